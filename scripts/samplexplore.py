@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
+import multiprocessing
+
 from samplexplore.__main__ import main
 
 
 if __name__ == "__main__":
+    # Metadata extraction runs in worker processes
+    multiprocessing.freeze_support()
     main()
@@ -1,3 +1,8 @@
+from .startup_timing import StartupTimer
+
+# Started before anything else is imported
+startup_timer = StartupTimer()
+
 import logging
 import threading
 
@@ -5,6 +10,7 @@ from qtpy.QtCore import *
 from qtpy.QtGui import *
 
 from .app import *
+from .waveform import WaveformCache
 
 
 log_proxy = None
@@ -71,11 +77,15 @@ class LogViewDialog(QDialog):
 
 
 def main():
+    startup_timer.mark('imports')
+
     app = QApplication(sys.argv)
 
     app.setOrganizationDomain("mwicat");
     app.setApplicationName("samplexplore");
 
+    startup_timer.mark('application')
+
     data_path = QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation)
     data_path_dir = QDir(data_path)
 
@@ -108,32 +118,52 @@ def main():
         "For details, visit menu Help -> Log viewer or quit and open log file at path '{}'".format(log_path)))
 
     logging.info("Application started")
-
-    console_locals = {}
-    console_locals.update(locals())
-    console_locals.update(globals())
-
-    console = PythonConsole(locals=console_locals)
-    console.eval_queued()
+    startup_timer.mark('logging')
 
     settings_manager = SettingsManager()
     settings_manager.read_settings()
+    startup_timer.mark('settings')
 
     db_path = data_path_dir.filePath("samplexplore.sqlite")
 
     db_manager = DBManager(log_proxy)
     db_manager.connect(db_path)
 
-    browser = Browser(settings_manager, db_manager, app=app, console=console, log_view_dlg=log_view_dlg)
+    waveform_cache = WaveformCache(data_path_dir.filePath("waveforms"))
+    startup_timer.mark('database')
+
+    # Python console is created when it is opened for the first time
+    console_locals = {}
+    console_locals.update(locals())
+    console_locals.update(globals())
+
+    browser = Browser(
+        settings_manager, db_manager, waveform_cache,
+        app=app, console_locals=console_locals, log_view_dlg=log_view_dlg)
+    startup_timer.mark('main window')
+
     browser.show()
+    startup_timer.mark('show')
+
+    def on_event_loop_started():
+        # Window has been painted and responds to input from now on
+        startup_timer.mark('first paint')
+        browser.finish_startup(startup_timer)
+        logging.info(startup_timer.report(interactive_phase='first paint'))
 
-    console.interpreter.locals['browser'] = browser
+    QTimer.singleShot(0, on_event_loop_started)
 
     retcode = app.exec_()
 
     logging.info("Shutting down database manager...")
     db_manager.shutdown()
 
+    logging.info("Shutting down waveform workers...")
+    waveform_cache.shutdown()
+
+    logging.info("Shutting down audio preview...")
+    browser.shutdown()
+
     logging.info("Application finished")
     sys.exit(retcode)
 
@@ -1,3 +1,5 @@
+from array import array
+import logging
 import os
 import math
 import sys
@@ -6,16 +8,21 @@ import pathlib
 from qtpy.QtCore import *
 from qtpy.QtGui import *
 from qtpy.QtWidgets import *
-from qtpy.QtMultimedia import QMediaContent, QMediaPlaylist, QMediaPlayer
-
-from pyqtconsole.console import PythonConsole
 
+from .audio_cache import DecodedAudioCache
 from .db_manager import DBManager
+from .db_core import STAGE_FEATURES, STAGE_HASH, STAGE_METADATA
+from .duplicates_dialog import DuplicatesDialog
+from .search_query import SEARCH_SYNTAX_HELP, SearchQueryError, parse_query
 
 from . import mediautils
 from . import fileutils
+from .fileutils import natural_sort_key
+from .index_model import IndexTreeModel
 from .media_slider import MediaSlider
-from . import rc_icons
+from .prefetch import DEFAULT_NUM_NEIGHBOURS, AudioPrefetcher
+from .preview_engine import STATE_PLAYING, PreviewEngine
+from .waveform_widget import WaveformWidget
 from .settings import SettingsManager
 
 
@@ -26,7 +33,11 @@ SUPPORTED_EXTENSIONS = [
     'flac',
 ]
 8
-PREVIEW_PLAY_LOCK_TIME = 200
+# Requests to play the file which started playing that many ms ago are ignored
+PREVIEW_REPLAY_GUARD_TIME = 200
+PREVIEW_POSITION_INTERVAL = 30
+# Superseded searches are interrupted, so it only saves starting them
+SEARCH_DEBOUNCE_TIME = 100
 
 WEBSITE_URL = 'https://github.com/mwicat/sample_explorer'
 
@@ -36,64 +47,191 @@ DB_PATH = '/tmp/samplesbdb.sqlite'
 INITIAL_SIZE = 1000, 600
 
 
-class SearchResultItemModel(QStandardItemModel):
+class SearchResultModel(QAbstractListModel):
+    """
+    Search results streamed from the database a page at a time.
+
+    Next page is requested when the view scrolls towards the end of rows
+    fetched so far, rows are kept as an array of file ids and their paths.
+
+    :param fetch_more: function taking SearchPage and callback to be called
+                       with the following SearchPage
+    """
+
+    FilenameRole = Qt.UserRole + 1
+
+    def __init__(self, fetch_more, parent=None):
+        super(SearchResultModel, self).__init__(parent)
+        self.fetch_more = fetch_more
+
+        self._ids = array('q')
+        self._paths = []
+        self._last_page = None
+        self._fetching = False
+
+    def set_first_page(self, page):
+        self.beginResetModel()
+        self._ids = array('q', (row[0] for row in page.rows))
+        self._paths = [row[2] for row in page.rows]
+        self._last_page = page
+        self._fetching = False
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self._ids = array('q')
+        self._paths = []
+        self._last_page = None
+        self._fetching = False
+        self.endResetModel()
+
+    def has_more(self):
+        return self._last_page is not None and self._last_page.has_more
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._fetching and self.has_more()
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._fetching = True
+        page = self._last_page
+        self.fetch_more(page, lambda next_page: self._on_page_fetched(page, next_page))
+
+    def _on_page_fetched(self, page, next_page):
+        # Model was reset while the page was being fetched
+        if page is not self._last_page:
+            return
+        self._fetching = False
+        self._last_page = next_page
+
+        if not next_page.rows:
+            return
+        start = len(self._ids)
+        self.beginInsertRows(QModelIndex(), start, start + len(next_page.rows) - 1)
+        self._ids.extend(row[0] for row in next_page.rows)
+        self._paths.extend(row[2] for row in next_page.rows)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._paths):
+            return None
+        full_path = self._paths[index.row()]
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return full_path
+        if role == self.FilenameRole:
+            return os.path.basename(full_path)
+        return None
+
+    def flags(self, index):
+        flags = super(SearchResultModel, self).flags(index)
+        if index.isValid():
+            flags |= Qt.ItemIsDragEnabled
+        return flags
 
     def mimeTypes(self):
         return ["text/uri-list"]
 
-    def mimeData( self, indexes):
+    def mimeData(self, indexes):
         mimedata = QMimeData()
         urls = []
         for index in indexes:
-            row = index.row()
-            full_path = index.sibling(row, 1).data()
-            urls.append(QUrl.fromLocalFile(full_path))
+            urls.append(QUrl.fromLocalFile(index.data()))
         mimedata.setUrls(urls)
         return mimedata
 
 
-class RenderTypeProxyModel(QSortFilterProxyModel):
-    def __init__(self):
-        super(RenderTypeProxyModel, self).__init__()
-
-    def filterAcceptsRow(self, row, parent):
-        fsmodel = self.sourceModel()
+# Sort groups of file system entries
+_SORT_PARENT = 0
+_SORT_DIR = 1
+_SORT_FILE = 2
 
-        index = fsmodel.index(row, 3, parent)
-        finfo = fsmodel.fileInfo(index)
 
-        if not finfo.isDir():
-            fn_base, fn_ext = os.path.splitext(finfo.fileName())
-            if fn_ext:
-                fn_ext = fn_ext[1:].lower()
-                return fn_ext in SUPPORTED_EXTENSIONS
-            return False
+class RenderTypeProxyModel(QSortFilterProxyModel):
+    """
+    Shows directories and supported audio files, directories first, in natural order.
 
-        return True
+    Classification of each entry is computed once and cached by its source
+    node until the file system model reports that the entry has changed or
+    is going away, so filtering and sorting of a big folder only compare
+    precomputed keys.
+    """
 
-    def lessThan(self, left, right):
+    def __init__(self, extensions=SUPPORTED_EXTENSIONS):
+        super(RenderTypeProxyModel, self).__init__()
+        self.extensions = frozenset(extensions)
+        # Internal id of source index -> (accepted, sort key)
+        self._entries = {}
+
+    def setSourceModel(self, model):
+        previous = self.sourceModel()
+        if previous is not None:
+            previous.dataChanged.disconnect(self._on_data_changed)
+            previous.rowsAboutToBeRemoved.disconnect(self._on_rows_about_to_be_removed)
+            previous.modelAboutToBeReset.disconnect(self._entries.clear)
+        self._entries.clear()
+
+        # Connected before handlers of base class, which may filter and sort again
+        model.dataChanged.connect(self._on_data_changed)
+        model.rowsAboutToBeRemoved.connect(self._on_rows_about_to_be_removed)
+        model.modelAboutToBeReset.connect(self._entries.clear)
+
+        super(RenderTypeProxyModel, self).setSourceModel(model)
+
+    def _forget_rows(self, parent, first, last):
         fsmodel = self.sourceModel()
+        for row in range(first, last + 1):
+            self._entries.pop(fsmodel.index(row, 0, parent).internalId(), None)
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        # Renamed file keeps its node
+        self._forget_rows(top_left.parent(), top_left.row(), bottom_right.row())
+
+    def _on_rows_about_to_be_removed(self, parent, first, last):
+        self._forget_rows(parent, first, last)
+
+    def _entry(self, index):
+        key = index.internalId()
+        entry = self._entries.get(key)
+        if entry is None:
+            fsmodel = self.sourceModel()
+            name = fsmodel.fileName(index)
+            if name == '..':
+                entry = True, (_SORT_PARENT,)
+            elif fsmodel.isDir(index):
+                entry = True, (_SORT_DIR, natural_sort_key(name))
+            else:
+                extension = os.path.splitext(name)[1][1:].lower()
+                entry = extension in self.extensions, (_SORT_FILE, natural_sort_key(name))
+            self._entries[key] = entry
+        return entry
 
-        info_left = fsmodel.fileInfo(left)
-        info_right = fsmodel.fileInfo(right)
-
-        if fsmodel.data(left) == "..":
-            return True
+    def filterAcceptsRow(self, row, parent):
+        return self._entry(self.sourceModel().index(row, 0, parent))[0]
 
-        if fsmodel.data(right) == "..":
-            return False
+    def lessThan(self, left, right):
+        if left.column() != 0:
+            return super(RenderTypeProxyModel, self).lessThan(left, right)
+        return self._entry(left)[1] < self._entry(right)[1]
 
-        if not info_left.isDir() and info_right.isDir():
-            return False
 
-        if info_left.isDir() and not info_right.isDir():
-            return True
+class Browser(QMainWindow):
+    """
+    Main window.
 
-        return super(RenderTypeProxyModel, self).lessThan(left, right)
+    Only what is needed to show the window is set up in constructor. Icons
+    and audio output are loaded by finish_startup() once the window is
+    shown, QtMultimedia and Python console on first use.
+    """
 
+    # Emitted from decoding thread with path and decoded audio, None if it cannot be played from memory
+    previewAudioLoaded = Signal(str, object)
 
-class Browser(QMainWindow):
-    def __init__(self, settings_manager, db_manager, parent=None, console=None, app=None, log_view_dlg=None):
+    def __init__(self, settings_manager, db_manager, waveform_cache, parent=None, console_locals=None, app=None,
+                 log_view_dlg=None):
         super(Browser, self).__init__(parent=parent)
 
         self.samples_directory = None
@@ -101,20 +239,51 @@ class Browser(QMainWindow):
         self.log_view_dlg = log_view_dlg
 
         self.db_manager = db_manager
+        self.db_manager.filesChanged.connect(self.on_files_changed)
 
         self.settings_manager = settings_manager
         self.settings_manager.samplesDirChanged.connect(self.on_samples_directory_changed)
 
-        self.play_locked = False
+        # File which started playing last and time since then
+        self.last_played_path = None
+        self.last_played_timer = QElapsedTimer()
         self.search_phrase = None
-
-        self.console = console
+        # Folder last search was restricted to, None for whole samples directory
+        self.search_directory = None
+
+        self.audio_cache = DecodedAudioCache(
+            max_bytes=self.settings_manager.preview_cache_mb * 1024 * 1024)
+        self.prefetcher = AudioPrefetcher(self.audio_cache)
+        # File being decoded to be played next
+        self.pending_preview_path = None
+        self.previewAudioLoaded.connect(self.on_preview_audio_loaded)
+
+        # Created by finish_startup(), None if audio output is unavailable
+        self.previewEngine = None
+        # Whether current file is played by preview engine rather than media player
+        self.preview_active = False
+
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setInterval(PREVIEW_POSITION_INTERVAL)
+        self.previewTimer.timeout.connect(self.update_preview_state)
+
+        # Created on first use
+        self.console = None
+        self.duplicatesDialog = None
+        self.console_locals = console_locals if console_locals is not None else {}
         self.app = app
 
         self.statusBar = QStatusBar()
         self.setStatusBar(self.statusBar)
 
-        self.setWindowIcon(QIcon(':headphones.svg'))
+        self.rebuildProgressBar = QProgressBar()
+        self.rebuildProgressBar.setMaximumWidth(200)
+        self.rebuildProgressBar.setVisible(False)
+        self.statusBar.addPermanentWidget(self.rebuildProgressBar)
+
+        self.db_manager.rebuildProgress.connect(self.on_rebuild_progress)
+
+        self.icons_loaded = False
 
         self._createActions()
         self._createMenuBar()
@@ -125,23 +294,22 @@ class Browser(QMainWindow):
 
         self.fsmodel = QFileSystemModel()
 
-        self.mediaPlayer = QMediaPlayer()
-        self.mediaPlayer.positionChanged.connect(self.media_position_changed)
-        self.mediaPlayer.durationChanged.connect(self.media_duration_changed)
-        self.mediaPlayer.stateChanged.connect(self.media_state_changed)
-        self.mediaPlayer.durationChanged.connect(self.media_duration_changed)
-        self.mediaPlayer.mediaChanged.connect(self.media_changed)
-
-        self.mediaPlaylist = QMediaPlaylist()
-        self.mediaPlayer.setPlaylist(self.mediaPlaylist)
+        # Fallback for files which preview engine cannot play, see media_player()
+        self.mediaPlayer = None
+        self.mediaPlaylist = None
 
         self.proxyModel = RenderTypeProxyModel()
         self.proxyModel.setSourceModel(self.fsmodel)
 
         self.proxyModel.sort(0)
 
+        self.indexModel = IndexTreeModel(self.db_manager.list_directory, parent=self)
+        self.indexModel.freshness_checker.staleDirectory.connect(self.on_index_directory_stale)
+        # Whether file view shows indexModel instead of file system
+        self.browse_from_index = settings_manager.browse_from_index
+
         self.file_view = QColumnView()
-        self.file_view.setModel(self.proxyModel)
+        self.file_view.setModel(self.indexModel if self.browse_from_index else self.proxyModel)
 
         self.file_view.setSelectionMode(QAbstractItemView.SingleSelection)
         self.file_view.setDragDropMode(QAbstractItemView.DragOnly)
@@ -159,6 +327,9 @@ class Browser(QMainWindow):
         self.media_slider.setRange(0, 0)
         self.media_slider.sliderMoved.connect(self.set_media_position)
 
+        self.waveformWidget = WaveformWidget(waveform_cache)
+        self.waveformWidget.seekRequested.connect(self.set_media_position)
+
         self.media_pane = QHBoxLayout()
         self.media_pane.setContentsMargins(0, 0, 0, 0)
 
@@ -176,7 +347,6 @@ class Browser(QMainWindow):
 
         self.loopBtn = QPushButton()
         self.loopBtn.setCheckable(True)
-        self.loopBtn.setIcon(QIcon(":repeat.svg"))
         self.loopBtn.toggled.connect(self.on_loop_toggled)
 
         self.media_pane.addWidget(self.loopBtn)
@@ -199,6 +369,7 @@ class Browser(QMainWindow):
 
         self.searchEdit = QLineEdit()
         self.searchEdit.setPlaceholderText("Search...")
+        self.searchEdit.setToolTip(SEARCH_SYNTAX_HELP)
         self.searchEdit.textChanged.connect(self.on_search_input)
         self.searchEdit.setMaximumWidth(250);
 
@@ -213,12 +384,26 @@ class Browser(QMainWindow):
 
         self.search_view.addWidget(self.searchEdit)
 
+        self.searchScopeCheckBox = QCheckBox("Search in current folder")
+        self.searchScopeCheckBox.setToolTip(
+            "Search only within folder selected in file view, or folder of selected file")
+        self.searchScopeCheckBox.toggled.connect(self.perform_search)
+        self.search_view.addWidget(self.searchScopeCheckBox)
+
+        self.hideDuplicatesCheckBox = QCheckBox("Hide duplicates")
+        self.hideDuplicatesCheckBox.setToolTip(
+            "Show only the first of files with the same contents.\n"
+            "Files are compared when duplicates were last looked for, see Tools menu.")
+        self.hideDuplicatesCheckBox.toggled.connect(self.perform_search)
+        self.search_view.addWidget(self.hideDuplicatesCheckBox)
+
         self.searchResultList = QListView()
         self.searchResultList.setEditTriggers(QAbstractItemView.NoEditTriggers)
 
-        self.searchResultModel = SearchResultItemModel()
+        self.searchResultModel = SearchResultModel(
+            lambda page, callback: self.db_manager.fetch_more(page, result_callback=callback))
 
-        self.searchResultList.setModelColumn(1)
+        self.searchResultList.setUniformItemSizes(True)
         self.searchResultList.setModel(self.searchResultModel)
         self.searchResultList.clicked.connect(self.search_result_clicked)
         self.searchResultList.selectionModel().selectionChanged.connect(self.search_result_selected)
@@ -235,17 +420,92 @@ class Browser(QMainWindow):
         grid.addLayout(self.search_view, 0, 0, 1, 1)
 
         grid.addWidget(self.file_view, 0, 1, 1, 3)
-        grid.addLayout(self.media_pane, 1, 0, 1, 4)
+        grid.addWidget(self.waveformWidget, 1, 0, 1, 4)
+        grid.addLayout(self.media_pane, 2, 0, 1, 4)
 
         self.main_panel = QWidget()
         self.main_panel.setLayout(grid)
         self.setCentralWidget(self.main_panel)
 
         if settings_manager.samples_directory is None:
+            self.load_icons()
             settings_manager.show_settings_dialog()
         else:
             self.set_samples_directory(settings_manager.samples_directory)
 
+        self.db_manager.resume_files_table(
+            result_callback=self.on_search_db_refreshed,
+            num_workers=self.settings_manager.scan_workers)
+
+    def finish_startup(self, startup_timer=None):
+        """
+        Load what is not needed for the first paint of the window.
+        """
+        self.load_icons()
+        if startup_timer is not None:
+            startup_timer.mark('icons')
+
+        self.previewEngine = self.create_preview_engine()
+        if startup_timer is not None:
+            startup_timer.mark('audio output')
+
+    def load_icons(self):
+        if self.icons_loaded:
+            return
+        # Registers resources on import
+        from . import rc_icons
+        self.icons_loaded = True
+
+        self.setWindowIcon(QIcon(':headphones.svg'))
+        self.settingsAction.setIcon(QIcon(":settings.svg"))
+        self.exitAction.setIcon(QIcon(":times.svg"))
+        self.openConsoleAction.setIcon(QIcon(":python.svg"))
+        self.openWebsiteAction.setIcon(QIcon(":globe.svg"))
+        self.showLogViewerAction.setIcon(QIcon(":book.svg"))
+        self.refreshDbAction.setIcon(QIcon(":arrows-round.svg"))
+        self.cancelRefreshDbAction.setIcon(QIcon(":times.svg"))
+        self.set_loop_icon(self.loopBtn.isChecked())
+
+    def create_preview_engine(self):
+        try:
+            from .preview_output_qt import create_output_backend
+            engine = PreviewEngine(create_output_backend())
+        except Exception as e:
+            logging.warning('Preview engine unavailable, using media player for all files: %s', e)
+            return None
+        engine.loop = self.loopBtn.isChecked()
+        return engine
+
+    def media_player(self):
+        """
+        Player for files which preview engine cannot play, QtMultimedia is loaded on first use.
+        """
+        if self.mediaPlayer is None:
+            from qtpy.QtMultimedia import QMediaPlayer, QMediaPlaylist
+
+            self.mediaPlayer = QMediaPlayer()
+            self.mediaPlayer.positionChanged.connect(self.media_position_changed)
+            self.mediaPlayer.durationChanged.connect(self.media_duration_changed)
+            self.mediaPlayer.stateChanged.connect(self.media_state_changed)
+            self.mediaPlayer.mediaChanged.connect(self.media_changed)
+
+            self.mediaPlaylist = QMediaPlaylist()
+            self.mediaPlayer.setPlaylist(self.mediaPlaylist)
+            self.set_media_loop(self.loopBtn.isChecked())
+        return self.mediaPlayer
+
+    def media_player_playing(self):
+        if self.mediaPlayer is None:
+            return False
+        from qtpy.QtMultimedia import QMediaPlayer
+        return self.mediaPlayer.state() == QMediaPlayer.State.PlayingState
+
+    def shutdown(self):
+        self.prefetcher.shutdown()
+        self.indexModel.shutdown()
+        if self.previewEngine is not None:
+            self.previewEngine.close()
+
     def show_status(self, text):
         self.statusBar.showMessage(text)
 
@@ -264,54 +524,221 @@ class Browser(QMainWindow):
 
     def refresh_db(self):
         self.show_status('Refreshing search database...')
-        self.db_manager.rebuild_files_table(
+        self.rebuildProgressBar.setRange(0, 0)
+        self.rebuildProgressBar.setVisible(True)
+        self.cancelRefreshDbAction.setEnabled(True)
+        self.db_manager.update_files_table(
             self.settings_manager.samples_directory,
-            result_callback=self.on_search_db_refreshed)
+            result_callback=self.on_search_db_refreshed,
+            num_workers=self.settings_manager.scan_workers)
+
+    def cancel_refresh_db(self):
+        self.show_status('Cancelling refresh of search database...')
+        self.db_manager.cancel_rebuild()
+
+    def on_rebuild_progress(self, progress_info):
+        self.rebuildProgressBar.setVisible(True)
+        self.cancelRefreshDbAction.setEnabled(True)
+
+        fraction = progress_info.fraction
+        if fraction is None:
+            self.rebuildProgressBar.setRange(0, 0)
+        else:
+            self.rebuildProgressBar.setRange(0, 1000)
+            self.rebuildProgressBar.setValue(int(fraction * 1000))
+
+        if progress_info.eta is not None:
+            eta = mediautils.media_time_to_str(progress_info.eta * 1000)
+        else:
+            eta = '--:--'
+
+        if progress_info.stage == STAGE_HASH:
+            self.show_status(
+                'Comparing contents of files: {} of {} files (ETA {})'.format(
+                    progress_info.num_files_done,
+                    progress_info.num_files_expected,
+                    eta))
+            return
+
+        if progress_info.stage == STAGE_FEATURES:
+            self.show_status(
+                'Analysing sound: {} of {} files ({:.0f} files/s, ETA {})'.format(
+                    progress_info.num_files_done,
+                    progress_info.num_files_expected,
+                    progress_info.files_per_sec,
+                    eta))
+            return
+
+        if progress_info.stage == STAGE_METADATA:
+            self.show_status(
+                'Reading audio metadata: {} of {} files ({:.0f} files/s, ETA {})'.format(
+                    progress_info.num_files_done,
+                    progress_info.num_files_expected,
+                    progress_info.files_per_sec,
+                    eta))
+            return
+
+        self.show_status(
+            'Indexing: {} files, {} directories scanned ({:.0f} files/s, ETA {}) - {}'.format(
+                progress_info.num_files_total,
+                progress_info.num_dirs_total,
+                progress_info.files_per_sec,
+                eta,
+                progress_info.current_dir))
+
+    def on_search_db_refreshed(self, completed):
+        self.rebuildProgressBar.setVisible(False)
+        self.cancelRefreshDbAction.setEnabled(False)
+
+        if completed is None:
+            return
+        if not completed:
+            self.show_status('Refresh of search database cancelled, it will be resumed on next start')
+            return
 
-    def on_search_db_refreshed(self):
         self.show_status('Completed refresh of search database!')
+        if self.browse_from_index:
+            self.indexModel.refresh_all()
         self.perform_search()
 
+    def on_files_changed(self, paths):
+        self.show_status('Search database updated with changes in {} directories'.format(len(paths)))
+        if self.browse_from_index:
+            self.indexModel.refresh_all()
+
+    def on_index_directory_stale(self, path):
+        # Shown listing is updated by on_files_changed() once the directory is stored again
+        if self.samples_directory is not None:
+            self.db_manager.apply_directory_changes(
+                self.samples_directory,
+                [path],
+                result_callback=self.on_files_changed,
+                num_workers=self.settings_manager.scan_workers)
+
+    def find_duplicates(self):
+        self.show_status('Looking for duplicate files...')
+        self.rebuildProgressBar.setRange(0, 0)
+        self.rebuildProgressBar.setVisible(True)
+        self.cancelRefreshDbAction.setEnabled(True)
+        self.db_manager.find_duplicates(result_callback=self.on_duplicates_found)
+
+    def on_duplicates_found(self, groups):
+        self.rebuildProgressBar.setVisible(False)
+        self.cancelRefreshDbAction.setEnabled(False)
+
+        if groups is None:
+            self.show_status('Looking for duplicate files cancelled, compared files will not be read again')
+            return
+
+        self.show_status('Found {} files with copies'.format(len(groups)))
+        if self.duplicatesDialog is None:
+            self.duplicatesDialog = DuplicatesDialog(self)
+            self.duplicatesDialog.fileActivated.connect(self.on_duplicate_activated)
+        self.duplicatesDialog.set_groups(groups)
+        self.duplicatesDialog.show()
+        self.duplicatesDialog.raise_()
+        # Results may collapse differently now
+        if self.hideDuplicatesCheckBox.isChecked():
+            self.perform_search()
+
+    def on_duplicate_activated(self, path):
+        self.select_path(path)
+        self.play_file(path)
+
     def set_samples_directory(self, path):
         self.samples_directory = path
-        self.fsmodel.setRootPath('/')
-        og_index = self.fsmodel.index(self.samples_directory)
-        root_index = self.proxyModel.mapFromSource(og_index)
-        self.file_view.setRootIndex(root_index)
+        if self.browse_from_index:
+            self.indexModel.set_root_path(path)
+        else:
+            self.fsmodel.setRootPath('/')
+        self.file_view.setRootIndex(self.file_view_index(self.samples_directory))
+        self.update_watcher()
+
+    def set_browse_from_index(self, enabled):
+        self.browse_from_index = enabled
+        self.file_view.setModel(self.indexModel if enabled else self.proxyModel)
+        # View creates new selection model for each model
+        self.file_view.selectionModel().selectionChanged.connect(self.on_files_selected)
+        if self.samples_directory is not None:
+            self.set_samples_directory(self.samples_directory)
+
+    def file_view_index(self, path) -> QModelIndex:
+        if self.browse_from_index:
+            return self.indexModel.index_for_path(path)
+        return self.proxyModel.mapFromSource(self.fsmodel.index(path))
+
+    def file_view_path(self, index: QModelIndex) -> str:
+        if self.browse_from_index:
+            return self.indexModel.file_path(index)
+        return self.fsmodel.filePath(self.proxyModel.mapToSource(index))
+
+    def file_view_is_dir(self, index: QModelIndex) -> bool:
+        if self.browse_from_index:
+            return self.indexModel.is_dir(index)
+        return self.fsmodel.isDir(self.proxyModel.mapToSource(index))
+
+    def update_watcher(self):
+        if self.samples_directory is not None and self.settings_manager.watch_samples_directory:
+            self.db_manager.start_watcher(
+                self.samples_directory,
+                num_workers=self.settings_manager.scan_workers)
+        else:
+            self.db_manager.stop_watcher()
 
     def refresh_file_view(self):
         self.file_view.reset()
-        og_index = self.fsmodel.index(self.samples_directory)
-        root_index = self.proxyModel.mapFromSource(og_index)
-        self.file_view.setRootIndex(root_index)
+        self.file_view.setRootIndex(self.file_view_index(self.samples_directory))
 
     def _createActions(self):
-        self.settingsAction = QAction(QIcon(":settings.svg"), "Se&ttings", self)
+        # Icons are set by load_icons()
+        self.settingsAction = QAction("Se&ttings", self)
         self.settingsAction.triggered.connect(self.open_settings)
 
-        self.exitAction = QAction(QIcon(":times.svg"), "E&xit", self)
+        self.exitAction = QAction("E&xit", self)
         self.exitAction.triggered.connect(self.app.quit)
 
-        self.openConsoleAction = QAction(QIcon(":python.svg"), "&Python console", self)
+        self.openConsoleAction = QAction("&Python console", self)
         self.openConsoleAction.triggered.connect(self.open_console)
 
-        self.openWebsiteAction = QAction(QIcon(":globe.svg"), "Open &website", self)
+        self.openWebsiteAction = QAction("Open &website", self)
         self.openWebsiteAction.triggered.connect(lambda: QDesktopServices.openUrl(QUrl(WEBSITE_URL)))
 
-        self.showLogViewerAction = QAction(QIcon(":book.svg"), "&Log viewer", self)
+        self.showLogViewerAction = QAction("&Log viewer", self)
         self.showLogViewerAction.triggered.connect(self.log_view_dlg.show)
 
-        self.refreshDbAction = QAction(QIcon(":arrows-round.svg"), "&Refresh search database", self)
+        self.refreshDbAction = QAction("&Refresh search database", self)
         self.refreshDbAction.triggered.connect(self.refresh_db)
 
+        self.cancelRefreshDbAction = QAction("&Cancel refresh of search database", self)
+        self.cancelRefreshDbAction.setEnabled(False)
+        self.cancelRefreshDbAction.triggered.connect(self.cancel_refresh_db)
+
+        self.findDuplicatesAction = QAction("Find &duplicate files", self)
+        self.findDuplicatesAction.triggered.connect(self.find_duplicates)
+
+        self.previewCacheStatsAction = QAction("Preview cache &statistics", self)
+        self.previewCacheStatsAction.triggered.connect(self.show_preview_cache_stats)
+
     def open_settings(self):
         self.settings_manager.show_settings_dialog()
+        self.update_watcher()
+        if self.settings_manager.browse_from_index != self.browse_from_index:
+            self.set_browse_from_index(self.settings_manager.browse_from_index)
+        self.audio_cache.max_bytes = self.settings_manager.preview_cache_mb * 1024 * 1024
+
+    def show_preview_cache_stats(self):
+        self.show_status("Preview cache: {}".format(self.audio_cache.stats()))
 
     def toggle_window_on_top(self):
         # self.setWindowFlags(self.windowFlags() & ~Qt.WindowStaysOnTopHint)
         pass
 
     def open_console(self):
+        if self.console is None:
+            from pyqtconsole.console import PythonConsole
+            self.console_locals.setdefault('browser', self)
+            self.console = PythonConsole(locals=self.console_locals)
+            self.console.eval_queued()
         self.console.show()
 
     def _createMenuBar(self):
@@ -325,6 +752,8 @@ class Browser(QMainWindow):
 
         toolsMenu = QMenu("&Tools", self)
         toolsMenu.addAction(self.openConsoleAction)
+        toolsMenu.addAction(self.findDuplicatesAction)
+        toolsMenu.addAction(self.previewCacheStatsAction)
         menuBar.addMenu(toolsMenu)
 
         helpMenu = QMenu("&Help", self)
@@ -338,6 +767,7 @@ class Browser(QMainWindow):
         fileToolBar.setMovable(False)
 
         fileToolBar.addAction(self.refreshDbAction)
+        fileToolBar.addAction(self.cancelRefreshDbAction)
         fileToolBar.addAction(self.settingsAction)
         # fileToolBar.addAction(self.toggleOnTop)
 
@@ -346,10 +776,7 @@ class Browser(QMainWindow):
         self.searchEdit.selectAll()
 
     def search_result_clicked(self, index):
-        row = index.row()
-
-        fn = index.sibling(row, 0).data()
-        full_path = index.sibling(row, 1).data()
+        full_path = index.data()
 
         self.select_path(full_path)
         self.play_file(full_path)
@@ -359,145 +786,315 @@ class Browser(QMainWindow):
         if not indexes:
             return
         index = indexes[0]
-        row = index.row()
-
-        fn = index.sibling(row, 0).data()
-        full_path = index.sibling(row, 1).data()
+        full_path = index.data()
 
         self.select_path(full_path)
         self.play_file(full_path)
 
-    def on_search_results(self, results):
-        for result in results:
-            self.searchResultModel.appendRow([
-                QStandardItem(result['filename']),
-                QStandardItem(result['full_path']),
-            ])
+    def on_search_results(self, page):
+        self.searchResultModel.set_first_page(page)
+        count = self.searchResultModel.rowCount()
+        status = "Found {}{} files".format(count, '+' if page.has_more else '')
+        if self.search_directory is not None:
+            status += " in {}".format(os.path.basename(self.search_directory))
+        self.show_status(status)
+
+    def current_folder(self):
+        """
+        Folder selected in file view or the one containing selected file,
+        samples directory if nothing is selected.
+        """
+        index = self.get_selected_index()
+        if index is None:
+            return self.samples_directory
+        path = self.file_view_path(index)
+        if self.file_view_is_dir(index):
+            return path
+        return os.path.dirname(path)
 
     def perform_search(self):
         self.searchResultModel.clear()
 
-        if not self.search_phrase:
+        try:
+            query = parse_query(self.search_phrase or '')
+        except SearchQueryError as e:
+            self.db_manager.cancel_search()
+            self.show_status(str(e))
+            return
+
+        if query.is_empty:
+            self.db_manager.cancel_search()
             return
 
+        self.search_directory = None
+        if self.searchScopeCheckBox.isChecked():
+            folder = self.current_folder()
+            # Whole samples directory is searched faster without restriction
+            if folder is not None and (self.samples_directory is None or
+                                       os.path.normpath(folder) != os.path.normpath(self.samples_directory)):
+                self.search_directory = os.path.normpath(folder)
+        query.directory = self.search_directory
+        query.collapse_duplicates = self.hideDuplicatesCheckBox.isChecked()
+
         self.db_manager.search_file(
-            self.search_phrase, result_callback=self.on_search_results)
+            query, result_callback=self.on_search_results)
 
     def on_search_input(self, search_phrase):
         self.search_phrase = search_phrase
-        self.searchTypeTimer.start(500)
+        self.searchTypeTimer.start(SEARCH_DEBOUNCE_TIME)
 
     def select_path(self, path):
-        idx = self.fsmodel.index(path)
-        file_view_idx = self.proxyModel.mapFromSource(idx)
+        file_view_idx = self.file_view_index(path)
 
         self.refresh_file_view()
 
         self.file_view.setCurrentIndex(file_view_idx)
 
     def on_play_clicked(self):
-        if self.mediaPlayer.state() == QMediaPlayer.State.PlayingState:
+        if self.preview_active:
+            if self.previewEngine.state == STATE_PLAYING:
+                self.previewEngine.pause()
+            else:
+                self.previewEngine.resume()
+            self.update_preview_state()
+        elif self.mediaPlayer is None:
+            return
+        elif self.media_player_playing():
             self.mediaPlayer.pause()
         else:
             self.mediaPlayer.play()
 
     def on_stop_clicked(self):
-        if self.mediaPlayer.state() != QMediaPlayer.State.StoppedState:
+        self.pending_preview_path = None
+        if self.previewEngine is not None:
+            self.previewEngine.stop()
+            self.update_preview_state()
+        if self.mediaPlayer is not None:
             self.mediaPlayer.stop()
 
+    def pause_playback(self):
+        if self.preview_active:
+            self.previewEngine.pause()
+            self.update_preview_state()
+        elif self.mediaPlayer is not None:
+            self.mediaPlayer.pause()
+
     def on_loop_shortcut(self):
         self.loopBtn.toggle()
 
     def on_loop_toggled(self, checked):
-        if checked:
+        if self.previewEngine is not None:
+            self.previewEngine.loop = checked
+        if self.mediaPlaylist is not None:
+            self.set_media_loop(checked)
+        self.set_loop_icon(checked)
+
+    def set_media_loop(self, loop):
+        from qtpy.QtMultimedia import QMediaPlaylist
+        if loop:
             self.mediaPlaylist.setPlaybackMode(QMediaPlaylist.Loop)
-            self.loopBtn.setIcon(QIcon(":repeat-on.svg"))
         else:
             self.mediaPlaylist.setPlaybackMode(QMediaPlaylist.CurrentItemOnce)
-            self.loopBtn.setIcon(QIcon(":repeat.svg"))
 
-    def media_state_changed(self, state: QMediaPlayer.State):
-        if state == QMediaPlayer.State.PlayingState:
+    def set_loop_icon(self, loop):
+        if self.icons_loaded:
+            self.loopBtn.setIcon(QIcon(":repeat-on.svg" if loop else ":repeat.svg"))
+
+    def set_play_icon(self, playing):
+        if playing:
             self.playBtn.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
         else:
             self.playBtn.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
 
-    def get_selected_fileinfo(self) -> QFileInfo:
+    def media_state_changed(self, state):
+        if not self.preview_active:
+            self.set_play_icon(self.media_player_playing())
+
+    def update_preview_state(self):
+        if not self.preview_active:
+            self.previewTimer.stop()
+            return
+
+        state = self.previewEngine.state
+        self.set_play_icon(state == STATE_PLAYING)
+        self.media_position_changed(self.previewEngine.position_ms())
+
+        if state == STATE_PLAYING:
+            self.previewTimer.start()
+        else:
+            self.previewTimer.stop()
+
+    def get_selected_index(self) -> QModelIndex:
         indexes = self.file_view.selectedIndexes()
 
         if not indexes:
             return
-        index = self.file_view.selectedIndexes()[0]
-        finfo = self.fsmodel.fileInfo(self.proxyModel.mapToSource(index))
-        return finfo
+        return indexes[0]
 
     def on_file_view_clicked(self):
-        finfo = self.get_selected_fileinfo()
+        index = self.get_selected_index()
 
-        if finfo is None or finfo.isDir():
+        if index is None or self.file_view_is_dir(index):
             return
 
-        self.play_file(finfo.filePath())
+        self.play_file(self.file_view_path(index))
 
     def on_files_selected(self, selected: QItemSelection, deselected: QItemSelection):
         indexes = selected.indexes()
         if not indexes:
             return
         index = indexes[0]
-        full_path = self.fsmodel.filePath(self.proxyModel.mapToSource(index))
-        finfo = self.fsmodel.fileInfo(self.proxyModel.mapToSource(index))
 
-        if finfo.isDir():
-            self.mediaPlayer.stop()
+        if self.file_view_is_dir(index):
+            self.prefetcher.cancel()
+            self.on_stop_clicked()
         else:
-            self.play_file(full_path)
-
-    def unlock_play(self):
-        self.play_locked = False
+            self.play_file(self.file_view_path(index))
+            self.prefetch_neighbours(index)
+
+    def prefetch_neighbours(self, index: QModelIndex, count=DEFAULT_NUM_NEIGHBOURS):
+        """
+        Decode files around index in the view order, nearest first.
+        """
+        model = self.file_view.model()
+        parent = index.parent()
+        row_count = model.rowCount(parent)
+
+        def neighbour_files(step):
+            paths = []
+            row = index.row() + step
+            while 0 <= row < row_count and len(paths) < count:
+                neighbour = model.index(row, 0, parent)
+                if not self.file_view_is_dir(neighbour):
+                    paths.append(self.file_view_path(neighbour))
+                row += step
+            return paths
+
+        following = neighbour_files(1)
+        preceding = neighbour_files(-1)
+
+        paths = []
+        for i in range(count):
+            paths.extend(side[i] for side in (following, preceding) if i < len(side))
+        self.prefetcher.prefetch(paths)
 
     def play_file(self, path):
-        if self.play_locked:
+        # Selecting a file with mouse also reports a click, and selecting a
+        # search result selects the file in file view too, play it only once.
+        # Other files always play, so the last one selected is never dropped.
+        if (path == self.last_played_path
+                and self.last_played_timer.elapsed() < PREVIEW_REPLAY_GUARD_TIME):
             return
+        self.last_played_path = path
+        self.last_played_timer.start()
 
-        self.play_locked = True
-        QTimer.singleShot(PREVIEW_PLAY_LOCK_TIME, self.unlock_play)
+        self.pending_preview_path = None
+        if self.previewEngine is None:
+            self.play_with_media_player(path)
+            return
+
+        audio = self.audio_cache.get_cached(path)
+        if audio is not None:
+            self.play_preview(path, audio)
+            return
 
-        self.mediaPlayer.stop()
+        # Decoding may take a while, do not freeze the window meanwhile
+        self.pending_preview_path = path
+        self.prefetcher.load(path, self.previewAudioLoaded.emit)
+
+    def on_preview_audio_loaded(self, path, audio):
+        if path != self.pending_preview_path:
+            return
+        self.pending_preview_path = None
+
+        if audio is not None:
+            self.play_preview(path, audio)
+        else:
+            # Let the media player try formats we cannot decode ourselves
+            self.play_with_media_player(path)
+
+    def play_preview(self, path, audio):
+        if self.mediaPlayer is not None:
+            self.mediaPlayer.stop()
+        self.preview_active = True
+        self.previewEngine.play(audio)
+
+        self.waveformWidget.set_file(path)
+        self.statusBar.showMessage(path)
+        self.media_duration_changed(self.previewEngine.duration_ms())
+        self.update_preview_state()
+
+    def play_with_media_player(self, path):
+        if self.previewEngine is not None:
+            self.previewEngine.stop()
+        self.preview_active = False
+        self.previewTimer.stop()
+
+        from qtpy.QtMultimedia import QMediaContent
+
+        player = self.media_player()
+        player.stop()
+
+        self.waveformWidget.set_file(path)
 
         self.mediaPlaylist.clear()
         self.mediaPlaylist.addMedia(QMediaContent(QUrl.fromLocalFile(path)))
 
-        self.mediaPlayer.play()
+        player.play()
 
-    def media_changed(self, media: QMediaContent):
+    def media_changed(self, media):
         filepath = media.request().url().toLocalFile()
         self.statusBar.showMessage("{}".format(filepath))
 
     def media_position_changed(self, position):
         self.positionLabel.setText(mediautils.media_time_to_str(position))
         self.media_slider.setValue(position)
+        self.waveformWidget.set_position(position)
 
     def media_duration_changed(self, duration):
         self.durationLabel.setText(mediautils.media_time_to_str(duration))
         self.media_slider.setRange(0, duration)
 
     def set_media_position(self, position):
-        self.mediaPlayer.setPosition(position)
+        if self.preview_active:
+            self.previewEngine.seek_ms(position)
+            self.update_preview_state()
+        elif self.mediaPlayer is not None:
+            self.mediaPlayer.setPosition(position)
 
     def open_file_menu(self, position):
         menu = QMenu()
 
         open_parent_action = menu.addAction("Show in file browser")
         open_action = menu.addAction("Open with default application")
+        similar_action = None
+        index = self.get_selected_index()
+        if index is not None and not self.file_view_is_dir(index):
+            similar_action = menu.addAction("Find similar sounds")
 
         action = menu.exec_(self.file_view.mapToGlobal(position))
-        finfo = self.get_selected_fileinfo()
-        path = pathlib.Path(finfo.absoluteFilePath())
+        path = pathlib.Path(self.file_view_path(self.get_selected_index()))
 
         if action == open_action:
-            self.mediaPlayer.pause()
+            self.pause_playback()
             fileutils.open_file(path)
         elif action == open_parent_action:
             fileutils.open_file_parent(path)
+        elif action is not None and action == similar_action:
+            self.find_similar(str(path))
+
+    def find_similar(self, path):
+        self.show_status('Looking for sounds similar to {}'.format(os.path.basename(path)))
+        self.db_manager.find_similar(
+            path,
+            result_callback=lambda page: self.on_similar_found(path, page))
+
+    def on_similar_found(self, path, page):
+        if not page.rows:
+            self.show_status('Sound of {} was not analysed, refresh database to analyse new files'.format(
+                os.path.basename(path)))
+            return
+        self.searchResultModel.set_first_page(page)
+        self.show_status('Found {} files similar to {}'.format(len(page.rows), os.path.basename(path)))
 
 
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+import os
+import threading
+from typing import Optional
+
+from .audio_decode import AudioDecodeError, DecodedAudio, decode_file
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Longer files are streamed by the player instead of being decoded up front
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024
+# Files which could not be decoded are remembered, so that they are not read again
+MAX_FAILURES = 1024
+
+
+@dataclass
+class AudioCacheStats(object):
+    hits: int = 0
+    misses: int = 0
+    # Files too big to be cached
+    bypasses: int = 0
+    evictions: int = 0
+    # Files decoded ahead of being played
+    prefetches: int = 0
+    num_entries: int = 0
+    num_bytes: int = 0
+    max_bytes: int = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return ('{} hits, {} misses ({:.0%} hit ratio), {} prefetched, {} evictions, '
+                '{} files using {:.1f} of {:.0f} MB').format(
+            self.hits, self.misses, self.hit_ratio, self.prefetches, self.evictions, self.num_entries,
+            self.num_bytes / 2 ** 20, self.max_bytes / 2 ** 20)
+
+
+class DecodedAudioCache(object):
+    """
+    Least recently used decoded audio files, limited by total size of samples.
+
+    Entries are keyed by path, modification time and size, so a modified
+    file is decoded again. Safe to use from multiple threads, decoding
+    happens outside of the lock and a file requested while another thread
+    decodes it is not decoded twice.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_file_size=DEFAULT_MAX_FILE_SIZE):
+        self._max_bytes = max_bytes
+        self.max_file_size = max_file_size
+
+        self._entries = OrderedDict()
+        # Decode error messages of files which could not be decoded
+        self._failures = OrderedDict()
+        self._loading = {}
+        self._stats = AudioCacheStats(max_bytes=max_bytes)
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._stats.max_bytes = max_bytes
+            self._evict()
+
+    @staticmethod
+    def _key(path, st: os.stat_result):
+        return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+    def _evict(self):
+        while self._stats.num_bytes > self._max_bytes and self._entries:
+            key, audio = self._entries.popitem(last=False)
+            self._stats.num_bytes -= audio.nbytes
+            self._stats.evictions += 1
+        self._stats.num_entries = len(self._entries)
+
+    def peek(self, path) -> Optional[DecodedAudio]:
+        """
+        Get cached audio without decoding it or affecting statistics.
+        """
+        try:
+            key = self._key(path, os.stat(path))
+        except OSError:
+            return None
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, path, audio: DecodedAudio, st: Optional[os.stat_result] = None):
+        key = self._key(path, st if st is not None else os.stat(path))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            if audio.nbytes > self._max_bytes:
+                return
+            self._entries[key] = audio
+            self._stats.num_bytes += audio.nbytes
+            self._evict()
+
+    def get_cached(self, path) -> Optional[DecodedAudio]:
+        """
+        Get cached audio without decoding it, meant for thread which must not block.
+
+        Hits are counted, while on miss the file is expected to be requested with get().
+        """
+        try:
+            key = self._key(path, os.stat(path))
+        except OSError:
+            return None
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+            return audio
+
+    def get(self, path, prefetch=False) -> Optional[DecodedAudio]:
+        """
+        Get decoded audio file, decoding it on miss.
+
+        Waiting for a file which is being decoded by another thread counts as a hit.
+
+        :param prefetch: whether file is loaded ahead of being played,
+                         such lookups do not count as hits or misses
+        :return: decoded audio or None if file is too big to be cached
+        :raises AudioDecodeError: if file could not be decoded
+        :raises OSError: if file could not be read
+        """
+        st = os.stat(path)
+        key = self._key(path, st)
+
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                if not prefetch:
+                    self._stats.hits += 1
+                return audio
+
+            if st.st_size > self.max_file_size:
+                if not prefetch:
+                    self._stats.bypasses += 1
+                return None
+
+            error = self._failures.get(key)
+            if error is not None:
+                self._failures.move_to_end(key)
+                raise AudioDecodeError(error)
+
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = Future()
+                if prefetch:
+                    self._stats.prefetches += 1
+                else:
+                    self._stats.misses += 1
+            elif not prefetch:
+                self._stats.hits += 1
+
+        if not owner:
+            return loading.result()
+
+        try:
+            audio = decode_file(path)
+            self.put(path, audio, st)
+            loading.set_result(audio)
+        except AudioDecodeError as e:
+            with self._lock:
+                self._failures[key] = str(e)
+                if len(self._failures) > MAX_FAILURES:
+                    self._failures.popitem(last=False)
+            loading.set_exception(e)
+            raise
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+        return audio
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._failures.clear()
+            self._stats.num_bytes = 0
+            self._stats.num_entries = 0
+
+    def stats(self) -> AudioCacheStats:
+        with self._lock:
+            return AudioCacheStats(**vars(self._stats))
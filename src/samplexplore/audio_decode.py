@@ -0,0 +1,217 @@
+from dataclasses import dataclass
+import logging
+import os
+import struct
+
+import numpy as np
+
+from .audio_metadata import (
+    MAX_HEADER_SCAN, WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_PCM, _parse_extended, _read_chunks)
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+
+# Extensions of files which could not be decoded for lack of soundfile, logged once per process
+_undecodable_extensions = set()
+
+
+@dataclass
+class DecodedAudio(object):
+    # float32 array of shape (frames, channels) in range -1..1
+    samples: np.ndarray
+    sample_rate: int
+
+    @property
+    def num_frames(self):
+        return self.samples.shape[0]
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def duration(self):
+        return self.num_frames / self.sample_rate if self.sample_rate else 0.0
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def _pcm_to_float(data, channels, bit_depth, endian, is_float=False, unsigned_8bit=True):
+    """
+    Convert interleaved PCM bytes to float32 array of shape (frames, channels).
+    """
+    sample_size = (bit_depth + 7) // 8
+    frame_size = sample_size * channels
+    data = data[:len(data) - len(data) % frame_size]
+
+    if is_float:
+        if sample_size not in (4, 8):
+            raise AudioDecodeError('Unsupported float sample size: {}'.format(sample_size))
+        samples = np.frombuffer(data, dtype='{}f{}'.format(endian, sample_size)).astype(np.float32)
+    elif sample_size == 1:
+        if unsigned_8bit:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        else:
+            samples = np.frombuffer(data, dtype=np.int8).astype(np.float32) / 128
+    elif sample_size == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        if endian == '>':
+            raw = raw[:, ::-1]
+        # Place 24 bits in the top of int32 so that sign is preserved
+        samples = ((raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)).astype(np.float32) / 2 ** 31
+    elif sample_size in (2, 4):
+        ints = np.frombuffer(data, dtype='{}i{}'.format(endian, sample_size))
+        samples = ints.astype(np.float32) / 2 ** (sample_size * 8 - 1)
+    else:
+        raise AudioDecodeError('Unsupported sample size: {}'.format(sample_size))
+
+    return samples.reshape(-1, channels)
+
+
+def _limit_size(data_size, frame_size, sample_rate, max_duration):
+    if max_duration is None or not frame_size:
+        return data_size
+    return min(data_size, int(max_duration * sample_rate) * frame_size)
+
+
+def _decode_wav(f, file_size, max_duration=None):
+    riff_id = f.read(12)
+    endian = '>' if riff_id[:4] == b'RIFX' else '<'
+
+    fmt = None
+    ds64_data_size = None
+    data_offset = data_size = None
+
+    for chunk_id, chunk_size, offset in _read_chunks(f, endian, file_size):
+        if chunk_id == b'ds64':
+            riff_size, ds64_data_size = struct.unpack(endian + 'QQ', f.read(16))
+        elif chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 40))
+        elif chunk_id == b'data':
+            data_size = ds64_data_size if chunk_size == 0xFFFFFFFF and ds64_data_size else chunk_size
+            data_offset = offset
+            break
+        if offset > MAX_HEADER_SCAN:
+            break
+
+    if fmt is None or len(fmt) < 16 or data_offset is None:
+        raise AudioDecodeError('Missing format or data chunk')
+
+    format_tag, channels, sample_rate, byte_rate, block_align, bit_depth = struct.unpack(
+        endian + 'HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag, = struct.unpack(endian + 'H', fmt[24:26])
+
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or not channels:
+        raise AudioDecodeError('Unsupported WAV format: 0x{:04x}'.format(format_tag))
+
+    # Container bit depth, extensible files may carry fewer valid bits
+    bit_depth = block_align * 8 // channels if block_align else bit_depth
+
+    f.seek(data_offset)
+    data_size = _limit_size(data_size, block_align or channels * ((bit_depth + 7) // 8), sample_rate, max_duration)
+    data = f.read(min(data_size, file_size - data_offset))
+    return DecodedAudio(
+        _pcm_to_float(data, channels, bit_depth, endian, is_float=format_tag == WAVE_FORMAT_IEEE_FLOAT),
+        sample_rate)
+
+
+def _decode_aiff(f, file_size, max_duration=None):
+    form = f.read(12)
+    is_aifc = form[8:12] == b'AIFC'
+
+    comm = None
+    data_offset = data_size = None
+
+    for chunk_id, chunk_size, offset in _read_chunks(f, '>', file_size):
+        if chunk_id == b'COMM':
+            comm = f.read(min(chunk_size, 22))
+        elif chunk_id == b'SSND':
+            ssnd_offset, block_size = struct.unpack('>II', f.read(8))
+            data_offset = offset + 8 + ssnd_offset
+            data_size = chunk_size - 8 - ssnd_offset
+        if comm is not None and data_offset is not None:
+            break
+        if offset > MAX_HEADER_SCAN:
+            break
+
+    if comm is None or len(comm) < 18 or data_offset is None:
+        raise AudioDecodeError('Missing COMM or SSND chunk')
+
+    channels, num_frames, bit_depth = struct.unpack('>hIh', comm[:8])
+    sample_rate = int(round(_parse_extended(comm[8:18])))
+
+    endian = '>'
+    is_float = False
+    if is_aifc and len(comm) >= 22:
+        compression = comm[18:22]
+        if compression == b'sowt':
+            endian = '<'
+        elif compression in (b'fl32', b'FL32', b'fl64', b'FL64'):
+            is_float = True
+        elif compression != b'NONE':
+            raise AudioDecodeError('Unsupported AIFC compression: {}'.format(compression))
+
+    if channels <= 0:
+        raise AudioDecodeError('Invalid channel count')
+
+    f.seek(data_offset)
+    data_size = _limit_size(data_size, channels * ((bit_depth + 7) // 8), sample_rate, max_duration)
+    data = f.read(max(0, min(data_size, file_size - data_offset)))
+    samples = _pcm_to_float(data, channels, bit_depth, endian, is_float=is_float, unsigned_8bit=False)
+    return DecodedAudio(samples[:num_frames], sample_rate)
+
+
+def _decode_soundfile(path, max_duration=None):
+    if soundfile is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in _undecodable_extensions:
+            _undecodable_extensions.add(extension)
+            logging.warning('Skipping %s files, decoding them requires soundfile package', extension)
+        raise AudioDecodeError('Decoding this format requires soundfile package')
+    try:
+        with soundfile.SoundFile(path) as sf:
+            frames = -1 if max_duration is None else int(max_duration * sf.samplerate)
+            samples = sf.read(frames, dtype='float32', always_2d=True)
+            sample_rate = sf.samplerate
+    except RuntimeError as e:
+        raise AudioDecodeError(str(e))
+    return DecodedAudio(samples, sample_rate)
+
+
+def decode_file(path, max_duration=None) -> DecodedAudio:
+    """
+    Decode audio file to float samples.
+
+    Uncompressed WAV and AIFF files are read directly, other formats
+    through soundfile package.
+
+    :param max_duration: seconds to decode from the start, whole file if None
+
+    :raises AudioDecodeError: if file could not be decoded
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            magic = f.read(12)
+            f.seek(0)
+
+            if magic[:4] in (b'RIFF', b'RIFX', b'RF64') and magic[8:12] == b'WAVE':
+                return _decode_wav(f, file_size, max_duration)
+            if magic[:4] == b'FORM' and magic[8:12] in (b'AIFF', b'AIFC'):
+                return _decode_aiff(f, file_size, max_duration)
+    except (struct.error, ValueError) as e:
+        raise AudioDecodeError('Damaged file: {}'.format(e))
+
+    return _decode_soundfile(path, max_duration)
@@ -0,0 +1,137 @@
+from functools import lru_cache
+import math
+
+import numpy as np
+
+from .audio_decode import AudioDecodeError, DecodedAudio, decode_file
+
+
+# Only the beginning of long files is analysed, it is what gets auditioned
+MAX_ANALYSIS_DURATION = 10.0
+# Analysis frames are about this long whatever the sample rate
+FRAME_DURATION = 0.046
+NUM_MEL_BANDS = 40
+NUM_MFCC = 13
+MIN_FREQUENCY = 20.0
+MAX_FREQUENCY = 16000.0
+ROLLOFF_FRACTION = 0.85
+# Frames quieter than the loudest one by more than this are left out of spectral statistics
+SILENCE_THRESHOLD_DB = 60.0
+
+# MFCC means and deviations, then centroid mean and deviation, rolloff,
+# flatness, zero crossing rate, loudness, crest factor and duration
+FEATURE_SIZE = 2 * NUM_MFCC + 8
+
+_EPSILON = 1e-10
+
+
+def _hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+
+def _mel_to_hz(mel):
+    return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+
+@lru_cache(maxsize=8)
+def _mel_filterbank(sample_rate, n_fft):
+    """
+    Triangular filters of shape (NUM_MEL_BANDS, n_fft // 2 + 1) evenly spaced on mel scale.
+    """
+    max_frequency = min(MAX_FREQUENCY, sample_rate / 2)
+    edges = _mel_to_hz(np.linspace(
+        _hz_to_mel(MIN_FREQUENCY), _hz_to_mel(max_frequency), NUM_MEL_BANDS + 2))
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (freqs - lower) / (center - lower)
+    falling = (upper - freqs) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+
+@lru_cache(maxsize=1)
+def _dct_matrix():
+    """
+    Orthonormal DCT-II of shape (NUM_MFCC, NUM_MEL_BANDS).
+    """
+    n = np.arange(NUM_MEL_BANDS)
+    k = np.arange(NUM_MFCC)[:, None]
+    dct = np.cos(np.pi / NUM_MEL_BANDS * (n + 0.5) * k) * math.sqrt(2.0 / NUM_MEL_BANDS)
+    dct[0] /= math.sqrt(2.0)
+    return dct.astype(np.float32)
+
+
+def compute_features(audio: DecodedAudio) -> np.ndarray:
+    """
+    Summary of how audio sounds, as float32 vector of FEATURE_SIZE values.
+
+    Statistics of MFCC-like coefficients describe timbre, the remaining
+    values brightness, noisiness, loudness, dynamics and length.
+    Vectors are meant to be compared after standardization across library.
+    """
+    sample_rate = audio.sample_rate
+    mono = audio.samples.mean(axis=1) if audio.channels > 1 else audio.samples[:, 0]
+    mono = mono[:int(MAX_ANALYSIS_DURATION * sample_rate)]
+
+    n_fft = 1 << max(6, int(round(math.log2(FRAME_DURATION * sample_rate))))
+    hop = n_fft // 2
+    if len(mono) < n_fft:
+        mono = np.pad(mono, (0, n_fft - len(mono)))
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop]
+
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    peak_rms = rms.max()
+    audible = rms >= peak_rms * 10 ** (-SILENCE_THRESHOLD_DB / 20)
+    if peak_rms > 0 and audible.any():
+        frames = frames[audible]
+
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+    power = spectrum.sum(axis=1) + _EPSILON
+
+    log_mel = np.log(spectrum @ _mel_filterbank(sample_rate, n_fft).T + _EPSILON)
+    mfcc = log_mel @ _dct_matrix().T
+
+    log_centroid = np.log((spectrum @ freqs) / power + 1.0)
+    cumulative = np.cumsum(spectrum, axis=1)
+    rolloff = freqs[np.argmax(cumulative >= ROLLOFF_FRACTION * cumulative[:, -1:], axis=1)]
+    flatness = np.exp(np.mean(np.log(spectrum + _EPSILON), axis=1)) / (np.mean(spectrum, axis=1) + _EPSILON)
+    zero_crossings = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+
+    loudness = 20 * np.log10(np.mean(rms) + _EPSILON)
+    crest = 20 * np.log10((peak_rms + _EPSILON) / (np.mean(rms) + _EPSILON))
+
+    return np.concatenate([
+        mfcc.mean(axis=0),
+        mfcc.std(axis=0),
+        [
+            log_centroid.mean(),
+            log_centroid.std(),
+            np.log(rolloff.mean() + 1.0),
+            flatness.mean(),
+            zero_crossings.mean(),
+            loudness,
+            crest,
+            np.log(audio.duration + _EPSILON),
+        ],
+    ]).astype(np.float32)
+
+
+def compute_features_batch(paths):
+    """
+    Analyse many files, meant to be run in worker process.
+
+    :return: list of float32 vectors as bytes, None in place of files which could not be decoded
+    """
+    results = []
+    for path in paths:
+        try:
+            audio = decode_file(path, max_duration=MAX_ANALYSIS_DURATION)
+        except (OSError, AudioDecodeError):
+            results.append(None)
+            continue
+        if not audio.num_frames or not audio.sample_rate:
+            results.append(None)
+            continue
+        results.append(compute_features(audio).tobytes())
+    return results
@@ -0,0 +1,287 @@
+from dataclasses import dataclass
+import os
+import struct
+from typing import Optional
+
+
+# Enough to find format chunks of files with big embedded metadata in front
+MAX_HEADER_SCAN = 1024 * 1024
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG 1
+    2: (22050, 24000, 16000),  # MPEG 2
+    0: (11025, 12000, 8000),  # MPEG 2.5
+}
+
+# Bitrates in kbps indexed by (is MPEG 1, layer)
+MPEG_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+@dataclass
+class AudioMetadata(object):
+    # Duration in seconds
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    bit_depth: Optional[int] = None
+
+
+class AudioMetadataError(Exception):
+    pass
+
+
+def _read_chunks(f, endian, end):
+    """
+    Yield (chunk id, chunk size, chunk data offset) of RIFF/IFF chunks up to end offset.
+    """
+    header = struct.Struct(endian + '4sI')
+    pos = f.tell()
+    while pos + header.size <= end:
+        f.seek(pos)
+        data = f.read(header.size)
+        if len(data) < header.size:
+            return
+        chunk_id, chunk_size = header.unpack(data)
+        yield chunk_id, chunk_size, pos + header.size
+        # Chunks are padded to even size
+        pos += header.size + chunk_size + (chunk_size & 1)
+
+
+def _parse_wav(f, file_size):
+    riff_id = f.read(12)
+    endian = '>' if riff_id[:4] == b'RIFX' else '<'
+
+    fmt = None
+    data_size = None
+    num_frames = None
+    ds64_data_size = None
+
+    for chunk_id, chunk_size, offset in _read_chunks(f, endian, file_size):
+        if chunk_id == b'ds64':
+            riff_size, ds64_data_size, ds64_num_frames = struct.unpack(endian + 'QQQ', f.read(24))
+            num_frames = ds64_num_frames or None
+        elif chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 40))
+        elif chunk_id == b'fact' and num_frames is None:
+            num_frames, = struct.unpack(endian + 'I', f.read(4))
+        elif chunk_id == b'data':
+            data_size = ds64_data_size if chunk_size == 0xFFFFFFFF and ds64_data_size else chunk_size
+            # Data size is unreliable in files which were not finalized
+            data_size = min(data_size, file_size - offset)
+            break
+        if offset > MAX_HEADER_SCAN:
+            break
+
+    if fmt is None or len(fmt) < 16:
+        raise AudioMetadataError('Missing format chunk')
+
+    format_tag, channels, sample_rate, byte_rate, block_align, bit_depth = struct.unpack(
+        endian + 'HHIIHH', fmt[:16])
+
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        valid_bits, channel_mask, sub_format = struct.unpack(endian + 'HIH', fmt[18:26])
+        format_tag = sub_format
+        if valid_bits:
+            bit_depth = valid_bits
+
+    duration = None
+    if data_size is not None:
+        if format_tag in (WAVE_FORMAT_PCM, 0x0003) and block_align:
+            duration = data_size // block_align / sample_rate if sample_rate else None
+        elif num_frames is not None and sample_rate:
+            duration = num_frames / sample_rate
+        elif byte_rate:
+            duration = data_size / byte_rate
+
+    return AudioMetadata(
+        duration=duration,
+        sample_rate=sample_rate or None,
+        channels=channels or None,
+        bit_depth=bit_depth or None)
+
+
+def _parse_extended(data):
+    """
+    Parse 80-bit IEEE 754 extended precision number used in AIFF for sample rate.
+    """
+    exponent, mantissa = struct.unpack('>HQ', data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+
+def _parse_aiff(f, file_size):
+    form = f.read(12)
+    for chunk_id, chunk_size, offset in _read_chunks(f, '>', file_size):
+        if chunk_id == b'COMM':
+            data = f.read(18)
+            if len(data) < 18:
+                break
+            channels, num_frames, bit_depth = struct.unpack('>hIh', data[:8])
+            sample_rate = _parse_extended(data[8:18])
+            return AudioMetadata(
+                duration=num_frames / sample_rate if sample_rate else None,
+                sample_rate=int(round(sample_rate)) or None,
+                channels=channels or None,
+                bit_depth=bit_depth or None)
+        if offset > MAX_HEADER_SCAN:
+            break
+
+    raise AudioMetadataError('Missing COMM chunk')
+
+
+def _skip_id3v2(f):
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        footer = 10 if header[5] & 0x10 else 0
+        f.seek(10 + size + footer)
+        return 10 + size + footer
+    f.seek(0)
+    return 0
+
+
+def _parse_flac(f, file_size):
+    _skip_id3v2(f)
+    if f.read(4) != b'fLaC':
+        raise AudioMetadataError('Missing fLaC marker')
+
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        raise AudioMetadataError('Missing STREAMINFO block')
+
+    streaminfo = f.read(34)
+    if len(streaminfo) < 34:
+        raise AudioMetadataError('Truncated STREAMINFO block')
+
+    bits = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = bits >> 44
+    channels = ((bits >> 41) & 0x7) + 1
+    bit_depth = ((bits >> 36) & 0x1F) + 1
+    num_frames = bits & 0xFFFFFFFFF
+
+    return AudioMetadata(
+        duration=num_frames / sample_rate if sample_rate and num_frames else None,
+        sample_rate=sample_rate or None,
+        channels=channels,
+        bit_depth=bit_depth)
+
+
+def _parse_mp3(f, file_size):
+    start = _skip_id3v2(f)
+    data = f.read(64 * 1024)
+
+    pos = 0
+    while True:
+        pos = data.find(b'\xff', pos)
+        if pos < 0 or pos + 4 > len(data):
+            raise AudioMetadataError('No MPEG frame found')
+
+        header, = struct.unpack('>I', data[pos:pos + 4])
+        version = (header >> 19) & 0x3
+        layer = 4 - ((header >> 17) & 0x3)
+        bitrate_index = (header >> 12) & 0xF
+        sample_rate_index = (header >> 10) & 0x3
+
+        if ((header >> 21) & 0x7FF) == 0x7FF and version != 1 and layer != 4 \
+                and bitrate_index not in (0, 15) and sample_rate_index != 3:
+            break
+        pos += 1
+
+    mpeg1 = version == 3
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    bitrate = MPEG_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    channel_mode = (header >> 6) & 0x3
+    channels = 1 if channel_mode == 3 else 2
+
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 3 and not mpeg1:
+        samples_per_frame = 576
+    else:
+        samples_per_frame = 1152
+
+    # Xing/Info header of VBR files carries exact frame count
+    num_frames = None
+    if layer == 3:
+        if mpeg1:
+            side_info = 17 if channels == 1 else 32
+        else:
+            side_info = 9 if channels == 1 else 17
+        xing_pos = pos + 4 + side_info
+        if data[xing_pos:xing_pos + 4] in (b'Xing', b'Info'):
+            flags, = struct.unpack('>I', data[xing_pos + 4:xing_pos + 8])
+            if flags & 0x1:
+                num_frames, = struct.unpack('>I', data[xing_pos + 8:xing_pos + 12])
+        elif data[pos + 36:pos + 40] == b'VBRI':
+            num_frames, = struct.unpack('>I', data[pos + 50:pos + 54])
+
+    if num_frames:
+        duration = num_frames * samples_per_frame / sample_rate
+    else:
+        duration = (file_size - start - pos) * 8 / bitrate
+
+    return AudioMetadata(
+        duration=duration,
+        sample_rate=sample_rate,
+        channels=channels,
+        bit_depth=None)
+
+
+def read_metadata(path) -> AudioMetadata:
+    """
+    Read basic properties of audio file from its headers, without decoding any audio.
+
+    :raises AudioMetadataError: if file format is not recognized or file is damaged
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            magic = f.read(12)
+            f.seek(0)
+
+            if magic[:4] in (b'RIFF', b'RIFX', b'RF64') and magic[8:12] == b'WAVE':
+                return _parse_wav(f, file_size)
+            if magic[:4] == b'FORM' and magic[8:12] in (b'AIFF', b'AIFC'):
+                return _parse_aiff(f, file_size)
+            if magic[:4] == b'fLaC':
+                return _parse_flac(f, file_size)
+
+            ext = os.path.splitext(path)[1].lower()
+            if ext == '.flac':
+                return _parse_flac(f, file_size)
+            if ext == '.mp3' or magic[:3] == b'ID3':
+                return _parse_mp3(f, file_size)
+    except (struct.error, KeyError, ZeroDivisionError) as e:
+        raise AudioMetadataError('Damaged header: {}'.format(e))
+
+    raise AudioMetadataError('Unrecognized format')
+
+
+def read_metadata_batch(paths):
+    """
+    Read metadata of many files, meant to be run in worker process.
+
+    :return: list of AudioMetadata, None in place of files which could not be parsed
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(read_metadata(path))
+        except (OSError, AudioMetadataError):
+            results.append(None)
+    return results
@@ -0,0 +1,257 @@
+"""
+Command line interface for building and querying the search database without Qt.
+
+Each command writes JSON objects to standard output, one per line.
+
+Usage: python -m samplexplore.cli [--db PATH] {index,update,search,similar,duplicates,stats} ...
+"""
+import argparse
+from dataclasses import asdict
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from . import db_core
+from .scanner import DEFAULT_NUM_WORKERS
+from .search_query import SearchQueryError, parse_query
+from .similarity import DEFAULT_NUM_NEIGHBOURS
+
+
+APP_NAME = 'samplexplore'
+DB_FILENAME = 'samplexplore.sqlite'
+
+EXIT_CANCELLED = 130
+SEARCH_PAGE_SIZE = 1000
+
+
+def default_data_dir():
+    """
+    Same location as application data directory of the GUI, resolved without Qt.
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser(os.path.join('~', 'Library', 'Application Support'))
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser(os.path.join('~', '.local', 'share'))
+    return os.path.join(base, APP_NAME)
+
+
+def emit(**record):
+    print(json.dumps(record, ensure_ascii=False), flush=True)
+
+
+def _progress_callback(args):
+    if not args.progress:
+        return None
+
+    def progress(info):
+        emit(event='progress', **asdict(info))
+
+    return progress
+
+
+def _cancel_on_interrupt():
+    """
+    Let rebuild store its checkpoint on Ctrl+C instead of being killed mid-transaction.
+    """
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+    return cancel_event
+
+
+def _finish(command, completed, started):
+    emit(
+        event='done',
+        command=command,
+        completed=completed,
+        elapsed=round(time.monotonic() - started, 3),
+        **db_core.index_stats())
+    return 0 if completed else EXIT_CANCELLED
+
+
+def _check_directory(path):
+    # Indexing a mistyped path would replace stored index with an empty one
+    if not os.path.isdir(path):
+        emit(event='error', message='Not a directory: {}'.format(path))
+        return False
+    return True
+
+
+def cmd_index(args):
+    if not _check_directory(args.directory):
+        return 2
+    started = time.monotonic()
+    completed = db_core.rebuild_files_table(
+        os.path.abspath(args.directory),
+        progress_callback=_progress_callback(args),
+        num_workers=args.workers,
+        cancel_event=_cancel_on_interrupt())
+    return _finish('index', completed, started)
+
+
+def cmd_update(args):
+    if args.directory is not None and not _check_directory(args.directory):
+        return 2
+    started = time.monotonic()
+    cancel_event = _cancel_on_interrupt()
+
+    completed = db_core.resume_files_table(
+        progress_callback=_progress_callback(args),
+        num_workers=args.workers,
+        cancel_event=cancel_event)
+
+    if completed is not False:
+        if args.directory is not None:
+            samples_directory = os.path.abspath(args.directory)
+        else:
+            samples_directory = db_core.get_config().get('samples_directory')
+        if samples_directory is None:
+            emit(event='error', message='Samples directory is not known, run index command first')
+            return 2
+        completed = db_core.update_files_table(
+            samples_directory,
+            progress_callback=_progress_callback(args),
+            num_workers=args.workers,
+            cancel_event=cancel_event)
+
+    return _finish('update', completed, started)
+
+
+def cmd_search(args):
+    try:
+        query = parse_query(' '.join(args.query))
+    except SearchQueryError as e:
+        emit(event='error', message=str(e))
+        return 2
+    if args.directory is not None:
+        query.directory = os.path.abspath(args.directory)
+    query.collapse_duplicates = args.collapse_duplicates
+
+    results = db_core.search_file_paged(query)
+    try:
+        remaining = args.limit
+        while not results.exhausted and remaining != 0:
+            count = SEARCH_PAGE_SIZE if remaining is None else min(remaining, SEARCH_PAGE_SIZE)
+            rows = results.fetch(count)
+            for file_id, filename, full_path, directory in rows:
+                emit(id=file_id, path=full_path, filename=filename)
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        results.close()
+    return 0
+
+
+def cmd_similar(args):
+    rows = db_core.find_similar(os.path.abspath(args.path), args.limit, exact=args.exact)
+    if rows is None:
+        emit(event='error', message='File was not indexed or could not be analysed: {}'.format(args.path))
+        return 2
+    for file_id, filename, full_path, directory in rows:
+        emit(id=file_id, path=full_path, filename=filename)
+    return 0
+
+
+def cmd_duplicates(args):
+    if not args.no_hash:
+        completed = db_core.hash_duplicate_candidates(
+            progress_callback=_progress_callback(args),
+            cancel_event=_cancel_on_interrupt())
+        if not completed:
+            emit(event='cancelled', command='duplicates')
+            return EXIT_CANCELLED
+
+    for group in db_core.find_duplicates():
+        emit(hash=group.content_hash, size=group.size, wasted_size=group.wasted_size, paths=group.paths)
+    return 0
+
+
+def cmd_stats(args):
+    emit(**db_core.index_stats())
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='samplexplore.cli',
+        description='Build and query samplexplore search database without starting the GUI')
+    parser.add_argument(
+        '--db',
+        help='database file, defaults to the one used by the application ({})'.format(
+            os.path.join(default_data_dir(), DB_FILENAME)))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_rebuild_arguments(subparser):
+        subparser.add_argument('--workers', type=int, default=DEFAULT_NUM_WORKERS,
+                               help='number of directory scanning threads')
+        subparser.add_argument('--progress', action='store_true',
+                               help='report progress of scanning and metadata reading')
+
+    index_parser = subparsers.add_parser('index', help='index samples directory from scratch')
+    index_parser.add_argument('directory')
+    add_rebuild_arguments(index_parser)
+    index_parser.set_defaults(func=cmd_index)
+
+    update_parser = subparsers.add_parser(
+        'update', help='resume interrupted indexing and bring index up to date with changes')
+    update_parser.add_argument('directory', nargs='?',
+                               help='samples directory, defaults to the indexed one')
+    add_rebuild_arguments(update_parser)
+    update_parser.set_defaults(func=cmd_update)
+
+    search_parser = subparsers.add_parser('search', help='search indexed files')
+    search_parser.add_argument('query', nargs='+', help='words and filters as in search box')
+    search_parser.add_argument('--limit', type=int, help='maximum number of results')
+    search_parser.add_argument('--in', dest='directory', help='search only within this directory')
+    search_parser.add_argument('--collapse-duplicates', action='store_true',
+                               help='list only the first of files with the same contents')
+    search_parser.set_defaults(func=cmd_search)
+
+    similar_parser = subparsers.add_parser('similar', help='find indexed files which sound like given one')
+    similar_parser.add_argument('path')
+    similar_parser.add_argument('--limit', type=int, default=DEFAULT_NUM_NEIGHBOURS,
+                                help='number of files to report, nearest first')
+    similar_parser.add_argument('--exact', action='store_true',
+                                help='compare with all files even in large libraries')
+    similar_parser.set_defaults(func=cmd_similar)
+
+    duplicates_parser = subparsers.add_parser(
+        'duplicates', help='hash files which may have copies and report groups of identical files')
+    duplicates_parser.add_argument('--no-hash', action='store_true',
+                                   help='report from hashes stored so far without reading any files')
+    duplicates_parser.add_argument('--progress', action='store_true',
+                                   help='report progress of hashing')
+    duplicates_parser.set_defaults(func=cmd_duplicates)
+
+    stats_parser = subparsers.add_parser('stats', help='show index statistics')
+    stats_parser.set_defaults(func=cmd_stats)
+
+    return parser
+
+
+def main(argv=None):
+    multiprocessing.freeze_support()
+
+    args = build_parser().parse_args(argv)
+
+    db_path = args.db
+    if db_path is None:
+        data_dir = default_data_dir()
+        os.makedirs(data_dir, exist_ok=True)
+        db_path = os.path.join(data_dir, DB_FILENAME)
+
+    db_core.connect(db_path)
+    db_core.create_tables()
+    try:
+        return args.func(args)
+    finally:
+        db_core.db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+
+# Read from both ends of a file to tell apart files of the same size
+HEAD_TAIL_BLOCK_SIZE = 64 * 1024
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def is_fully_read(size):
+    """
+    Whether head and tail blocks of file of given size cover all of its contents.
+    """
+    return size <= 2 * HEAD_TAIL_BLOCK_SIZE
+
+
+def hash_head_tail(path, size) -> bytes:
+    """
+    Hash of the first and the last block of file.
+
+    Equal to hash_full() for files which are read whole, see is_fully_read().
+    """
+    h = _new_hash()
+    with open(path, 'rb') as f:
+        if is_fully_read(size):
+            h.update(f.read())
+        else:
+            h.update(f.read(HEAD_TAIL_BLOCK_SIZE))
+            f.seek(-HEAD_TAIL_BLOCK_SIZE, os.SEEK_END)
+            h.update(f.read(HEAD_TAIL_BLOCK_SIZE))
+    return h.digest()
+
+
+def hash_full(path) -> bytes:
+    h = _new_hash()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FULL_HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def hash_head_tail_batch(files):
+    """
+    Hash many files given as (path, size) tuples, meant to be run in worker process.
+
+    :return: list of digests, None in place of files which could not be read
+    """
+    results = []
+    for path, size in files:
+        try:
+            results.append(hash_head_tail(path, size))
+        except OSError:
+            results.append(None)
+    return results
+
+
+def hash_full_batch(paths):
+    """
+    Hash whole contents of many files, meant to be run in worker process.
+
+    :return: list of digests, None in place of files which could not be read
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(hash_full(path))
+        except OSError:
+            results.append(None)
+    return results
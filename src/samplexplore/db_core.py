@@ -1,35 +1,115 @@
-from dataclasses import dataclass
-import re
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from itertools import groupby
+import multiprocessing
+import operator
+from typing import Callable, Optional, Union
 import os
+import random
+import signal
+import sqlite3
+import threading
+import time
 
+import numpy as np
 from peewee import *
 from playhouse.kv import KeyValue
 from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
-from playhouse.shortcuts import model_to_dict
+
+from .audio_features import FEATURE_SIZE, compute_features_batch
+from .audio_metadata import read_metadata_batch
+from .content_hash import hash_full_batch, hash_head_tail_batch, is_fully_read
+from .scanner import DEFAULT_NUM_WORKERS, ParallelScanner
+from .search_query import SearchQuery, parse_query
+from .similarity import DEFAULT_NUM_NEIGHBOURS, FeatureMatrix, SimilarityIndexCache
 
 
 db = SqliteDatabase(None)
 config = None
 
 
-SQL_SEARCH = '''
-SELECT full_path, filename FROM files WHERE filename MATCH ? ORDER BY RANK;
+SQL_CREATE_FILES_SEARCH_VIEW = '''
+CREATE VIEW IF NOT EXISTS files_search AS
+SELECT files.id, files.filename, directories.search_path AS directory
+FROM files JOIN directories ON directories.id = files.directory_id;
+'''
+
+SQL_DROP_FILES_SEARCH_VIEW = '''
+DROP VIEW IF EXISTS files_search;
 '''
 
-SQL_CREATE_FILES_TABLE = '''
-CREATE VIRTUAL TABLE files 
-USING FTS5(full_path, filename, tokenize="trigram");
+SQL_INSERT_FILE_RECORDS = '''
+INSERT INTO files(filename, extension, directory_id, size, mtime_ns)
+VALUES (?, ?, ?, ?, ?);
 '''
 
-SQL_DROP_FILES_TABLE = '''
-DROP TABLE IF EXISTS files;
+SQL_FTS_DELETE = '''
+INSERT INTO filesindex(filesindex, rowid, filename, directory)
+SELECT 'delete', id, filename, directory FROM files_search WHERE id = ?;
 '''
 
-SQL_INSERT_FILES = '''
-INSERT INTO files(full_path, filename)
-VALUES (?, ?);
+SQL_FTS_DELETE_DIRECTORY_FILES = '''
+INSERT INTO filesindex(filesindex, rowid, filename, directory)
+SELECT 'delete', id, filename, directory FROM files_search
+WHERE id IN (SELECT id FROM files WHERE directory_id = ?);
 '''
 
+SCHEMA_VERSION = 6
+
+DEFAULT_PROGRESS_RATE = 4
+
+# Seconds between commits of long running rebuild
+CHECKPOINT_INTERVAL = 2.0
+
+REBUILD_STATE_KEY = 'rebuild_state'
+
+STAGE_SCAN = 'scan'
+STAGE_METADATA = 'metadata'
+STAGE_HASH = 'hash'
+STAGE_FEATURES = 'features'
+
+# Number of files read by single metadata worker task
+METADATA_BATCH_SIZE = 64
+METADATA_PAGE_SIZE = 4096
+# Fewer files than that are read without starting worker processes
+METADATA_POOL_THRESHOLD = 256
+
+# Number of files analysed by single feature worker task
+FEATURES_BATCH_SIZE = 8
+FEATURES_PAGE_SIZE = 1024
+# Fewer files than that are analysed without starting worker processes
+FEATURES_POOL_THRESHOLD = 16
+# Changed whenever feature vectors are stored or deleted, see update_feature_matrix()
+FEATURES_GENERATION_KEY = 'features_generation'
+
+# Number of files hashed by single worker task
+HASH_BATCH_SIZE = 16
+HASH_PAGE_SIZE = 1024
+# Fewer files than that are hashed without starting worker processes
+HASH_POOL_THRESHOLD = 64
+
+# Shorter words can not be looked up in trigram index
+MIN_MATCH_TERM_LENGTH = 3
+# Weights of FilesIndex columns in bm25 ranking, file name matches count the most
+FILENAME_RANK_WEIGHT = 4.0
+DIRECTORY_RANK_WEIGHT = 1.0
+# Number of SQLite virtual machine instructions between checks for cancellation
+CANCEL_CHECK_STEPS = 1000
+
+SEARCH_CACHE_MAX_ROWS = 50000
+# Bigger result sets are streamed from the database instead of being cached
+SEARCH_CACHE_MAX_RESULT_ROWS = 5000
+
+FILTER_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+}
+
 DEFAULT_SUPPORTED_EXTENSIONS = [
     'wav',
     'aif',
@@ -45,91 +125,1623 @@ def get_config():
     return config
 
 
+class Directories(Model):
+    """
+    Directories of samples directory tree, each file refers to one of them.
+
+    Absolute path is stored once per directory instead of in every file row.
+    """
+    path = TextField(null=False, unique=True)
+    # None for samples directory itself
+    parent = ForeignKeyField('self', null=True, backref='children')
+    # None until the directory listing has been stored at least once
+    mtime_ns = IntegerField(null=True)
+    # Path components relative to samples directory separated by spaces, indexed for search
+    search_path = TextField(null=False, default='')
+
+    class Meta:
+        database = db
+
+
 class Files(Model):
-    full_path = TextField(null=False, unique=True)
     filename = TextField(null=False)
+    # Lower case, without dot
+    extension = TextField(null=False, default='', index=True)
+    # Covered by the unique index below
+    directory = ForeignKeyField(Directories, backref='files', index=False)
+    size = IntegerField(default=0)
+    mtime_ns = IntegerField(default=0)
 
     class Meta:
         database = db
+        indexes = (
+            (('directory', 'filename'), True),
+        )
+
+
+class FileMetadata(Model):
+    """
+    Audio properties read from file headers.
+
+    Row with all values empty is stored for files which could not be parsed,
+    so that they are not read again.
+    """
+    file = ForeignKeyField(Files, primary_key=True, backref='metadata')
+    # Duration in seconds
+    duration = FloatField(null=True, index=True)
+    sample_rate = IntegerField(null=True, index=True)
+    channels = IntegerField(null=True)
+    bit_depth = IntegerField(null=True)
+
+    class Meta:
+        database = db
+
+
+class FileHashes(Model):
+    """
+    Content hashes of files which have the same size as some other file.
+
+    Head hash covers the first and the last block of file. Full hash is
+    computed only for files whose head hashes collide as well, or is the
+    head hash itself when that covers the whole file. Both are empty for
+    files which could not be read, so that they are not read again.
+    """
+    file = ForeignKeyField(Files, primary_key=True, backref='hashes')
+    head_hash = BlobField(null=True)
+    full_hash = BlobField(null=True, index=True)
+
+    class Meta:
+        database = db
+
+
+class FileFeatures(Model):
+    """
+    Feature vectors describing how files sound, used by similarity search.
+
+    Row with empty vector is stored for files which could not be decoded,
+    so that they are not read again.
+    """
+    file = ForeignKeyField(Files, primary_key=True, backref='features')
+    # float32 values, see audio_features.compute_features()
+    vector = BlobField(null=True)
+
+    class Meta:
+        database = db
+
+
+class FilesSearch(Model):
+    """
+    Files along with search path of their directory, external content of FilesIndex.
+
+    View over Files and Directories, so the directory strings are stored
+    once per directory rather than for every file.
+    """
+    id = IntegerField(primary_key=True)
+    filename = TextField()
+    directory = TextField()
+
+    class Meta:
+        database = db
+        table_name = 'files_search'
 
 
 class FilesIndex(FTS5Model):
     rowid = RowIDField()
     filename = SearchField()
+    directory = SearchField()
 
     class Meta:
         database = db
         options = {
             'tokenize': 'trigram',
-            'content': Files,
+            'content': FilesSearch._meta.table_name,
+            'content_rowid': 'id',
         }
 
 
 @dataclass
 class DBRebuildProgressInfo(object):
+    stage: str = STAGE_SCAN
     num_files_total: int = 0
     num_dirs_total: int = 0
     current_dir: str = ''
+    # Number of directories in the index before rebuild, 0 if unknown
+    num_dirs_expected: int = 0
+    # Files processed and to be processed in metadata stage
+    num_files_done: int = 0
+    num_files_expected: int = 0
+    elapsed: float = 0.0
+    files_per_sec: float = 0.0
+    # Estimated number of seconds left in current stage, None if unknown
+    eta: Optional[float] = None
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if self.stage != STAGE_SCAN:
+            done, expected = self.num_files_done, self.num_files_expected
+        else:
+            done, expected = self.num_dirs_total, self.num_dirs_expected
+        if not expected:
+            return None
+        return min(1.0, done / expected)
+
+
+class _ProgressReporter(object):
+    """
+    Accumulates rebuild progress and passes it on at most max_rate times per second.
+    """
+
+    def __init__(self, progress_callback, num_dirs_expected=0, max_rate=DEFAULT_PROGRESS_RATE):
+        self.progress_callback = progress_callback
+        self.interval = 1.0 / max_rate
+        self.info = DBRebuildProgressInfo(num_dirs_expected=num_dirs_expected)
+        self.started = time.monotonic()
+        self.last_report = None
+
+    def update(self, scan):
+        info = self.info
+        info.num_dirs_total += 1
+        if scan.changed:
+            info.num_files_total += len(scan.files)
+        info.current_dir = scan.path
+        self._report(info.num_files_total, info.num_dirs_total, info.num_dirs_expected)
+
+    def update_metadata(self, num_files_done, num_files_expected):
+        self.update_files(STAGE_METADATA, num_files_done, num_files_expected)
+
+    def begin_stage(self, stage, num_files_expected):
+        """
+        Start timing stage of work done file by file, before any file is done.
+        """
+        info = self.info
+        info.stage = stage
+        info.current_dir = ''
+        info.num_files_done = 0
+        info.num_files_expected = num_files_expected
+        self.started = time.monotonic()
+        self.last_report = None
+        self._report(0, 0, num_files_expected)
+
+    def update_files(self, stage, num_files_done, num_files_expected):
+        info = self.info
+        if info.stage != stage:
+            self.begin_stage(stage, num_files_expected)
+        info.num_files_done = num_files_done
+        info.num_files_expected = num_files_expected
+        self._report(num_files_done, num_files_done, num_files_expected)
+
+    def _report(self, num_files, done, expected):
+        now = time.monotonic()
+        if self.last_report is not None and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        info = self.info
+        info.elapsed = now - self.started
+        if info.elapsed > 0:
+            info.files_per_sec = num_files / info.elapsed
+        if 0 < done < expected:
+            info.eta = info.elapsed * (expected - done) / done
+        else:
+            info.eta = None
+
+        # Receiver may live in another thread
+        self.progress_callback(replace(info))
 
 
 def connect(db_path):
-    db.init(db_path)
+    """
+    Set database location, each thread opens its own connection on first use.
+
+    Write-ahead log lets readers work on the last committed state while
+    the writer is in the middle of a transaction.
+    """
+    db.init(db_path, pragmas={
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+    })
+    search_cache.invalidate()
+
+
+def connect_reader():
+    """
+    Open read-only connection for calling thread unless it has one already.
+    """
+    if db.is_closed():
+        db.connect()
+        db.execute_sql('PRAGMA query_only = 1')
 
 
 def create_tables():
-    db.create_tables([Files, FilesIndex])
+    config = get_config()
+    if config.get('schema_version') != SCHEMA_VERSION:
+        # Index is a disposable cache of the filesystem, so instead of
+        # migrating old layouts simply start over with an empty one.
+        db.drop_tables([FilesIndex, FileFeatures, FileHashes, FileMetadata, Files, Directories])
+        db.execute_sql(SQL_DROP_FILES_SEARCH_VIEW)
+        _features_changed()
+    db.create_tables([Directories, Files, FileMetadata, FileHashes, FileFeatures, FilesIndex])
+    db.execute_sql(SQL_CREATE_FILES_SEARCH_VIEW)
+    config['schema_version'] = SCHEMA_VERSION
+    search_cache.invalidate()
 
 
-def search_file(phrase):
-    phrase = re.sub(r"[\"\'.\*]%&", ' ', phrase).strip()
-    if not phrase:
+def file_extension(filename):
+    return os.path.splitext(filename)[1][1:].lower()
+
+
+def file_full_path():
+    """
+    Expression building absolute path of file from its directory, which has to be joined.
+    """
+    return Directories.path.concat(os.sep).concat(Files.filename)
+
+
+def directory_search_path(samples_directory, path):
+    """
+    Components of directory path relative to samples directory, separated by spaces.
+    """
+    relative = os.path.relpath(path, samples_directory)
+    if relative == os.curdir:
+        return ''
+    return ' '.join(relative.split(os.sep))
+
+
+def _fts_phrase(terms):
+    # Quoted strings are taken literally, without FTS5 query syntax
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _search_select(query: Union[str, SearchQuery], *fields):
+    if isinstance(query, str):
+        query = parse_query(query)
+    if query.is_empty:
         return
 
+    match_terms = [term for term in query.terms if len(term) >= MIN_MATCH_TERM_LENGTH]
+    short_terms = [term for term in query.terms if len(term) < MIN_MATCH_TERM_LENGTH]
+
     q = (Files
-            .select()
-            .join(
+         .select(*fields)
+         .join_from(
+            Files,
+            Directories,
+            on=(Files.directory == Directories.id)))
+
+    if match_terms:
+        q = (q
+             .join_from(
+                Files,
                 FilesIndex,
                 on=(Files.id == FilesIndex.rowid))
-            .where(FilesIndex.match(phrase))
-            .order_by(FilesIndex.rank()))
+             .where(FilesIndex.match(_fts_phrase(match_terms)))
+             .order_by(FilesIndex.bm25(FILENAME_RANK_WEIGHT, DIRECTORY_RANK_WEIGHT)))
+    else:
+        q = q.order_by(Files.filename)
+
+    for term in short_terms:
+        q = q.where(Files.filename.contains(term) | Directories.search_path.contains(term))
+
+    if query.extensions:
+        q = q.where(Files.extension.in_(query.extensions))
+
+    if query.directory is not None:
+        # Set of directories is looked up once by range over path index
+        subtree = Directories.alias()
+        q = q.where(Files.directory.in_(
+            subtree
+            .select(subtree.id)
+            .where(_subtree_condition(subtree.path, os.path.normpath(query.directory)))))
+
+    if query.filters:
+        q = q.join_from(
+            Files,
+            FileMetadata,
+            on=(FileMetadata.file == Files.id))
+        for field_name, op, value in query.filters:
+            q = q.where(FILTER_OPERATORS[op](getattr(FileMetadata, field_name), value))
+
+    return q
+
+
+def search_file(query: Union[str, SearchQuery]):
+    """
+    Find files matching search box input or structured query.
+
+    Words are looked up in full-text index of file names and directory
+    names, and metadata filters are applied in the same statement.
+
+    :raises SearchQueryError: if query text is invalid
+    """
+    q = _search_select(query)
+    if q is None:
+        return
     return q.execute()
 
 
-def rebuild_files_table(
-        samples_directory,
-        supported_extensions=DEFAULT_SUPPORTED_EXTENSIONS,
-        progress_callback=None):
-    progress_info_total = DBRebuildProgressInfo()
-
-    def yield_records():
-        for root, dirs, files in os.walk(samples_directory):
-            for fn in files:
-                fn_base, fn_ext = os.path.splitext(fn)
-                if fn_ext:
-                    fn_ext = fn_ext[1:].lower()
-                    if fn_ext not in supported_extensions:
+def _search_cache_key(query: SearchQuery):
+    # Both full-text and LIKE matching ignore case and order of words
+    return (
+        tuple(sorted({term.lower() for term in query.terms})),
+        tuple(sorted(set(query.extensions))),
+        tuple(sorted(query.filters)),
+        os.path.normpath(query.directory) if query.directory is not None else None,
+    )
+
+
+def _is_ranked(terms):
+    return any(len(term) >= MIN_MATCH_TERM_LENGTH for term in terms)
+
+
+def _narrows(terms, cached_terms):
+    # File containing each of terms contains each of cached terms as well
+    return all(any(cached in term for term in terms) for cached in cached_terms)
+
+
+def _is_within(directory, cached_directory):
+    return (cached_directory is None
+            or directory == cached_directory
+            or (directory is not None and directory.startswith(os.path.join(cached_directory, ''))))
+
+
+class SearchCache(object):
+    """
+    Complete result sets of recent searches, keyed by normalized query.
+
+    Query which only narrows down a cached one, like "kick_h" typed after
+    "kick", or searches a subdirectory of the cached one, is answered by
+    filtering cached rows, which keeps the order of the cached results.
+    Ranked results are ordered by relevance to their terms, so only the
+    subdirectory ones are answered this way.
+
+    Entries belong to index generation, advanced by invalidate() whenever
+    a write to the index is committed. Safe to use from multiple threads.
+    """
+
+    def __init__(self, max_rows=SEARCH_CACHE_MAX_ROWS, max_result_rows=SEARCH_CACHE_MAX_RESULT_ROWS):
+        self.max_rows = max_rows
+        self.max_result_rows = max_result_rows
+        self.generation = 0
+
+        self._entries = OrderedDict()
+        self._num_rows = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._num_rows = 0
+
+    def get(self, query: SearchQuery) -> Optional[list]:
+        """
+        :return: list of (id, filename, full_path, directory) tuples, None if query has to be run
+        """
+        key = _search_cache_key(query)
+        terms, extensions, filters, directory = key
+
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+                return rows
+
+            narrowed = None
+            for (cached_terms, cached_extensions, cached_filters, cached_directory), cached_rows \
+                    in self._entries.items():
+                if (cached_extensions == extensions
+                        and cached_filters == filters
+                        and _is_within(directory, cached_directory)
+                        # Otherwise results would be in different order
+                        and (terms == cached_terms or not _is_ranked(terms))
+                        and _narrows(terms, cached_terms)
+                        and (narrowed is None or len(cached_rows) < len(narrowed))):
+                    narrowed = cached_rows
+            generation = self.generation
+
+        if narrowed is None:
+            return None
+
+        rows = [row for row in narrowed
+                if all(term in row[1].lower() or term in row[3].lower() for term in terms)]
+        if directory is not None:
+            prefix = os.path.join(directory, '')
+            rows = [row for row in rows if row[2].startswith(prefix)]
+        self.put(query, rows, generation)
+        return rows
+
+    def put(self, query: SearchQuery, rows: list, generation):
+        """
+        :param generation: index generation from before the query was run
+        """
+        if len(rows) > self.max_result_rows:
+            return
+        key = _search_cache_key(query)
+
+        with self._lock:
+            if generation != self.generation or key in self._entries:
+                return
+            self._entries[key] = rows
+            self._num_rows += len(rows)
+            while self._num_rows > self.max_rows and self._entries:
+                key, rows = self._entries.popitem(last=False)
+                self._num_rows -= len(rows)
+
+
+search_cache = SearchCache()
+
+
+class _BufferedCursor(object):
+    """
+    Rows read ahead, followed by the remaining rows of cursor if there is one.
+    """
+
+    def __init__(self, rows, cursor=None):
+        self._rows = rows
+        self._position = 0
+        self._cursor = cursor
+
+    def fetchmany(self, count):
+        rows = self._rows[self._position:self._position + count]
+        self._position += len(rows)
+        if len(rows) < count and self._cursor is not None:
+            rows.extend(self._cursor.fetchmany(count - len(rows)))
+        return rows
+
+    def close(self):
+        self._rows = []
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+class _CollapsedCursor(object):
+    """
+    Rows of cursor without files whose contents are the same as of a file in an earlier row.
+
+    Files are compared by full hashes stored so far, see hash_duplicate_candidates().
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._seen_hashes = set()
+
+    def fetchmany(self, count):
+        rows = []
+        while len(rows) < count:
+            wanted = count - len(rows)
+            fetched = self._cursor.fetchmany(wanted)
+            if not fetched:
+                break
+            hashes = dict(FileHashes
+                          .select(FileHashes.file, FileHashes.full_hash)
+                          .where(FileHashes.file.in_([row[0] for row in fetched])
+                                 & FileHashes.full_hash.is_null(False))
+                          .tuples())
+            for row in fetched:
+                content_hash = hashes.get(row[0])
+                if content_hash is not None:
+                    if content_hash in self._seen_hashes:
                         continue
+                    self._seen_hashes.add(content_hash)
+                rows.append(row)
+            if len(fetched) < wanted:
+                break
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+
+class SearchResults(object):
+    """
+    Search statement kept open to read its rows a page at a time.
+
+    Has to be used and closed from the thread it was created in.
+    """
+
+    def __init__(self, cursor=None):
+        self._cursor = cursor
+
+    @property
+    def exhausted(self):
+        return self._cursor is None
+
+    def fetch(self, count) -> list:
+        """
+        :return: list of (id, filename, full_path, directory) tuples, shorter than count
+                 when there are no more results
+        """
+        if self._cursor is None:
+            return []
+        rows = self._cursor.fetchmany(count)
+        if len(rows) < count:
+            self.close()
+        return rows
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+@contextmanager
+def cancellable(is_cancelled: Callable[[], bool], steps=CANCEL_CHECK_STEPS):
+    """
+    Abort statements run within the block as soon as is_cancelled returns True.
+
+    :raises QueryCancelled: if statement was aborted
+    """
+    conn = db.connection()
+    conn.set_progress_handler(lambda: 1 if is_cancelled() else 0, steps)
+    try:
+        yield
+    # Error raised by statement execution is wrapped by peewee, by fetching it is not
+    except (OperationalError, sqlite3.OperationalError) as e:
+        if is_cancelled():
+            raise QueryCancelled() from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def search_file_paged(query: Union[str, SearchQuery]) -> SearchResults:
+    """
+    Start search returning rows as plain tuples, in the same order as search_file.
+
+    Small result sets are read at once and kept in search_cache, so that
+    repeated and narrowed down queries do not hit the database.
+    Run it within cancellable() block to be able to abort it.
+
+    :raises SearchQueryError: if query text is invalid
+    """
+    if isinstance(query, str):
+        query = parse_query(query)
+    if query.is_empty:
+        return SearchResults()
+
+    # Cached rows include duplicates, which are collapsed while they are read
+    wrap = _CollapsedCursor if query.collapse_duplicates else lambda cursor: cursor
+
+    rows = search_cache.get(query)
+    if rows is not None:
+        return SearchResults(wrap(_BufferedCursor(rows)))
+
+    generation = search_cache.generation
+    cursor = db.execute(_search_select(
+        query, Files.id, Files.filename, file_full_path(), Directories.search_path))
+    # Ranking is done before the first row is returned, reading more is cheap
+    rows = cursor.fetchmany(search_cache.max_result_rows + 1)
+    if len(rows) > search_cache.max_result_rows:
+        return SearchResults(wrap(_BufferedCursor(rows, cursor)))
+
+    cursor.close()
+    search_cache.put(query, rows, generation)
+    return SearchResults(wrap(_BufferedCursor(rows)))
+
+
+def _fts_insert_directory_files(dir_id, filenames=None):
+    """
+    Add given files of directory to search index, all of them if filenames are not given.
+    """
+    q = Files.select(Files.id).where(Files.directory == dir_id)
+    if filenames is None:
+        (FilesIndex
+            .insert_from(
+                (FilesSearch
+                    .select(FilesSearch.id, FilesSearch.filename, FilesSearch.directory)
+                    .where(FilesSearch.id.in_(q))),
+                [FilesIndex.rowid, FilesIndex.filename, FilesIndex.directory])
+            .execute())
+        return
+    for batch in chunked(filenames, 500):
+        (FilesIndex
+            .insert_from(
+                (FilesSearch
+                    .select(FilesSearch.id, FilesSearch.filename, FilesSearch.directory)
+                    .where(FilesSearch.id.in_(q.where(Files.filename.in_(batch))))),
+                [FilesIndex.rowid, FilesIndex.filename, FilesIndex.directory])
+            .execute())
+
+
+def _delete_files(rows, update_index=True):
+    """
+    Delete files given as (id, filename) tuples along with their search index entries.
+
+    Directories of the files have to be still present, the index entries
+    are deleted with directory names read from them.
+    """
+    if update_index:
+        for file_id, filename in rows:
+            db.execute_sql(SQL_FTS_DELETE, (file_id,))
+    for batch in chunked([file_id for file_id, filename in rows], 500):
+        FileMetadata.delete().where(FileMetadata.file.in_(batch)).execute()
+        FileHashes.delete().where(FileHashes.file.in_(batch)).execute()
+        FileFeatures.delete().where(FileFeatures.file.in_(batch)).execute()
+        Files.delete().where(Files.id.in_(batch)).execute()
+    if rows:
+        # Ids of deleted files are reused by new ones
+        _features_changed()
+
+
+def _update_file(file_id, size, mtime_ns):
+    Files.update(size=size, mtime_ns=mtime_ns).where(Files.id == file_id).execute()
+    # Will be read again
+    FileMetadata.delete().where(FileMetadata.file == file_id).execute()
+    FileHashes.delete().where(FileHashes.file == file_id).execute()
+    FileFeatures.delete().where(FileFeatures.file == file_id).execute()
+    _features_changed()
+
+
+def _subtree_condition(field, path):
+    # Range over the index instead of LIKE, which would need escaping of
+    # wildcards commonly found in file names.
+    prefix = os.path.join(path, '')
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (field == path) | ((field >= prefix) & (field < upper))
+
+
+def _delete_directories(condition, update_index=True):
+    dir_ids = Directories.select(Directories.id).where(condition)
+    rows = list(Files
+                .select(Files.id, Files.filename)
+                .where(Files.directory.in_(dir_ids))
+                .tuples())
+    _delete_files(rows, update_index=update_index)
+    Directories.delete().where(condition).execute()
+
+
+class _FilesTableSync(object):
+    """
+    Brings Files table in line with the contents of samples directory.
+
+    Directories whose mtime did not change since the last scan have the same
+    set of entries, so they are not listed again: only their known files are
+    checked for changes in place and their known subdirectories are visited.
+    Changed directories are listed and their files are compared by
+    (size, mtime) against stored rows.
+    """
+
+    def __init__(self, samples_directory, supported_extensions, update_index, num_workers):
+        self.samples_directory = samples_directory
+        self.supported_extensions = supported_extensions
+        self.update_index = update_index
+        self.num_workers = num_workers
+
+        self.dirs = {}
+        self.children = defaultdict(list)
+        # Directories whose files were added or updated
+        self.synced_dir_ids = set()
+
+    def _load_dirs(self, condition=None):
+        q = Directories.select(Directories.id, Directories.path, Directories.mtime_ns)
+        if condition is not None:
+            q = q.where(condition)
+        for dir_id, path, mtime_ns in q.tuples():
+            self._add_dir(dir_id, path, mtime_ns)
+
+    def _load_files(self):
+        """
+        :return: mapping of directory path to mapping of filename to (size, mtime_ns)
+        """
+        paths = {dir_id: path for path, (dir_id, mtime_ns) in self.dirs.items()}
+        files = defaultdict(dict)
+        for dir_id, filename, size, mtime_ns in (Files
+                .select(Files.directory, Files.filename, Files.size, Files.mtime_ns)
+                .tuples()):
+            path = paths.get(dir_id)
+            if path is not None:
+                files[path][filename] = (size, mtime_ns)
+        return files
 
-                file_path = os.path.join(root, fn)
-                yield file_path, fn
+    def _add_dir(self, dir_id, path, mtime_ns):
+        self.dirs[path] = [dir_id, mtime_ns]
+        self.children[os.path.dirname(path)].append(path)
 
-            if progress_callback is not None:
-                progress_info_total.num_dirs_total += len(dirs)
-                progress_info_total.num_files_total += len(files)
+    def _create_dir(self, path):
+        parent = self.dirs.get(os.path.dirname(path)) if path != self.samples_directory else None
+        dir_id = (Directories
+                  .insert(
+                    path=path,
+                    parent=parent[0] if parent is not None else None,
+                    mtime_ns=None,
+                    search_path=directory_search_path(self.samples_directory, path))
+                  .execute())
+        self._add_dir(dir_id, path, None)
 
-                progress_info = DBRebuildProgressInfo(
-                    num_files_total=progress_info_total.num_files_total,
-                    num_dirs_total=progress_info_total.num_dirs_total,
-                    current_dir=root)
-                #progress_callback(5)
+        # Directories stored under previous samples directory, which was below this one
+        known_children = self.children.get(path)
+        if known_children:
+            Directories.update(parent=dir_id).where(Directories.path.in_(known_children)).execute()
+        return dir_id
+
+    def _relocate_dirs(self):
+        """
+        Make stored directories relative to samples directory, which may
+        have been changed to an ancestor or a descendant of the previous one.
+        """
+        root = self.samples_directory
+        rows = (Directories
+                .select(Directories.id, Directories.path, Directories.parent, Directories.search_path)
+                .tuples())
+        for dir_id, path, parent_id, search_path in rows:
+            parent = self.dirs.get(os.path.dirname(path)) if path != root else None
+            # Directories between samples directory and previous one get stored during scan
+            new_parent_id = parent[0] if parent is not None else None
+            if parent_id != new_parent_id:
+                Directories.update(parent=new_parent_id).where(Directories.id == dir_id).execute()
+
+            new_search_path = directory_search_path(root, path)
+            if search_path != new_search_path:
+                if self.update_index:
+                    db.execute_sql(SQL_FTS_DELETE_DIRECTORY_FILES, (dir_id,))
+                Directories.update(search_path=new_search_path).where(Directories.id == dir_id).execute()
+                if self.update_index:
+                    _fts_insert_directory_files(dir_id)
+
+    def _forget_dir(self, path):
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            del self.dirs[path]
+            stack.extend(self.children.pop(path, []))
+
+    def sync(
+            self,
+            roots=None,
+            progress=None,
+            cancel_event=None,
+            checkpoint=None):
+        """
+        Walk samples directory, or only given subtrees of it.
+
+        :param checkpoint: called every CHECKPOINT_INTERVAL seconds and on
+                           cancel with list of directories yet to be visited
+        :return: True if completed, False if cancelled
+        """
+        root = self.samples_directory
+        if roots is None:
+            roots = [root]
+
+        # Samples directory might have been changed in the meantime
+        _delete_directories(~_subtree_condition(Directories.path, root), self.update_index)
+        self._load_dirs()
+        if progress is not None and not progress.info.num_dirs_expected:
+            progress.info.num_dirs_expected = len(self.dirs)
+        self._relocate_dirs()
+        if root not in self.dirs:
+            self._create_dir(root)
+
+        files = self._load_files()
+        known_dirs = {
+            path: (mtime_ns, list(self.children[path]), files.pop(path, {}))
+            for path, (dir_id, mtime_ns) in self.dirs.items()}
+        scanner = ParallelScanner(
+            self.supported_extensions,
+            known_dirs,
+            num_workers=self.num_workers)
+
+        # Directories scheduled for scan but not stored yet. These are
+        # disjoint subtrees, so they are enough to resume interrupted scan.
+        pending = set(roots)
+        last_checkpoint = time.monotonic()
+
+        scans = scanner.scan(roots)
+        try:
+            for scan in scans:
+                self._apply(scan)
+
+                pending.discard(scan.path)
+                pending.update(self.children[scan.path])
+
+                if progress is not None:
+                    progress.update(scan)
+
+                if cancel_event is not None and cancel_event.is_set():
+                    if checkpoint is not None:
+                        checkpoint(sorted(pending))
+                    return False
+
+                if checkpoint is not None and time.monotonic() - last_checkpoint > CHECKPOINT_INTERVAL:
+                    checkpoint(sorted(pending))
+                    last_checkpoint = time.monotonic()
+        finally:
+            scans.close()
+
+        return True
+
+    def sync_directories(self, paths):
+        """
+        List again given directories regardless of their mtime, along with
+        any subdirectories which are not stored yet.
+        """
+        root = self.samples_directory
+        paths = [path for path in set(paths)
+                 if path == root or path.startswith(os.path.join(root, ''))]
+        if not paths:
+            return
+
+        condition = None
+        for path in paths:
+            subtree = _subtree_condition(Directories.path, path)
+            condition = subtree if condition is None else condition | subtree
+        self._load_dirs(condition)
+
+        paths = [path for path in paths if path in self.dirs]
+        # Unchanged subdirectories are not visited, so their files are not needed
+        known_dirs = {
+            path: (mtime_ns, list(self.children[path]), {})
+            for path, (dir_id, mtime_ns) in self.dirs.items()
+            if path not in paths}
+        scanner = ParallelScanner(
+            self.supported_extensions,
+            known_dirs,
+            num_workers=self.num_workers,
+            descend_unchanged=False)
+
+        for scan in scanner.scan(paths):
+            self._apply(scan)
+
+    def _apply(self, scan):
+        if scan.path not in self.dirs:
+            return
+        if not scan.changed:
+            if scan.modified:
+                self._sync_modified_files(self.dirs[scan.path][0], scan.modified)
+                self.synced_dir_ids.add(self.dirs[scan.path][0])
+            return
+
+        dir_id, stored_mtime_ns = self.dirs[scan.path]
+        self.synced_dir_ids.add(dir_id)
+
+        # Directory which was never listed has no files stored yet
+        self._sync_files(dir_id, scan.path, scan.files, has_stored=stored_mtime_ns is not None)
+        self._sync_subdirs(scan.path, scan.subdirs)
+
+        Directories.update(mtime_ns=scan.mtime_ns).where(Directories.id == dir_id).execute()
+        self.dirs[scan.path][1] = scan.mtime_ns
+
+    def _sync_files(self, dir_id, path, files, has_stored=True):
+        stored = {}
+        if has_stored:
+            stored = {
+                filename: (file_id, size, mtime_ns)
+                for file_id, filename, size, mtime_ns in (Files
+                    .select(Files.id, Files.filename, Files.size, Files.mtime_ns)
+                    .where(Files.directory == dir_id)
+                    .tuples())}
+
+        new_records = []
+
+        for filename, size, mtime_ns in files:
+            stored_file = stored.pop(filename, None)
+            if stored_file is None:
+                new_records.append((
+                    filename,
+                    file_extension(filename),
+                    dir_id,
+                    size,
+                    mtime_ns))
+            elif stored_file[1:] != (size, mtime_ns):
+                _update_file(stored_file[0], size, mtime_ns)
+
+        if stored:
+            _delete_files(
+                [(file_id, filename) for filename, (file_id, size, mtime_ns) in stored.items()],
+                self.update_index)
+
+        if new_records:
+            # Hot path of the initial scan, skip query building overhead
+            db.cursor().executemany(SQL_INSERT_FILE_RECORDS, new_records)
+
+        if new_records and self.update_index:
+            _fts_insert_directory_files(dir_id, [r[0] for r in new_records])
+
+    def _sync_modified_files(self, dir_id, files):
+        file_ids = dict(Files
+                        .select(Files.filename, Files.id)
+                        .where((Files.directory == dir_id)
+                               & Files.filename.in_([filename for filename, size, mtime_ns in files]))
+                        .tuples())
+        for filename, size, mtime_ns in files:
+            if filename in file_ids:
+                _update_file(file_ids[filename], size, mtime_ns)
+
+    def _sync_subdirs(self, path, subdirs):
+        stored = set(self.children[path])
+        current = [os.path.join(path, name) for name in subdirs]
+
+        for subdir_path in current:
+            if subdir_path in stored:
+                stored.discard(subdir_path)
+            else:
+                self._create_dir(subdir_path)
+
+        for subdir_path in stored:
+            _delete_directories(_subtree_condition(Directories.path, subdir_path), self.update_index)
+            self.children[path].remove(subdir_path)
+            self._forget_dir(subdir_path)
+
+
+def _ignore_interrupt():
+    # Ctrl+C is sent to the whole process group, workers are stopped by parent once it cancels
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class _FileStage(object):
+    """
+    Work on files done a page at a time, with batches of files handed over
+    to a pool of worker processes unless there are only a few files.
+
+    Pool is started once enough files are expected and is kept for files
+    of later queries, until the stage is closed.
+    """
+
+    def __init__(
+            self,
+            stage,
+            page_size,
+            batch_size,
+            pool_threshold,
+            progress=None,
+            cancel_event=None,
+            checkpoint=None,
+            num_processes=None):
+        self.stage = stage
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.pool_threshold = pool_threshold
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.checkpoint = checkpoint
+        self.num_processes = num_processes
+
+        self.num_done = 0
+        self.num_expected = 0
+        self._ppe = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._ppe is not None:
+            self._ppe.shutdown(cancel_futures=True)
+            self._ppe = None
+
+    def run(self, query, work_batch, batch_item, store):
+        """
+        :param query: select of rows starting with Files.id
+        :param work_batch: function run in worker process with a list of
+                           batch_item(row), returning list of results in the same order
+        :param store: called with a page of rows and their results
+        :return: True if completed, False if cancelled
+        """
+        num_files = query.count()
+        if not num_files:
+            return True
+        if self.progress is not None and not self.num_expected:
+            self.progress.begin_stage(self.stage, num_files)
+        self.num_expected += num_files
+
+        if self._ppe is None and self.num_expected - self.num_done >= self.pool_threshold:
+            # Forking process with running Qt and database threads is unsafe
+            self._ppe = ProcessPoolExecutor(
+                max_workers=self.num_processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_ignore_interrupt)
+
+        last_id = 0
+        last_checkpoint = time.monotonic()
+        while True:
+            rows = list(query
+                        .where(Files.id > last_id)
+                        .order_by(Files.id)
+                        .limit(self.page_size)
+                        .tuples())
+            if not rows:
+                return True
+            last_id = rows[-1][0]
+
+            batches = list(chunked([batch_item(row) for row in rows], self.batch_size))
+            if self._ppe is not None:
+                results = self._ppe.map(work_batch, batches)
+            else:
+                results = map(work_batch, batches)
+            store(rows, [result for batch in results for result in batch])
+
+            self.num_done += len(rows)
+            if self.progress is not None:
+                self.progress.update_files(self.stage, self.num_done, self.num_expected)
+
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                if self.checkpoint is not None:
+                    self.checkpoint([])
+                return False
+
+            if self.checkpoint is not None and time.monotonic() - last_checkpoint > CHECKPOINT_INTERVAL:
+                self.checkpoint([])
+                last_checkpoint = time.monotonic()
+
+
+def extract_metadata(
+        progress=None,
+        cancel_event=None,
+        checkpoint=None,
+        num_processes=None,
+        directory_ids=None):
+    """
+    Read audio metadata of all files which do not have it stored yet.
+
+    Headers are parsed in a pool of worker processes, unless there are only a few files.
+
+    :param directory_ids: read only files of these directories
+    :return: True if completed, False if cancelled
+    """
+    missing = (Files
+               .select(Files.id, file_full_path())
+               .join_from(Files, Directories, on=(Files.directory == Directories.id))
+               .join_from(Files, FileMetadata, JOIN.LEFT_OUTER, on=(FileMetadata.file == Files.id))
+               .where(FileMetadata.file.is_null()))
+    if directory_ids is not None:
+        missing = missing.where(Files.directory.in_(list(directory_ids)))
+
+    def store(rows, results):
+        records = []
+        for (file_id, full_path), metadata in zip(rows, results):
+            if metadata is None:
+                records.append((file_id, None, None, None, None))
+            else:
+                records.append((
+                    file_id,
+                    metadata.duration,
+                    metadata.sample_rate,
+                    metadata.channels,
+                    metadata.bit_depth))
+
+        fields = [
+            FileMetadata.file,
+            FileMetadata.duration,
+            FileMetadata.sample_rate,
+            FileMetadata.channels,
+            FileMetadata.bit_depth,
+        ]
+        for batch in chunked(records, 100):
+            FileMetadata.insert_many(batch, fields=fields).execute()
+
+    with _FileStage(
+            STAGE_METADATA,
+            METADATA_PAGE_SIZE,
+            METADATA_BATCH_SIZE,
+            METADATA_POOL_THRESHOLD,
+            progress=progress,
+            cancel_event=cancel_event,
+            checkpoint=checkpoint,
+            num_processes=num_processes) as stage:
+        return stage.run(missing, read_metadata_batch, lambda row: row[1], store)
+
+
+def extract_features(
+        progress=None,
+        cancel_event=None,
+        checkpoint=None,
+        num_processes=None,
+        directory_ids=None):
+    """
+    Compute feature vectors for similarity search of all files which do not have them stored yet.
+
+    Files are decoded and analysed in a pool of worker processes, unless there are only a few of them.
+
+    :param directory_ids: analyse only files of these directories
+    :return: True if completed, False if cancelled
+    """
+    missing = (Files
+               .select(Files.id, file_full_path())
+               .join_from(Files, Directories, on=(Files.directory == Directories.id))
+               .join_from(Files, FileFeatures, JOIN.LEFT_OUTER, on=(FileFeatures.file == Files.id))
+               .where(FileFeatures.file.is_null()))
+    if directory_ids is not None:
+        missing = missing.where(Files.directory.in_(list(directory_ids)))
+
+    def store(rows, vectors):
+        records = [(file_id, vector) for (file_id, full_path), vector in zip(rows, vectors)]
+        with db.atomic():
+            for batch in chunked(records, 100):
+                FileFeatures.insert_many(batch, fields=[FileFeatures.file, FileFeatures.vector]).execute()
+            _features_changed()
+
+    with _FileStage(
+            STAGE_FEATURES,
+            FEATURES_PAGE_SIZE,
+            FEATURES_BATCH_SIZE,
+            FEATURES_POOL_THRESHOLD,
+            progress=progress,
+            cancel_event=cancel_event,
+            checkpoint=checkpoint,
+            num_processes=num_processes) as stage:
+        return stage.run(missing, compute_features_batch, lambda row: row[1], store)
+
+
+def feature_matrix_path():
+    """
+    Feature matrix file is kept next to database file.
+    """
+    return os.path.splitext(db.database)[0] + '.features'
+
+
+def _features_changed():
+    """
+    Mark feature matrix file as out of date.
+
+    Has to be called in the same transaction which stores or deletes
+    feature vectors, so that the matrix is never taken for the current one
+    while file ids in it may already refer to other files.
+    """
+    # Random instead of incremented, so that matrix of a deleted database
+    # does not match generation of a new one
+    get_config()[FEATURES_GENERATION_KEY] = random.getrandbits(63)
+
+
+# Matrix is written by refreshes as well as by searches which find it out of date
+_feature_matrix_lock = threading.Lock()
+
+
+def update_feature_matrix():
+    """
+    Write stored feature vectors to feature matrix file unless it is up to date.
+
+    Similarity search reads the whole matrix at once from there, which is
+    much faster than reading vectors from the database.
+    """
+    with _feature_matrix_lock, db.atomic():
+        # Vectors are read in the same transaction as generation they belong to
+        generation = get_config().get(FEATURES_GENERATION_KEY, 0)
+        header = FeatureMatrix.read_header(feature_matrix_path())
+        if header is not None and header[2] == generation:
+            return
+
+        rows = (FileFeatures
+                .select(FileFeatures.file, FileFeatures.vector)
+                .where(FileFeatures.vector.is_null(False))
+                .order_by(FileFeatures.file)
+                .tuples())
+        ids = []
+        vectors = []
+        for file_id, vector in rows:
+            ids.append(file_id)
+            vectors.append(vector)
+        matrix = FeatureMatrix(
+            np.array(ids, dtype=np.int64),
+            np.frombuffer(b''.join(vectors), dtype=np.float32).reshape(len(ids), FEATURE_SIZE),
+            generation)
+        matrix.save(feature_matrix_path())
+
+
+similarity_indexes = SimilarityIndexCache()
+
+
+def file_id_of(path) -> Optional[int]:
+    """
+    :return: id of indexed file, None if it is not in the index
+    """
+    path = os.path.normpath(path)
+    row = (Files
+           .select(Files.id)
+           .join_from(Files, Directories, on=(Files.directory == Directories.id))
+           .where((Directories.path == os.path.dirname(path)) & (Files.filename == os.path.basename(path)))
+           .tuples()
+           .first())
+    return row[0] if row is not None else None
+
+
+def find_similar(path, count=DEFAULT_NUM_NEIGHBOURS, exact=False) -> Optional[list]:
+    """
+    Files which sound most like given one, according to the feature matrix file.
+
+    The file is written again first if feature vectors changed since.
+
+    :return: list of (id, filename, full_path, directory) tuples like
+             search results, nearest first, None if file was not analysed
+    """
+    update_feature_matrix()
+    index = similarity_indexes.get(feature_matrix_path())
+    file_id = file_id_of(path)
+    if index is None or file_id is None:
+        return None
+    neighbours = index.nearest(file_id, count, exact=exact)
+    if neighbours is None:
+        return None
+
+    rows = {
+        row[0]: row
+        for row in (Files
+                    .select(Files.id, Files.filename, file_full_path(), Directories.search_path)
+                    .join_from(Files, Directories, on=(Files.directory == Directories.id))
+                    .where(Files.id.in_([neighbour_id for neighbour_id, distance in neighbours]))
+                    .tuples())}
+    # Matrix may still have files which were removed since it was written
+    return [rows[neighbour_id] for neighbour_id, distance in neighbours if neighbour_id in rows]
+
+
+def hash_duplicate_candidates(
+        progress_callback=None,
+        progress_rate=DEFAULT_PROGRESS_RATE,
+        cancel_event=None,
+        num_processes=None):
+    """
+    Store content hashes of files which may have duplicates and were not hashed yet.
+
+    Files are compared in stages, each reading more of fewer files: only
+    files of the same size as some other file get the hash of their first
+    and last block, and only those whose block hashes collide are hashed
+    whole. Files are hashed in a pool of worker processes unless there are
+    only a few of them, and each page of hashes is committed on its own.
+
+    :return: True if completed, False if cancelled
+    """
+    same_size = (Files
+                 .select(Files.size)
+                 .where(Files.size > 0)
+                 .group_by(Files.size)
+                 .having(fn.COUNT(Files.id) > 1))
+    files = (Files
+             .select(Files.id, file_full_path(), Files.size)
+             .join_from(Files, Directories, on=(Files.directory == Directories.id))
+             .join_from(Files, FileHashes, JOIN.LEFT_OUTER, on=(FileHashes.file == Files.id)))
+    unhashed = files.where(FileHashes.file.is_null() & Files.size.in_(same_size))
+
+    progress = None
+    if progress_callback is not None:
+        progress = _ProgressReporter(progress_callback, max_rate=progress_rate)
+
+    def store_head_hashes(rows, digests):
+        records = [
+            (file_id, digest, digest if digest is not None and is_fully_read(size) else None)
+            for (file_id, full_path, size), digest in zip(rows, digests)]
+        with db.atomic():
+            for batch in chunked(records, 100):
+                (FileHashes
+                    .insert_many(batch, fields=[FileHashes.file, FileHashes.head_hash, FileHashes.full_hash])
+                    .execute())
+
+    def store_full_hashes(rows, digests):
+        with db.atomic():
+            for (file_id, full_path, size), digest in zip(rows, digests):
+                if digest is None:
+                    # Same as for files which could not be read in the first stage
+                    FileHashes.update(head_hash=None).where(FileHashes.file == file_id).execute()
+                else:
+                    FileHashes.update(full_hash=digest).where(FileHashes.file == file_id).execute()
+
+    with _FileStage(
+            STAGE_HASH,
+            HASH_PAGE_SIZE,
+            HASH_BATCH_SIZE,
+            HASH_POOL_THRESHOLD,
+            progress=progress,
+            cancel_event=cancel_event,
+            num_processes=num_processes) as stage:
+        if not stage.run(unhashed, hash_head_tail_batch, lambda row: (row[1], row[2]), store_head_hashes):
+            return False
+
+        colliding = (FileHashes
+                     .select(Files.size, FileHashes.head_hash)
+                     .join_from(FileHashes, Files, on=(FileHashes.file == Files.id))
+                     .where(FileHashes.head_hash.is_null(False))
+                     .group_by(Files.size, FileHashes.head_hash)
+                     .having(fn.COUNT(FileHashes.file) > 1))
+        partially_hashed = files.where(
+            FileHashes.full_hash.is_null()
+            & FileHashes.head_hash.is_null(False)
+            & Tuple(Files.size, FileHashes.head_hash).in_(colliding))
+        return stage.run(partially_hashed, hash_full_batch, lambda row: row[1], store_full_hashes)
+
+
+@dataclass
+class DuplicateGroup(object):
+    # Hex digest of contents shared by files
+    content_hash: str
+    size: int
+    paths: list
+
+    @property
+    def wasted_size(self):
+        return self.size * (len(self.paths) - 1)
+
+
+def find_duplicates() -> list:
+    """
+    Files with the same contents, according to hashes stored by hash_duplicate_candidates().
+
+    :return: list of DuplicateGroup, the ones wasting most space first
+    """
+    duplicate_hashes = (FileHashes
+                        .select(FileHashes.full_hash)
+                        .where(FileHashes.full_hash.is_null(False))
+                        .group_by(FileHashes.full_hash)
+                        .having(fn.COUNT(FileHashes.file) > 1))
+    rows = (Files
+            .select(FileHashes.full_hash, Files.size, file_full_path())
+            .join_from(Files, Directories, on=(Files.directory == Directories.id))
+            .join_from(Files, FileHashes, on=(FileHashes.file == Files.id))
+            .where(FileHashes.full_hash.in_(duplicate_hashes))
+            .order_by(FileHashes.full_hash, Directories.path, Files.filename)
+            .tuples())
+
+    groups = []
+    for content_hash, group_rows in groupby(rows, key=operator.itemgetter(0)):
+        group_rows = list(group_rows)
+        groups.append(DuplicateGroup(
+            content_hash=bytes(content_hash).hex(),
+            size=group_rows[0][1],
+            paths=[full_path for content_hash, size, full_path in group_rows]))
+    groups.sort(key=lambda group: group.wasted_size, reverse=True)
+    return groups
+
+
+def get_interrupted_rebuild():
+    """
+    :return: saved state of rebuild which was cancelled or interrupted, None if there is none
+    """
+    return get_config().get(REBUILD_STATE_KEY)
+
+
+def index_stats() -> dict:
+    """
+    :return: dict with indexed samples directory, numbers of stored rows,
+             size of database file and whether rebuild was interrupted
+    """
+    page_count, = db.execute_sql('PRAGMA page_count').fetchone()
+    page_size, = db.execute_sql('PRAGMA page_size').fetchone()
+    return {
+        'samples_directory': get_config().get('samples_directory'),
+        'num_directories': Directories.select().count(),
+        'num_files': Files.select().count(),
+        'num_files_with_metadata': (FileMetadata
+                                    .select()
+                                    .where(FileMetadata.sample_rate.is_null(False))
+                                    .count()),
+        'num_files_with_features': (FileFeatures
+                                    .select()
+                                    .where(FileFeatures.vector.is_null(False))
+                                    .count()),
+        'database_size': page_count * page_size,
+        'interrupted_rebuild': get_interrupted_rebuild() is not None,
+    }
+
+
+@dataclass
+class DirectoryListing(object):
+    # Modification time of directory when its listing was stored, None if it never was
+    mtime_ns: Optional[int]
+    # Names of subdirectories and files
+    directories: list
+    files: list
+
+
+def list_directory(path) -> Optional[DirectoryListing]:
+    """
+    Contents of directory as stored in the index, without touching the file system.
+
+    :return: None if directory is not indexed
+    """
+    row = (Directories
+           .select(Directories.id, Directories.mtime_ns)
+           .where(Directories.path == os.path.normpath(path))
+           .tuples()
+           .first())
+    if row is None:
+        return None
+    dir_id, mtime_ns = row
+
+    subdirectories = (Directories
+                      .select(Directories.path)
+                      .where(Directories.parent == dir_id)
+                      .tuples())
+    files = (Files
+             .select(Files.filename)
+             .where(Files.directory == dir_id)
+             .tuples())
+    return DirectoryListing(
+        mtime_ns=mtime_ns,
+        directories=[os.path.basename(subdir_path) for subdir_path, in subdirectories],
+        files=[filename for filename, in files])
+
+
+def _run_sync(
+        samples_directory,
+        full,
+        roots,
+        supported_extensions,
+        progress_callback,
+        num_workers,
+        progress_rate,
+        cancel_event,
+        num_dirs_expected=0):
+    """
+    Sync files table committing progress regularly, so that it can be resumed.
+
+    In full mode search index is not updated until all files are stored.
+    Audio metadata and feature vectors of new files are read afterwards.
+    """
+    progress = None
+    if progress_callback is not None:
+        progress = _ProgressReporter(progress_callback, num_dirs_expected, progress_rate)
+
+    with db.atomic() as txn:
+        def checkpoint(pending):
+            get_config()[REBUILD_STATE_KEY] = {
+                'samples_directory': samples_directory,
+                'full': full,
+                'pending': pending,
+                'num_dirs_expected': num_dirs_expected,
+            }
+            txn.commit()
+            search_cache.invalidate()
+
+        sync = _FilesTableSync(
+            samples_directory, supported_extensions, update_index=not full, num_workers=num_workers)
+
+        completed = sync.sync(
+            roots,
+            progress=progress,
+            cancel_event=cancel_event,
+            checkpoint=checkpoint)
+        if not completed:
+            return False
+
+        if full:
+            FilesIndex.rebuild()
+            FilesIndex.optimize()
+            full = False
+
+        completed = extract_metadata(
+            progress=progress,
+            cancel_event=cancel_event,
+            checkpoint=checkpoint)
+        if not completed:
+            return False
+
+        completed = extract_features(
+            progress=progress,
+            cancel_event=cancel_event,
+            checkpoint=checkpoint)
+        if not completed:
+            return False
+
+        config = get_config()
+        config['samples_directory'] = samples_directory
+        if REBUILD_STATE_KEY in config:
+            del config[REBUILD_STATE_KEY]
+
+    search_cache.invalidate()
+    update_feature_matrix()
+    return True
+
+
+def rebuild_files_table(
+        samples_directory,
+        supported_extensions=DEFAULT_SUPPORTED_EXTENSIONS,
+        progress_callback=None,
+        num_workers=DEFAULT_NUM_WORKERS,
+        progress_rate=DEFAULT_PROGRESS_RATE,
+        cancel_event=None):
+    """
+    Recreate search database from scratch.
+
+    :return: True if completed, False if cancelled
+    """
+    samples_directory = os.path.normpath(samples_directory)
 
     with db.atomic():
+        num_dirs_expected = Directories.select().count()
+
+        FilesIndex.delete_all()
+        # Ids of files are reused by the new rows
+        FileHashes.delete().execute()
+        FileFeatures.delete().execute()
+        FileMetadata.delete().execute()
         Files.delete().execute()
+        Directories.delete().execute()
+        _features_changed()
+
+        get_config()[REBUILD_STATE_KEY] = {
+            'samples_directory': samples_directory,
+            'full': True,
+            'pending': [samples_directory],
+            'num_dirs_expected': num_dirs_expected,
+        }
+    search_cache.invalidate()
+
+    return _run_sync(
+        samples_directory, True, None, supported_extensions,
+        progress_callback, num_workers, progress_rate, cancel_event, num_dirs_expected)
+
 
-        for batch in chunked(yield_records(), 100):
-            Files.insert_many(batch).execute()
+def update_files_table(
+        samples_directory,
+        supported_extensions=DEFAULT_SUPPORTED_EXTENSIONS,
+        progress_callback=None,
+        num_workers=DEFAULT_NUM_WORKERS,
+        progress_rate=DEFAULT_PROGRESS_RATE,
+        cancel_event=None):
+    """
+    Incrementally bring search database up to date, touching only changed rows.
+
+    If full rebuild was interrupted before, it is finished instead.
+
+    :return: True if completed, False if cancelled
+    """
+    samples_directory = os.path.normpath(samples_directory)
+
+    state = get_interrupted_rebuild()
+    full = state is not None and state['full']
+
+    return _run_sync(
+        samples_directory, full, None, supported_extensions,
+        progress_callback, num_workers, progress_rate, cancel_event)
+
+
+def resume_files_table(
+        supported_extensions=DEFAULT_SUPPORTED_EXTENSIONS,
+        progress_callback=None,
+        num_workers=DEFAULT_NUM_WORKERS,
+        progress_rate=DEFAULT_PROGRESS_RATE,
+        cancel_event=None):
+    """
+    Continue interrupted rebuild or update from the last checkpoint.
+
+    :return: None if there was nothing to resume, True if completed, False if cancelled
+    """
+    state = get_interrupted_rebuild()
+    if state is None:
+        return None
 
-        FilesIndex.rebuild()
-        FilesIndex.optimize()
+    return _run_sync(
+        state['samples_directory'], state['full'], state['pending'], supported_extensions,
+        progress_callback, num_workers, progress_rate, cancel_event, state['num_dirs_expected'])
+
+
+def sync_directories(
+        samples_directory,
+        paths,
+        supported_extensions=DEFAULT_SUPPORTED_EXTENSIONS,
+        num_workers=DEFAULT_NUM_WORKERS,
+        cancel_event=None):
+    """
+    Update search database with current contents of given directories,
+    e.g. as reported by filesystem watcher. All changes are applied in single transaction.
+
+    Feature vectors of new files are computed afterwards, which takes much
+    longer, so only that part can be cancelled. Feature matrix file is
+    written again by the next similarity search.
+
+    :return: False if analysis of new files was cancelled, True otherwise
+    """
+    state = get_interrupted_rebuild()
+    if state is not None and state['full']:
+        # Search index is rebuilt only once all files are stored
+        return True
+
+    samples_directory = os.path.normpath(samples_directory)
+    paths = [os.path.normpath(path) for path in paths]
+
+    with db.atomic():
+        sync = _FilesTableSync(
+            samples_directory, supported_extensions, update_index=True, num_workers=num_workers)
+        sync.sync_directories(paths)
+        # Whole transaction cannot be cancelled, so files pending from elsewhere
+        # are left for the next refresh
+        if sync.synced_dir_ids:
+            extract_metadata(directory_ids=sync.synced_dir_ids)
+    search_cache.invalidate()
 
-        get_config()['samples_directory'] = samples_directory
+    if not sync.synced_dir_ids:
+        return True
+    return extract_features(cancel_event=cancel_event, directory_ids=sync.synced_dir_ids)
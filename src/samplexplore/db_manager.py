@@ -1,19 +1,65 @@
 from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import logging
-from typing import Optional, Protocol
-
-from playhouse.shortcuts import model_to_dict
+import os
+import threading
+from typing import List, Optional, Protocol, Tuple
 
 from qtpy.QtCore import *
 
 from . import db_core
 from .db_core import DBRebuildProgressInfo
+from .scanner import DEFAULT_NUM_WORKERS
+from .similarity import DEFAULT_NUM_NEIGHBOURS
+from .watcher import FilesystemWatcher
+
+
+SEARCH_PAGE_SIZE = 200
+NUM_READ_CONNECTIONS = 2
 
 
 class RebuildProgressCallback(Protocol):
     def __call__(self, status_info: DBRebuildProgressInfo): ...
 
 
+@dataclass
+class SearchPage(object):
+    # (id, filename, full_path, directory) tuples
+    rows: List[Tuple[int, str, str, str]]
+    results: db_core.SearchResults
+    generation: int = 0
+    # Connection the results are read from
+    reader: Optional['ReadConnection'] = None
+
+    @property
+    def has_more(self):
+        return not self.results.exhausted
+
+
+class ReadConnection(object):
+    """
+    Thread with its own read-only database connection.
+
+    Search kept open for fetch_more is only touched from that thread. While
+    it is open, the connection keeps reading the snapshot it started with.
+    """
+
+    def __init__(self, name, db_ready: threading.Event):
+        self.tpe = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.db_ready = db_ready
+        self.search_results = None
+
+    def run(self, fn, *args, **kwargs):
+        self.db_ready.wait()
+        db_core.connect_reader()
+        return fn(*args, **kwargs)
+
+    def close_search(self):
+        if self.search_results is not None:
+            self.search_results.close()
+            self.search_results = None
+
+
 class ThreadProxy(QObject):
 
     progress = Signal()
@@ -41,24 +87,70 @@ class ThreadProxy(QObject):
 
 class DBManager(QObject):
 
-    def __init__(self, log_proxy):
+    filesChanged = Signal(object)
+    rebuildProgress = Signal(object)
+
+    def __init__(self, log_proxy, num_readers=NUM_READ_CONNECTIONS):
         super().__init__()
         self.log_proxy = log_proxy
-        self.tpe = ThreadPoolExecutor(max_workers=1)
+        # All writes go through single thread, while searches are served by
+        # read connections from the last committed state of the database
+        self.tpe = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self.db_ready = threading.Event()
+        self.readers = [
+            ReadConnection('db-reader-{}'.format(i), self.db_ready)
+            for i in range(max(1, num_readers))]
+        self._next_reader = 0
+        self.watcher = None
+        self.rebuild_cancel_event = threading.Event()
+        # Set when watcher is stopped, a cancelled rebuild must not stop later syncs of changes
+        self.watcher_cancel_event = threading.Event()
+        # Incremented from UI thread by each search, older ones are abandoned
+        self.search_generation = 0
 
     def shutdown(self):
+        self.stop_watcher()
+        # Rebuild in progress will be resumed on next start
+        self.cancel_rebuild()
+        # Let readers waiting for a database which was never set up finish
+        self.db_ready.set()
+        self.search_generation += 1
+        for reader in self.readers:
+            reader.tpe.shutdown()
         self.tpe.shutdown()
 
+    def cancel_rebuild(self):
+        """
+        Stop running and queued rebuilds of search database at the next checkpoint.
+        """
+        self.rebuild_cancel_event.set()
+
     def _run_async(self, result_callback, fn, *args, **kwargs):
         proxy = ThreadProxy(self.log_proxy, fn, *args, **kwargs)
         if result_callback is not None:
             proxy.result.connect(result_callback)
         self.tpe.submit(proxy.run).add_done_callback(proxy.on_done)
 
+    def _run_read_async(self, reader: ReadConnection, result_callback, fn, *args, **kwargs):
+        proxy = ThreadProxy(self.log_proxy, reader.run, fn, *args, **kwargs)
+        if result_callback is not None:
+            proxy.result.connect(result_callback)
+        reader.tpe.submit(proxy.run).add_done_callback(proxy.on_done)
+
+    def _pick_reader(self) -> ReadConnection:
+        reader = self.readers[self._next_reader]
+        self._next_reader = (self._next_reader + 1) % len(self.readers)
+        return reader
+
     def connect(self, db_path, result_callback=None):
+        # Connections are opened by each thread on first use
+        db_core.connect(db_path)
+
         def db_connect():
-            db_core.connect(db_path)
-            db_core.create_tables()
+            try:
+                db_core.create_tables()
+            finally:
+                self.db_ready.set()
 
         self._run_async(result_callback, db_connect)
 
@@ -66,25 +158,275 @@ class DBManager(QObject):
             self,
             samples_directory,
             progress_callback: Optional[RebuildProgressCallback] = None,
-            result_callback=None):
+            result_callback=None,
+            num_workers=DEFAULT_NUM_WORKERS):
+        """
+        Progress is reported through rebuildProgress signal unless progress_callback is given,
+        in which case it is called directly from database thread.
+        """
+        if progress_callback is None:
+            progress_callback = self.rebuildProgress.emit
+        self.rebuild_cancel_event.clear()
 
         self._run_async(
             result_callback,
             db_core.rebuild_files_table,
             samples_directory,
-            progress_callback=progress_callback)
+            progress_callback=progress_callback,
+            num_workers=num_workers,
+            cancel_event=self.rebuild_cancel_event)
 
-    def search_file(
+    def update_files_table(
+            self,
+            samples_directory,
+            progress_callback: Optional[RebuildProgressCallback] = None,
+            result_callback=None,
+            num_workers=DEFAULT_NUM_WORKERS):
+        """
+        Progress is reported through rebuildProgress signal unless progress_callback is given,
+        in which case it is called directly from database thread.
+        """
+        if progress_callback is None:
+            progress_callback = self.rebuildProgress.emit
+        self.rebuild_cancel_event.clear()
+
+        self._run_async(
+            result_callback,
+            db_core.update_files_table,
+            samples_directory,
+            progress_callback=progress_callback,
+            num_workers=num_workers,
+            cancel_event=self.rebuild_cancel_event)
+
+    def resume_files_table(
             self,
-            phrase,
+            progress_callback: Optional[RebuildProgressCallback] = None,
+            result_callback=None,
+            num_workers=DEFAULT_NUM_WORKERS):
+        """
+        Continue rebuild interrupted by cancel or application exit.
+        Result is None if there was nothing to resume.
+        """
+        if progress_callback is None:
+            progress_callback = self.rebuildProgress.emit
+        self.rebuild_cancel_event.clear()
+
+        self._run_async(
+            result_callback,
+            db_core.resume_files_table,
+            progress_callback=progress_callback,
+            num_workers=num_workers,
+            cancel_event=self.rebuild_cancel_event)
+
+    def find_duplicates(
+            self,
+            progress_callback: Optional[RebuildProgressCallback] = None,
             result_callback=None):
-        def db_search_file():
-            res = db_core.search_file(phrase)
-            if res is not None:
-                return [model_to_dict(m) for m in res]
+        """
+        Hash files which may have duplicates and were not hashed yet, then find them.
+
+        Result is a list of DuplicateGroup, None if hashing was cancelled.
+        Progress is reported like for rebuild, and cancel_rebuild() stops hashing too.
+        """
+        if progress_callback is None:
+            progress_callback = self.rebuildProgress.emit
+        self.rebuild_cancel_event.clear()
+
+        def db_find_duplicates():
+            if not db_core.hash_duplicate_candidates(
+                    progress_callback=progress_callback,
+                    cancel_event=self.rebuild_cancel_event):
+                return None
+            return db_core.find_duplicates()
+
+        self._run_async(result_callback, db_find_duplicates)
+
+    def apply_directory_changes(
+            self,
+            samples_directory,
+            paths,
+            full=False,
+            result_callback=None,
+            num_workers=DEFAULT_NUM_WORKERS):
+        """
+        Store current contents of given directories, or of the whole samples
+        directory if full. Full sync, or analysis of new files otherwise,
+        is cancelled by stop_watcher().
+        """
+        def db_apply_directory_changes():
+            if full:
+                db_core.update_files_table(
+                    samples_directory,
+                    num_workers=num_workers,
+                    cancel_event=self.watcher_cancel_event)
             else:
-                return []
+                db_core.sync_directories(
+                    samples_directory,
+                    paths,
+                    num_workers=num_workers,
+                    cancel_event=self.watcher_cancel_event)
+            return paths
 
         self._run_async(
             result_callback,
+            db_apply_directory_changes)
+
+    def list_directory(self, path) -> Optional[db_core.DirectoryListing]:
+        """
+        Read stored directory listing on the calling thread.
+
+        Meant for UI thread, which gets its own read-only connection: the
+        lookup touches a few index pages only and never waits for writer.
+        """
+        self.db_ready.wait()
+        db_core.connect_reader()
+        return db_core.list_directory(path)
+
+    def start_watcher(self, samples_directory, num_workers=DEFAULT_NUM_WORKERS):
+        if self.watcher is not None and self.watcher.root == os.path.normpath(samples_directory):
+            return
+        self.stop_watcher()
+        self.watcher_cancel_event.clear()
+
+        def on_changes(paths, overflow):
+            logging.info("Detected changes in %d directories", len(paths))
+            self.apply_directory_changes(
+                samples_directory,
+                paths,
+                full=overflow,
+                result_callback=self.filesChanged.emit,
+                num_workers=num_workers)
+
+        self.watcher = FilesystemWatcher(samples_directory, on_changes)
+        self.watcher.start()
+
+    def stop_watcher(self):
+        self.watcher_cancel_event.set()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _is_search_stale(self, generation):
+        return generation != self.search_generation
+
+    def _deliver_search_page(self, generation, result_callback):
+        def deliver(page):
+            # Results arriving after a newer search was started are dropped
+            if page is not None and not self._is_search_stale(generation) and result_callback is not None:
+                result_callback(page)
+        return deliver
+
+    def cancel_search(self):
+        """
+        Abandon running and queued searches, their results will not be delivered.
+        """
+        self.search_generation += 1
+        self._close_stale_searches()
+
+    def _close_stale_searches(self, keep: Optional[ReadConnection] = None):
+        generation = self.search_generation
+
+        def db_close_search(reader):
+            # Reader may have started a newer search meanwhile
+            if not self._is_search_stale(generation):
+                reader.close_search()
+
+        for reader in self.readers:
+            if reader is not keep:
+                self._run_read_async(reader, None, db_close_search, reader)
+
+    def search_file(
+            self,
+            query,
+            result_callback=None,
+            page_size=SEARCH_PAGE_SIZE):
+        """
+        Result is a SearchPage with first page_size matches, pass it to
+        fetch_more to get the next ones.
+
+        Starting a search supersedes the previous one: if it has not started
+        yet it is skipped, if it is running it gets interrupted, and
+        its results are never delivered.
+        """
+        self.search_generation += 1
+        generation = self.search_generation
+        reader = self._pick_reader()
+
+        def db_search_file():
+            if self._is_search_stale(generation):
+                return None
+            reader.close_search()
+            try:
+                with db_core.cancellable(lambda: self._is_search_stale(generation)):
+                    results = db_core.search_file_paged(query)
+                    rows = results.fetch(page_size)
+            except db_core.QueryCancelled:
+                return None
+            if not results.exhausted:
+                reader.search_results = results
+            return SearchPage(rows, results, generation, reader)
+
+        self._run_read_async(
+            reader,
+            self._deliver_search_page(generation, result_callback),
             db_search_file)
+        self._close_stale_searches(keep=reader)
+
+    def find_similar(
+            self,
+            path,
+            result_callback=None,
+            count=DEFAULT_NUM_NEIGHBOURS):
+        """
+        Result is a SearchPage with files which sound most like given one,
+        nearest first. It has no rows if the file was not analysed.
+
+        Like search_file, it supersedes the previous search.
+        """
+        self.search_generation += 1
+        generation = self.search_generation
+        reader = self._pick_reader()
+
+        def db_find_similar():
+            if self._is_search_stale(generation):
+                return None
+            reader.close_search()
+            rows = db_core.find_similar(path, count)
+            return SearchPage(rows or [], db_core.SearchResults(), generation, reader)
+
+        self._run_read_async(
+            reader,
+            self._deliver_search_page(generation, result_callback),
+            db_find_similar)
+        self._close_stale_searches(keep=reader)
+
+    def fetch_more(
+            self,
+            page: SearchPage,
+            result_callback=None,
+            page_size=SEARCH_PAGE_SIZE):
+        """
+        Result is a SearchPage with matches following given page, it is not
+        delivered if a newer search was started in the meantime.
+        """
+        reader = page.reader
+
+        def db_fetch_more():
+            results = page.results
+            if self._is_search_stale(page.generation) or results is not reader.search_results:
+                return None
+            try:
+                with db_core.cancellable(lambda: self._is_search_stale(page.generation)):
+                    rows = results.fetch(page_size)
+            except db_core.QueryCancelled:
+                return None
+            if results.exhausted:
+                reader.search_results = None
+            return SearchPage(rows, results, page.generation, reader)
+
+        if reader is None:
+            return
+        self._run_read_async(
+            reader,
+            self._deliver_search_page(page.generation, result_callback),
+            db_fetch_more)
@@ -0,0 +1,71 @@
+import os
+
+from qtpy.QtCore import *
+from qtpy.QtWidgets import *
+
+
+def size_to_str(size) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+
+
+class DuplicatesDialog(QDialog):
+    """
+    Groups of files with the same contents, biggest waste of space first.
+
+    Activating a file emits fileActivated with its path.
+    """
+
+    fileActivated = Signal(str)
+
+    PathRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super(DuplicatesDialog, self).__init__(parent=parent)
+
+        self.setWindowTitle("Duplicate files")
+
+        self.layout = QVBoxLayout()
+
+        self.summaryLabel = QLabel()
+        self.layout.addWidget(self.summaryLabel)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(['File', 'Size'])
+        self.tree.setUniformRowHeights(True)
+        self.tree.itemActivated.connect(self.on_item_activated)
+        self.tree.setMinimumSize(700, 400)
+        self.layout.addWidget(self.tree)
+
+        self.setLayout(self.layout)
+
+    def set_groups(self, groups):
+        """
+        :param groups: list of DuplicateGroup
+        """
+        self.tree.clear()
+        wasted_size = 0
+        for group in groups:
+            wasted_size += group.wasted_size
+            group_item = QTreeWidgetItem([
+                '{} copies of {}'.format(len(group.paths), os.path.basename(group.paths[0])),
+                size_to_str(group.size)])
+            for path in group.paths:
+                item = QTreeWidgetItem(group_item, [path])
+                item.setData(0, self.PathRole, path)
+            self.tree.addTopLevelItem(group_item)
+
+        self.tree.resizeColumnToContents(1)
+        if groups:
+            self.summaryLabel.setText('{} files have copies, removing the copies would free {}'.format(
+                len(groups), size_to_str(wasted_size)))
+        else:
+            self.summaryLabel.setText('No duplicate files found')
+
+    def on_item_activated(self, item, column):
+        path = item.data(0, self.PathRole)
+        if path is not None:
+            self.fileActivated.emit(path)
@@ -1,9 +1,23 @@
 import os
 import pathlib
+import re
 import subprocess
 import sys
 
 
+_NATURAL_SORT_RE = re.compile(r'(\d+)')
+
+
+def natural_sort_key(name):
+    """
+    Case insensitive key ordering numbers by value, e.g. "kick 2" before "kick 10".
+    """
+    parts = _NATURAL_SORT_RE.split(name.casefold())
+    # Digits are at odd positions, so parts of two keys are always comparable
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+
 def open_file(path: pathlib.Path):
     os.startfile(str(path), 'open')
 
@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from qtpy.QtCore import *
+from qtpy.QtWidgets import *
+
+from .db_core import DirectoryListing
+from .fileutils import natural_sort_key
+
+
+# Directory is not checked against file system again for this many seconds
+FRESHNESS_CHECK_INTERVAL = 30.0
+NUM_FRESHNESS_CHECK_WORKERS = 1
+
+ListDirectory = Callable[[str], Optional[DirectoryListing]]
+
+
+class _Node(object):
+    """
+    Entry of the tree, children are None until directory has been listed.
+    """
+
+    __slots__ = ('name', 'path', 'is_dir', 'parent', 'row', 'children')
+
+    def __init__(self, name, path, is_dir, parent=None, row=0):
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.parent = parent
+        self.row = row
+        self.children = None
+
+    @property
+    def sort_key(self):
+        return not self.is_dir, natural_sort_key(self.name)
+
+
+class FreshnessChecker(QObject):
+    """
+    Compares modification times of listed directories with the stored ones
+    in background, as stat of a directory on network drive can take a while.
+
+    Each directory is checked at most once per interval, staleDirectory is
+    emitted from the worker thread for those which have changed or are gone.
+    """
+
+    staleDirectory = Signal(str)
+
+    def __init__(self, interval=FRESHNESS_CHECK_INTERVAL, num_workers=NUM_FRESHNESS_CHECK_WORKERS, parent=None):
+        super(FreshnessChecker, self).__init__(parent)
+        self.interval = interval
+        self._tpe = ThreadPoolExecutor(
+            max_workers=num_workers,
+            thread_name_prefix='freshness')
+        # Path -> monotonic time of the last check
+        self._checked = {}
+
+    def check(self, path, stored_mtime_ns):
+        now = time.monotonic()
+        last_checked = self._checked.get(path)
+        if last_checked is not None and now - last_checked < self.interval:
+            return
+        self._checked[path] = now
+        self._tpe.submit(self._check, path, stored_mtime_ns)
+
+    def _check(self, path, stored_mtime_ns):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            # Removal is stored with listing of the parent
+            logging.info("Listed directory '%s' is gone", path)
+            self.staleDirectory.emit(os.path.dirname(path))
+            return
+        except OSError as e:
+            logging.debug("Could not check freshness of '%s': %s", path, e)
+            return
+        if mtime_ns != stored_mtime_ns:
+            logging.info("Stored listing of '%s' is out of date", path)
+            self.staleDirectory.emit(path)
+
+    def shutdown(self):
+        self._tpe.shutdown(wait=False, cancel_futures=True)
+
+
+class IndexTreeModel(QAbstractItemModel):
+    """
+    Samples directory tree served from search database instead of file system.
+
+    Browsing does not wait for the file system, which makes it instant on
+    network drives. Directories are listed from the index when the view
+    expands them, and each listing is then compared with the file system
+    by FreshnessChecker, see refresh_directories() for applying changes.
+
+    :param list_directory: function returning DirectoryListing of path or
+                           None if it is not indexed, called on UI thread
+    """
+
+    FilePathRole = Qt.UserRole + 1
+
+    def __init__(self, list_directory: ListDirectory, parent=None):
+        super(IndexTreeModel, self).__init__(parent)
+        self.list_directory = list_directory
+        self.freshness_checker = FreshnessChecker(parent=self)
+        self.icon_provider = QFileIconProvider()
+        self._root = None
+
+    @property
+    def root_path(self):
+        return self._root.path if self._root is not None else None
+
+    def set_root_path(self, path):
+        self.beginResetModel()
+        path = os.path.normpath(path)
+        self._root = _Node(os.path.basename(path), path, True)
+        self.endResetModel()
+        self._load(self._root)
+
+    def reload(self):
+        if self._root is not None:
+            self.set_root_path(self._root.path)
+
+    def shutdown(self):
+        self.freshness_checker.shutdown()
+
+    def _node(self, index) -> Optional[_Node]:
+        return index.internalPointer() if index.isValid() else self._root
+
+    def _index(self, node):
+        if node is self._root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def _listing_nodes(self, node, listing):
+        children = [_Node(name, os.path.join(node.path, name), True, node)
+                    for name in listing.directories]
+        children.extend(_Node(name, os.path.join(node.path, name), False, node)
+                        for name in listing.files)
+        children.sort(key=lambda child: child.sort_key)
+        return children
+
+    def _load(self, node):
+        listing = self.list_directory(node.path)
+        if listing is None:
+            node.children = []
+            return
+        children = self._listing_nodes(node, listing)
+        for row, child in enumerate(children):
+            child.row = row
+
+        if children:
+            self.beginInsertRows(self._index(node), 0, len(children) - 1)
+            node.children = children
+            self.endInsertRows()
+        else:
+            node.children = children
+        self.freshness_checker.check(node.path, listing.mtime_ns)
+
+    def _find(self, path, load=False) -> Optional[_Node]:
+        if self._root is None:
+            return None
+        relpath = os.path.relpath(os.path.normpath(path), self._root.path)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return None
+
+        node = self._root
+        if relpath == os.curdir:
+            return node
+        for name in relpath.split(os.sep):
+            if node.children is None:
+                if not load or not node.is_dir:
+                    return None
+                self._load(node)
+            node = next((child for child in node.children if child.name == name), None)
+            if node is None:
+                return None
+        return node
+
+    def refresh_directories(self, paths):
+        """
+        Apply changes of stored listings of directories which have been loaded.
+        """
+        for path in paths:
+            node = self._find(path)
+            if node is not None and node.children is not None:
+                self._refresh(node)
+
+    def refresh_all(self):
+        """
+        Apply changes of all loaded listings, e.g. after the index was updated.
+        """
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node = pending.pop()
+            if node.children is None:
+                continue
+            self._refresh(node)
+            pending.extend(child for child in node.children if child.is_dir)
+
+    def _refresh(self, node):
+        listing = self.list_directory(node.path)
+        wanted = self._listing_nodes(node, listing) if listing is not None else []
+        wanted_keys = {(child.name, child.is_dir) for child in wanted}
+        parent_index = self._index(node)
+
+        # Remaining children keep their nodes, so expanded subdirectories and
+        # selection survive, and stay in the same order as wanted ones
+        for row in reversed(range(len(node.children))):
+            child = node.children[row]
+            if (child.name, child.is_dir) not in wanted_keys:
+                self.beginRemoveRows(parent_index, row, row)
+                del node.children[row]
+                self._renumber(node, row)
+                self.endRemoveRows()
+
+        for row, new_child in enumerate(wanted):
+            if row < len(node.children):
+                child = node.children[row]
+                if (child.name, child.is_dir) == (new_child.name, new_child.is_dir):
+                    continue
+            self.beginInsertRows(parent_index, row, row)
+            node.children.insert(row, new_child)
+            self._renumber(node, row)
+            self.endInsertRows()
+
+        if listing is not None:
+            self.freshness_checker.check(node.path, listing.mtime_ns)
+
+    @staticmethod
+    def _renumber(node, start):
+        for row in range(start, len(node.children)):
+            node.children[row].row = row
+
+    def index_for_path(self, path):
+        """
+        Index of file or directory, listing directories on the way as needed.
+        """
+        node = self._find(path, load=True)
+        return self._index(node) if node is not None else QModelIndex()
+
+    def file_path(self, index):
+        node = self._node(index)
+        return node.path if node is not None else None
+
+    def is_dir(self, index):
+        node = self._node(index)
+        return node is not None and node.is_dir
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self._node(parent)
+        if node is None or node.children is None or column != 0 or not 0 <= row < len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self._index(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if node is None or node.children is None:
+            return 0
+        return len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if node is None or not node.is_dir:
+            return False
+        return node.children is None or bool(node.children)
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return node is not None and node.is_dir and node.children is None
+
+    def fetchMore(self, parent):
+        if self.canFetchMore(parent):
+            self._load(self._node(parent))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.name
+        if role == Qt.ToolTipRole or role == self.FilePathRole:
+            return node.path
+        if role == Qt.DecorationRole:
+            return self.icon_provider.icon(
+                QFileIconProvider.Folder if node.is_dir else QFileIconProvider.File)
+        return None
+
+    def flags(self, index):
+        flags = super(IndexTreeModel, self).flags(index)
+        if index.isValid():
+            flags |= Qt.ItemIsDragEnabled
+        return flags
+
+    def mimeTypes(self):
+        return ["text/uri-list"]
+
+    def mimeData(self, indexes):
+        mimedata = QMimeData()
+        mimedata.setUrls([QUrl.fromLocalFile(self.file_path(index)) for index in indexes])
+        return mimedata
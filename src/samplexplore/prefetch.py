@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+
+from .audio_cache import DecodedAudioCache
+from .audio_decode import AudioDecodeError, DecodedAudio
+
+
+DEFAULT_NUM_NEIGHBOURS = 3
+DEFAULT_NUM_WORKERS = 2
+
+
+class AudioPrefetcher(object):
+    """
+    Decodes files which are likely to be previewed next into DecodedAudioCache.
+
+    Each call of prefetch() supersedes the previous one: queued files which
+    are no longer requested are cancelled, and a file whose turn comes after
+    it was superseded is skipped.
+    """
+
+    def __init__(self, audio_cache: DecodedAudioCache, num_workers=DEFAULT_NUM_WORKERS):
+        self.audio_cache = audio_cache
+
+        self._tpe = ThreadPoolExecutor(
+            max_workers=num_workers,
+            thread_name_prefix='prefetch')
+        # Files requested for playback do not wait behind prefetched ones
+        self._play_tpe = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='preview-load')
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._play_path = None
+
+    def prefetch(self, paths: Iterable[str]):
+        """
+        :param paths: files in order of priority
+        """
+        paths = list(dict.fromkeys(paths))
+
+        with self._lock:
+            futures = {}
+            for path, future in self._futures.items():
+                if path in paths and not future.done():
+                    futures[path] = future
+                else:
+                    future.cancel()
+
+            for path in paths:
+                if path not in futures and self.audio_cache.peek(path) is None:
+                    futures[path] = self._tpe.submit(self._load, path)
+
+            self._futures = futures
+
+    def cancel(self):
+        self.prefetch([])
+
+    def load(self, path, callback: Callable[[str, Optional[DecodedAudio]], None]):
+        """
+        Decode file requested for playback without blocking the caller.
+
+        Only the last requested file is loaded, earlier ones still waiting are skipped.
+
+        :param callback: called from worker thread with path and decoded audio,
+                         which is None if file is too big to be cached or could not be decoded
+        """
+        with self._lock:
+            self._play_path = path
+        self._play_tpe.submit(self._load_for_playback, path, callback)
+
+    def _load_for_playback(self, path, callback):
+        with self._lock:
+            if path != self._play_path:
+                return
+        try:
+            audio = self.audio_cache.get(path)
+        except (OSError, AudioDecodeError) as e:
+            logging.debug("Not decoding '%s': %s", path, e)
+            audio = None
+        callback(path, audio)
+
+    def _load(self, path):
+        with self._lock:
+            if path not in self._futures:
+                return
+        try:
+            self.audio_cache.get(path, prefetch=True)
+        except (OSError, AudioDecodeError) as e:
+            logging.debug("Not prefetching '%s': %s", path, e)
+
+    def shutdown(self):
+        self.cancel()
+        with self._lock:
+            self._play_path = None
+        self._play_tpe.shutdown(wait=True)
+        self._tpe.shutdown(wait=True)
@@ -0,0 +1,404 @@
+from collections import deque
+import copy
+import threading
+import time
+from typing import Callable
+import wave
+
+import numpy as np
+
+from .audio_decode import DecodedAudio
+
+try:
+    import sounddevice
+except ImportError:
+    sounddevice = None
+
+
+DEFAULT_SAMPLE_RATE = 44100
+DEFAULT_CHANNELS = 2
+DEFAULT_BLOCK_SIZE = 256
+# Length of fades applied when a voice is stolen, stopped or seeked
+DEFAULT_FADE_TIME = 0.005
+MAX_LATENCY_HISTORY = 100
+
+STATE_STOPPED = 'stopped'
+STATE_PLAYING = 'playing'
+STATE_PAUSED = 'paused'
+
+RenderCallback = Callable[[int], np.ndarray]
+
+
+def _map_channels(samples, channels):
+    if samples.shape[1] == channels:
+        return samples
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    if samples.shape[1] > channels:
+        return samples[:, :channels]
+    # More output channels than source ones, leave the rest silent
+    return np.pad(samples, ((0, 0), (0, channels - samples.shape[1])))
+
+
+class _Voice(object):
+    """
+    Single playing buffer, advancing by step source frames per output frame.
+    """
+
+    def __init__(self, samples, step, position):
+        self.samples = samples
+        self.num_frames = len(samples)
+        self.step = step
+        self.position = float(position)
+        self.gain = 1.0
+        self.gain_step = 0.0
+        self.started = False
+
+    @property
+    def finished(self):
+        return self.gain <= 0.0 and self.gain_step <= 0.0
+
+    def fade_out(self, num_frames):
+        self.gain_step = -1.0 / max(1, num_frames)
+
+    def fade_in(self, num_frames):
+        self.gain = 0.0
+        self.gain_step = 1.0 / max(1, num_frames)
+
+    def render(self, out, loop):
+        """
+        Add frames to out buffer.
+
+        :return: whether the end of buffer was reached
+        """
+        frames = len(out)
+        n = self.num_frames
+        if not n:
+            return True
+        positions = self.position + np.arange(frames) * self.step
+
+        if loop:
+            positions %= n
+            valid = frames
+        else:
+            valid = int(np.searchsorted(positions, n, side='left'))
+
+        index = positions[:valid].astype(np.intp)
+        frac = (positions[:valid] - index).astype(np.float32)[:, None]
+        next_index = index + 1
+        if loop:
+            next_index %= n
+        else:
+            np.minimum(next_index, n - 1, out=next_index)
+        chunk = self.samples[index] * (1 - frac) + self.samples[next_index] * frac
+
+        if self.gain_step or self.gain != 1.0:
+            gains = np.clip(self.gain + self.gain_step * np.arange(1, valid + 1), 0.0, 1.0)
+            chunk *= gains.astype(np.float32)[:, None]
+            if valid:
+                self.gain = float(gains[-1])
+            if self.gain >= 1.0 and self.gain_step > 0:
+                self.gain_step = 0.0
+
+        out[:valid] += chunk
+        self.position = self.position + frames * self.step
+        if loop:
+            self.position %= n
+        self.started = True
+        return not loop and valid < frames
+
+
+class PreviewEngine(object):
+    """
+    Plays decoded audio from memory through an output backend.
+
+    Rendering happens in the backend's audio thread, all other methods
+    are meant to be called from the UI thread. Positions are expressed in
+    frames of the played audio, so seeks and loops are sample-accurate.
+    Starting a new file or seeking steals the current voice, which fades
+    out over a few milliseconds under the new one instead of being cut.
+    """
+
+    def __init__(self, backend, fade_time=DEFAULT_FADE_TIME):
+        self.backend = backend
+        self.sample_rate = backend.sample_rate
+        self.channels = backend.channels
+        self.fade_frames = int(fade_time * self.sample_rate)
+
+        self.audio = None
+        # Samples of audio mapped to output channels
+        self._samples = None
+        self._step = 1.0
+        self.loop = False
+        self.state = STATE_STOPPED
+
+        # Seconds between play() and rendering of the first block, output latency excluded
+        self.latencies = deque(maxlen=MAX_LATENCY_HISTORY)
+
+        self._voice = None
+        self._stolen = []
+        self._play_requested = None
+        self._lock = threading.Lock()
+
+        self.backend.start(self.render)
+
+    def close(self):
+        self.backend.stop()
+
+    def _steal_voice(self):
+        if self._voice is not None:
+            self._voice.fade_out(self.fade_frames)
+            self._stolen.append(self._voice)
+            self._voice = None
+
+    def play(self, audio: DecodedAudio, start_frame=0):
+        samples = _map_channels(audio.samples, self.channels)
+        step = audio.sample_rate / self.sample_rate
+        with self._lock:
+            self._steal_voice()
+            self.audio = audio
+            self._samples = samples
+            self._step = step
+            self._voice = _Voice(samples, step, start_frame)
+            self._play_requested = time.perf_counter()
+            self.state = STATE_PLAYING
+
+    def stop(self):
+        with self._lock:
+            self._steal_voice()
+            self.state = STATE_STOPPED
+
+    def pause(self):
+        with self._lock:
+            if self.state == STATE_PLAYING:
+                # Let a copy fade out, the voice itself resumes from where it is now
+                fading = copy.copy(self._voice)
+                fading.fade_out(self.fade_frames)
+                self._stolen.append(fading)
+                self.state = STATE_PAUSED
+
+    def resume(self):
+        """
+        Continue paused audio or play stopped one from the start.
+        """
+        with self._lock:
+            if self.state == STATE_PAUSED:
+                self._voice.fade_in(self.fade_frames)
+                self.state = STATE_PLAYING
+                return
+            audio = self.audio
+        if audio is not None:
+            self.play(audio)
+
+    def seek(self, frame):
+        with self._lock:
+            if self.audio is None:
+                return
+            frame = max(0, min(frame, self.audio.num_frames))
+            if self.state == STATE_PLAYING:
+                self._steal_voice()
+                self._voice = _Voice(self._samples, self._step, frame)
+                self._voice.fade_in(self.fade_frames)
+            elif self._voice is not None:
+                self._voice.position = float(frame)
+            else:
+                self._voice = _Voice(self._samples, self._step, frame)
+                self.state = STATE_PAUSED
+
+    def seek_ms(self, position):
+        if self.audio is not None:
+            self.seek(int(position * self.audio.sample_rate / 1000))
+
+    @property
+    def position(self):
+        """
+        Current frame of the played audio.
+        """
+        voice = self._voice
+        if voice is None:
+            return 0
+        return min(int(voice.position), voice.num_frames)
+
+    def position_ms(self):
+        if self.audio is None or not self.audio.sample_rate:
+            return 0
+        return int(self.position * 1000 / self.audio.sample_rate)
+
+    def duration_ms(self):
+        return int(self.audio.duration * 1000) if self.audio is not None else 0
+
+    def render(self, frames) -> np.ndarray:
+        """
+        Mix next frames of output, called by backend.
+
+        :return: float32 array of shape (frames, channels)
+        """
+        out = np.zeros((frames, self.channels), dtype=np.float32)
+
+        with self._lock:
+            self._stolen = [voice for voice in self._stolen
+                            if not voice.render(out, self.loop) and not voice.finished]
+
+            voice = self._voice
+            if voice is not None and self.state == STATE_PLAYING:
+                if not voice.started and self._play_requested is not None:
+                    self.latencies.append(time.perf_counter() - self._play_requested)
+                    self._play_requested = None
+                if voice.render(out, self.loop):
+                    self._voice = None
+                    self.state = STATE_STOPPED
+
+        return out
+
+
+class NullBackend(object):
+    """
+    Renders output in a thread and throws it away, for measurements without audio device.
+
+    :param realtime: whether to pace rendering like a sound card would,
+                     otherwise blocks are rendered as fast as possible
+    """
+
+    def __init__(
+            self,
+            sample_rate=DEFAULT_SAMPLE_RATE,
+            channels=DEFAULT_CHANNELS,
+            block_size=DEFAULT_BLOCK_SIZE,
+            realtime=True):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.realtime = realtime
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def latency(self):
+        return self.block_size / self.sample_rate
+
+    def start(self, render: RenderCallback):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(render,),
+            name='preview-output',
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, render):
+        block_time = self.block_size / self.sample_rate
+        deadline = time.perf_counter()
+        while not self._stop.is_set():
+            self.write(render(self.block_size))
+            if self.realtime:
+                deadline += block_time
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self._stop.wait(delay)
+
+    def write(self, block):
+        pass
+
+
+class WavFileBackend(NullBackend):
+    """
+    Writes rendered output to a 16-bit WAV file.
+    """
+
+    def __init__(self, path, **kwargs):
+        super(WavFileBackend, self).__init__(**kwargs)
+        self.path = path
+        self._wav = None
+
+    def start(self, render: RenderCallback):
+        self._wav = wave.open(self.path, 'wb')
+        self._wav.setnchannels(self.channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.sample_rate)
+        super(WavFileBackend, self).start(render)
+
+    def stop(self):
+        super(WavFileBackend, self).stop()
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+    def write(self, block):
+        self._wav.writeframes((np.clip(block, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+
+
+class SoundDeviceBackend(object):
+    """
+    Plays output through PortAudio using optional sounddevice package.
+    """
+
+    def __init__(
+            self,
+            sample_rate=DEFAULT_SAMPLE_RATE,
+            channels=DEFAULT_CHANNELS,
+            block_size=DEFAULT_BLOCK_SIZE):
+        if sounddevice is None:
+            raise RuntimeError('sounddevice package is not installed')
+        sounddevice.check_output_settings(samplerate=sample_rate, channels=channels, dtype='float32')
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self._stream = None
+
+    @property
+    def latency(self):
+        return self._stream.latency if self._stream is not None else 0.0
+
+    def start(self, render: RenderCallback):
+        def callback(outdata, frames, time_info, status):
+            outdata[:] = render(frames)
+
+        self._stream = sounddevice.OutputStream(
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            blocksize=self.block_size,
+            dtype='float32',
+            latency='low',
+            callback=callback)
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+def benchmark_latency(audios, backend=None, interval=0.05) -> dict:
+    """
+    Play audio buffers one after another like fast auditioning would.
+
+    :return: dict with mean, median and max start latency in seconds
+    """
+    engine = PreviewEngine(backend if backend is not None else NullBackend())
+    try:
+        for audio in audios:
+            engine.play(audio)
+            time.sleep(interval)
+        engine.stop()
+        time.sleep(interval)
+    finally:
+        engine.close()
+
+    latencies = np.array(engine.latencies) + engine.backend.latency
+    if not len(latencies):
+        return {}
+    return {
+        'count': len(latencies),
+        'mean': float(latencies.mean()),
+        'median': float(np.median(latencies)),
+        'max': float(latencies.max()),
+    }
@@ -0,0 +1,128 @@
+import logging
+
+import numpy as np
+from qtpy.QtCore import *
+from qtpy.QtMultimedia import QAudioDeviceInfo, QAudioFormat, QAudioOutput
+
+from .preview_engine import (
+    DEFAULT_CHANNELS, DEFAULT_SAMPLE_RATE, RenderCallback, SoundDeviceBackend, sounddevice)
+
+
+DEFAULT_QT_BLOCK_SIZE = 2048
+
+
+class _RenderDevice(QIODevice):
+    """
+    Endless sequential device pulling 16-bit frames from render callback.
+    """
+
+    def __init__(self, render: RenderCallback, channels, parent=None):
+        super(_RenderDevice, self).__init__(parent)
+        self.render = render
+        self.channels = channels
+
+    def readData(self, maxlen):
+        frames = maxlen // (2 * self.channels)
+        if not frames:
+            return bytes()
+        block = self.render(frames)
+        return (np.clip(block, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+    def writeData(self, data):
+        return -1
+
+    def bytesAvailable(self):
+        return (1 << 20) + super(_RenderDevice, self).bytesAvailable()
+
+    def isSequential(self):
+        return True
+
+
+class _OutputThread(QThread):
+    """
+    Runs QAudioOutput in its own event loop, so that blocks are rendered
+    on time even while UI thread is busy.
+    """
+
+    def __init__(self, device_info, fmt, buffer_size, render: RenderCallback, parent=None):
+        super(_OutputThread, self).__init__(parent)
+        self.device_info = device_info
+        self.format = fmt
+        self.buffer_size = buffer_size
+        self.render = render
+
+    def run(self):
+        # Created here to live in this thread, which pulls data from device
+        device = _RenderDevice(self.render, self.format.channelCount())
+        device.open(QIODevice.ReadOnly)
+        output = QAudioOutput(self.device_info, self.format)
+        output.setBufferSize(self.buffer_size)
+        output.start(device)
+        self.buffer_size = output.bufferSize()
+
+        self.exec_()
+
+        output.stop()
+        device.close()
+
+
+class QtAudioBackend(object):
+    """
+    Plays output through QAudioOutput in pull mode on a dedicated thread.
+    """
+
+    def __init__(
+            self,
+            sample_rate=DEFAULT_SAMPLE_RATE,
+            channels=DEFAULT_CHANNELS,
+            block_size=DEFAULT_QT_BLOCK_SIZE):
+        self.device_info = QAudioDeviceInfo.defaultOutputDevice()
+
+        fmt = QAudioFormat()
+        fmt.setSampleRate(sample_rate)
+        fmt.setChannelCount(channels)
+        fmt.setSampleSize(16)
+        fmt.setCodec('audio/pcm')
+        fmt.setByteOrder(QAudioFormat.LittleEndian)
+        fmt.setSampleType(QAudioFormat.SignedInt)
+
+        if not self.device_info.isFormatSupported(fmt):
+            fmt.setSampleRate(self.device_info.nearestFormat(fmt).sampleRate())
+            if not self.device_info.isFormatSupported(fmt):
+                raise RuntimeError('Audio output does not support 16-bit PCM')
+
+        self.format = fmt
+        self.sample_rate = fmt.sampleRate()
+        self.channels = fmt.channelCount()
+        self.block_size = block_size
+
+        self._thread = None
+
+    @property
+    def latency(self):
+        if self._thread is None:
+            return 0.0
+        return self._thread.buffer_size / (2 * self.channels * self.sample_rate)
+
+    def start(self, render: RenderCallback):
+        self._thread = _OutputThread(
+            self.device_info, self.format, self.block_size * 2 * self.channels, render)
+        self._thread.start(QThread.TimeCriticalPriority)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.quit()
+            self._thread.wait()
+            self._thread = None
+
+
+def create_output_backend():
+    """
+    Pick lowest latency output available, PortAudio if sounddevice is installed.
+    """
+    if sounddevice is not None:
+        try:
+            return SoundDeviceBackend()
+        except Exception as e:
+            logging.warning('Could not open PortAudio output, falling back to Qt: %s', e)
+    return QtAudioBackend()
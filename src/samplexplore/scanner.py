@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+DEFAULT_NUM_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+@dataclass
+class DirectoryScan(object):
+    path: str
+    mtime_ns: int
+    # None when directory did not change since it was last stored
+    files: Optional[List[Tuple[str, int, int]]] = None
+    subdirs: Optional[List[str]] = None
+    # Known files of unchanged directory whose size or mtime is different now,
+    # as (filename, size, mtime_ns) tuples
+    modified: Optional[List[Tuple[str, int, int]]] = None
+
+    @property
+    def changed(self):
+        return self.files is not None
+
+
+def is_supported_file(filename, supported_extensions):
+    fn_base, fn_ext = os.path.splitext(filename)
+    if fn_ext:
+        fn_ext = fn_ext[1:].lower()
+        return fn_ext in supported_extensions
+    return True
+
+
+def scan_directory(path, supported_extensions):
+    """
+    List single directory.
+
+    Stat results come from the DirEntry objects, which on Windows are
+    filled in by the listing itself and elsewhere are cached after first use.
+
+    :return: tuple of (files, subdirs) where files is a list of
+             (filename, size, mtime_ns) tuples and subdirs a list of
+             (dirname, mtime_ns) tuples
+    """
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    # Same as os.walk, do not descend into symlinked directories
+                    if not entry.is_symlink():
+                        subdirs.append((entry.name, entry.stat().st_mtime_ns))
+                    continue
+                if not is_supported_file(entry.name, supported_extensions):
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((entry.name, st.st_size, st.st_mtime_ns))
+    return files, subdirs
+
+
+def stat_known_files(path, known_files):
+    """
+    Find files which were modified in place, which does not change mtime of their directory.
+
+    :param known_files: mapping of filename to (size, mtime_ns) as previously stored
+    :return: list of (filename, size, mtime_ns) tuples of files which differ
+    """
+    modified = []
+    for filename, stored in known_files.items():
+        try:
+            st = os.stat(os.path.join(path, filename))
+        except OSError:
+            # Removed files change mtime of directory, so it will be listed next time
+            continue
+        if (st.st_size, st.st_mtime_ns) != stored:
+            modified.append((filename, st.st_size, st.st_mtime_ns))
+    return modified
+
+
+class ParallelScanner(object):
+    """
+    Walks directory trees spreading subdirectories over a pool of threads.
+
+    Results are handed over to a single consumer through a bounded queue,
+    so that slow database writes apply back pressure on the scan. A directory
+    is always delivered before any of its subdirectories.
+
+    :param known_dirs: mapping of directory path to (mtime_ns, subdir paths, files)
+                       as previously stored, where files maps filename to
+                       (size, mtime_ns). Directories with unchanged mtime
+                       are not listed again, only their known files are
+                       checked and their known subdirectories visited.
+    :param descend_unchanged: whether to visit known subdirectories of
+                              unchanged directories at all
+    """
+
+    def __init__(
+            self,
+            supported_extensions,
+            known_dirs: Optional[Dict[str, Tuple[Optional[int], List[str], Dict[str, Tuple[int, int]]]]] = None,
+            num_workers=DEFAULT_NUM_WORKERS,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            descend_unchanged=True):
+        self.supported_extensions = supported_extensions
+        self.known_dirs = known_dirs if known_dirs is not None else {}
+        self.descend_unchanged = descend_unchanged
+        self.num_workers = max(1, num_workers)
+        self.queue_size = queue_size
+
+        self._queue = None
+        self._tpe = None
+        self._stop = threading.Event()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def scan(self, roots) -> Iterator[DirectoryScan]:
+        if not roots:
+            return
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stop.clear()
+        self._pending = 0
+        self._tpe = ThreadPoolExecutor(
+            max_workers=self.num_workers,
+            thread_name_prefix='scanner')
+
+        try:
+            # Hold off completion until all roots are submitted
+            with self._pending_lock:
+                self._pending += 1
+            for root in roots:
+                self._submit(root, None)
+            self._task_done()
+
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+            self._tpe.shutdown(wait=True)
+
+    def _submit(self, path, mtime_ns):
+        with self._pending_lock:
+            self._pending += 1
+        self._tpe.submit(self._scan_one, path, mtime_ns)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _scan_one(self, path, mtime_ns):
+        try:
+            if not self._stop.is_set():
+                self._visit(path, mtime_ns)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._task_done()
+
+    def _task_done(self):
+        with self._pending_lock:
+            self._pending -= 1
+            done = not self._pending
+        if done:
+            self._put(_DONE)
+
+    def _visit(self, path, mtime_ns):
+        try:
+            if mtime_ns is None:
+                mtime_ns = os.stat(path).st_mtime_ns
+
+            known_mtime_ns, known_subdirs, known_files = self.known_dirs.get(path, (None, (), {}))
+            if mtime_ns == known_mtime_ns:
+                result = DirectoryScan(path, mtime_ns, modified=stat_known_files(path, known_files))
+                subdirs = []
+                if self.descend_unchanged:
+                    subdirs = [(subdir_path, None) for subdir_path in known_subdirs]
+            else:
+                files, subdir_entries = scan_directory(path, self.supported_extensions)
+                result = DirectoryScan(
+                    path, mtime_ns,
+                    files=files,
+                    subdirs=[name for name, subdir_mtime_ns in subdir_entries])
+                subdirs = [(os.path.join(path, name), subdir_mtime_ns)
+                           for name, subdir_mtime_ns in subdir_entries]
+        except OSError as e:
+            logging.warning("Skipping directory '%s': %s", path, e)
+            return
+
+        if not self._put(result):
+            return
+
+        for subdir_path, subdir_mtime_ns in subdirs:
+            self._submit(subdir_path, subdir_mtime_ns)
@@ -0,0 +1,150 @@
+from dataclasses import dataclass, field
+import re
+from typing import List, Optional, Tuple
+
+
+FILTER_ALIASES = {
+    'dur': 'duration',
+    'duration': 'duration',
+    'len': 'duration',
+    'sr': 'sample_rate',
+    'rate': 'sample_rate',
+    'ch': 'channels',
+    'channels': 'channels',
+    'bits': 'bit_depth',
+    'depth': 'bit_depth',
+    'ext': 'extension',
+}
+
+CHANNEL_NAMES = {
+    'mono': 1,
+    'stereo': 2,
+}
+
+OPERATORS = ('<=', '>=', '<', '>', '=')
+
+# Duration given without operator matches files that much shorter or longer,
+# stored durations are hardly ever exactly the typed value
+DURATION_TOLERANCE = 0.05
+
+SEARCH_SYNTAX_HELP = (
+    "Words are matched against file names. Filters:\n"
+    "  dur:1s  dur:<0.5  dur:>=2s  dur:100ms..1s - duration, dur:1s matches 0.95s..1.05s\n"
+    "  sr:44100  sr:>=48k - sample rate\n"
+    "  ch:mono  ch:2 - channels\n"
+    "  bits:24 - bit depth\n"
+    "  ext:wav  ext:wav,aif - file extension")
+
+_FILTER_RE = re.compile(r'^(\w+):(.+)$')
+_OPERATOR_RE = re.compile(r'^(<=|>=|<|>|=)?(.+)$')
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+@dataclass
+class SearchQuery(object):
+    # Words to be found in file name
+    terms: List[str] = field(default_factory=list)
+    # (metadata field, operator, value) tuples, all have to be satisfied
+    filters: List[Tuple[str, str, float]] = field(default_factory=list)
+    # Lower case extensions without dot, any of them has to match
+    extensions: List[str] = field(default_factory=list)
+    # Directory to search in along with its subdirectories, whole index if None
+    directory: Optional[str] = None
+    # Show only the first of files with the same contents
+    collapse_duplicates: bool = False
+
+    @property
+    def is_empty(self):
+        return not (self.terms or self.filters or self.extensions)
+
+
+def _parse_duration(value):
+    value = value.lower()
+    if value.endswith('ms'):
+        return float(value[:-2]) / 1000
+    if value.endswith('s'):
+        return float(value[:-1])
+    return float(value)
+
+
+def _parse_sample_rate(value):
+    value = value.lower()
+    if value.endswith('khz'):
+        return float(value[:-3]) * 1000
+    if value.endswith('k'):
+        return float(value[:-1]) * 1000
+    if value.endswith('hz'):
+        value = value[:-2]
+    rate = float(value)
+    # Nobody has samples at 48 Hz, so it must be kHz
+    return rate * 1000 if rate < 1000 else rate
+
+
+def _parse_channels(value):
+    value = value.lower()
+    if value in CHANNEL_NAMES:
+        return CHANNEL_NAMES[value]
+    return int(value)
+
+
+VALUE_PARSERS = {
+    'duration': _parse_duration,
+    'sample_rate': _parse_sample_rate,
+    'channels': _parse_channels,
+    'bit_depth': int,
+}
+
+
+def _parse_filter(name, value):
+    parse_value = VALUE_PARSERS[name]
+
+    if '..' in value:
+        low, high = value.split('..', 1)
+        filters = []
+        if low:
+            filters.append((name, '>=', parse_value(low)))
+        if high:
+            filters.append((name, '<=', parse_value(high)))
+        return filters
+
+    op, value = _OPERATOR_RE.match(value).groups()
+    value = parse_value(value)
+    if op is None and name == 'duration':
+        return [
+            (name, '>=', value * (1 - DURATION_TOLERANCE)),
+            (name, '<=', value * (1 + DURATION_TOLERANCE)),
+        ]
+    return [(name, op or '=', value)]
+
+
+def parse_query(text) -> SearchQuery:
+    """
+    Parse search box input, e.g. "kick dur:<0.5 sr:44.1k ext:wav".
+
+    :raises SearchQueryError: if filter value is invalid
+    """
+    query = SearchQuery()
+
+    for token in text.split():
+        m = _FILTER_RE.match(token)
+        name = FILTER_ALIASES.get(m.group(1).lower()) if m else None
+
+        if name is None:
+            query.terms.append(token)
+            continue
+
+        value = m.group(2)
+        if name == 'extension':
+            query.extensions.extend(
+                ext.lstrip('.').lower() for ext in value.split(',') if ext.lstrip('.'))
+            continue
+
+        try:
+            query.filters.extend(_parse_filter(name, value))
+        except ValueError:
+            raise SearchQueryError("Invalid value of filter '{}': {}".format(m.group(1), value))
+
+    return query
@@ -4,6 +4,12 @@ from qtpy.QtCore import *
 from qtpy.QtGui import *
 from qtpy.QtWidgets import *
 
+from .audio_cache import DEFAULT_MAX_BYTES
+from .scanner import DEFAULT_NUM_WORKERS
+
+
+DEFAULT_PREVIEW_CACHE_MB = DEFAULT_MAX_BYTES // (1024 * 1024)
+
 
 class SelectDirectoryWidget(QWidget):
 
@@ -75,6 +81,34 @@ class SettingsDialog(QDialog):
 
         self.formlayout.addRow(sdir_hintlabel)
 
+        self.scan_workers_spinbox = QSpinBox()
+        self.scan_workers_spinbox.setRange(1, 64)
+        self.scan_workers_spinbox.setValue(self.settings_manager.scan_workers)
+        self.scan_workers_spinbox.setToolTip(
+            "Number of directories listed in parallel while indexing.\n"
+            "Higher values help with network drives.")
+        self.formlayout.addRow('Indexing threads:', self.scan_workers_spinbox)
+
+        self.watch_checkbox = QCheckBox('Keep search database up to date while running')
+        self.watch_checkbox.setChecked(self.settings_manager.watch_samples_directory)
+        self.formlayout.addRow(self.watch_checkbox)
+
+        self.browse_index_checkbox = QCheckBox('Browse folders from search database')
+        self.browse_index_checkbox.setChecked(self.settings_manager.browse_from_index)
+        self.browse_index_checkbox.setToolTip(
+            "Folders open instantly even on network drives.\n"
+            "Listings are checked against the drive in background and updated when they change.")
+        self.formlayout.addRow(self.browse_index_checkbox)
+
+        self.preview_cache_spinbox = QSpinBox()
+        self.preview_cache_spinbox.setRange(16, 8192)
+        self.preview_cache_spinbox.setSuffix(' MB')
+        self.preview_cache_spinbox.setValue(self.settings_manager.preview_cache_mb)
+        self.preview_cache_spinbox.setToolTip(
+            "Memory used to keep recently previewed samples decoded.\n"
+            "See Tools -> Preview cache statistics to check if it is big enough.")
+        self.formlayout.addRow('Preview cache size:', self.preview_cache_spinbox)
+
         self.bbox = bbox = QDialogButtonBox()
         self.bbox.setStandardButtons(QDialogButtonBox.Cancel | QDialogButtonBox.Ok)
 
@@ -93,6 +127,10 @@ class SettingsDialog(QDialog):
         samples_directory = self.select_directory_widget.text()
 
         self.settings_manager.samples_directory = samples_directory
+        self.settings_manager.scan_workers = self.scan_workers_spinbox.value()
+        self.settings_manager.watch_samples_directory = self.watch_checkbox.isChecked()
+        self.settings_manager.browse_from_index = self.browse_index_checkbox.isChecked()
+        self.settings_manager.preview_cache_mb = self.preview_cache_spinbox.value()
         self.settings_manager.write_settings()
 
         return super(SettingsDialog, self).accept()
@@ -105,6 +143,10 @@ class SettingsManager(QObject):
     def __init__(self, parent=None):
         super(SettingsManager, self).__init__(parent=parent)
         self._samples_directory = None
+        self.scan_workers = DEFAULT_NUM_WORKERS
+        self.watch_samples_directory = True
+        self.browse_from_index = False
+        self.preview_cache_mb = DEFAULT_PREVIEW_CACHE_MB
 
     @property
     def samples_directory(self):
@@ -121,6 +163,10 @@ class SettingsManager(QObject):
         settings.beginGroup("Settings")
 
         settings.setValue("samples_directory", self._samples_directory)
+        settings.setValue("scan_workers", self.scan_workers)
+        settings.setValue("watch_samples_directory", self.watch_samples_directory)
+        settings.setValue("browse_from_index", self.browse_from_index)
+        settings.setValue("preview_cache_mb", self.preview_cache_mb)
 
         settings.endGroup()
 
@@ -131,6 +177,10 @@ class SettingsManager(QObject):
         settings.beginGroup("Settings")
 
         self._samples_directory = settings.value("samples_directory")
+        self.scan_workers = int(settings.value("scan_workers", DEFAULT_NUM_WORKERS))
+        self.watch_samples_directory = settings.value("watch_samples_directory", True, type=bool)
+        self.browse_from_index = settings.value("browse_from_index", False, type=bool)
+        self.preview_cache_mb = int(settings.value("preview_cache_mb", DEFAULT_PREVIEW_CACHE_MB))
 
         settings.endGroup()
 
@@ -0,0 +1,231 @@
+from dataclasses import dataclass
+import math
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+MATRIX_MAGIC = b'SXFT'
+MATRIX_VERSION = 1
+
+DEFAULT_NUM_NEIGHBOURS = 50
+# Libraries with fewer vectors are always searched exhaustively
+APPROXIMATE_THRESHOLD = 50000
+# Clusters probed by approximate search, more is slower and more accurate
+DEFAULT_NUM_PROBES = 8
+KMEANS_ITERATIONS = 10
+# Cluster centres are trained on a sample of that many vectors per cluster
+KMEANS_SAMPLES_PER_CLUSTER = 64
+
+_MATRIX_HEADER = struct.Struct('<4sHIIQ')
+
+
+@dataclass
+class FeatureMatrix(object):
+    """
+    Feature vectors of files, stored in a file as header followed by
+    int64 file ids in ascending order and float32 rows of vectors.
+    """
+    # int64 array of shape (count,)
+    ids: np.ndarray
+    # float32 array of shape (count, size)
+    vectors: np.ndarray
+    # Tells apart matrices of the same size written from different vectors
+    generation: int = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def save(self, path):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(_MATRIX_HEADER.pack(
+                MATRIX_MAGIC, MATRIX_VERSION, self.vectors.shape[1], len(self.ids), self.generation))
+            f.write(self.ids.astype('<i8').tobytes())
+            f.write(self.vectors.astype('<f4').tobytes())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_header(f):
+        data = f.read(_MATRIX_HEADER.size)
+        if len(data) < _MATRIX_HEADER.size:
+            raise ValueError('Not a feature matrix file')
+        magic, version, size, count, generation = _MATRIX_HEADER.unpack(data)
+        if magic != MATRIX_MAGIC or version != MATRIX_VERSION:
+            raise ValueError('Not a feature matrix file')
+        return size, count, generation
+
+    @classmethod
+    def read_header(cls, path) -> Optional[Tuple[int, int, int]]:
+        """
+        :return: (vector size, count, generation) tuple, None if file is missing or invalid
+        """
+        try:
+            with open(path, 'rb') as f:
+                return cls._read_header(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, path) -> 'FeatureMatrix':
+        """
+        :raises ValueError: if file is not a feature matrix
+        """
+        with open(path, 'rb') as f:
+            size, count, generation = cls._read_header(f)
+            ids = np.fromfile(f, dtype='<i8', count=count)
+            vectors = np.fromfile(f, dtype='<f4', count=count * size)
+        if len(ids) != count or len(vectors) != count * size:
+            raise ValueError('Truncated feature matrix file')
+        return cls(ids, vectors.reshape(count, size), generation)
+
+
+def _squared_distances(vectors, norms, query):
+    return norms - 2 * (vectors @ query) + query @ query
+
+
+def _nearest_rows(distances, count):
+    count = min(count, len(distances))
+    if not count:
+        return np.empty(0, dtype=np.intp)
+    rows = np.argpartition(distances, count - 1)[:count]
+    return rows[np.argsort(distances[rows], kind='stable')]
+
+
+class _InvertedFileIndex(object):
+    """
+    Vectors grouped by nearest of k-means cluster centres, so that a query
+    only compares vectors of clusters whose centres are closest to it.
+    """
+
+    def __init__(self, vectors, num_clusters, seed=0):
+        rng = np.random.default_rng(seed)
+        num_samples = min(len(vectors), num_clusters * KMEANS_SAMPLES_PER_CLUSTER)
+        samples = vectors[rng.choice(len(vectors), num_samples, replace=False)]
+        centres = samples[rng.choice(num_samples, num_clusters, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = self._assign(samples, centres)
+            sums = np.zeros_like(centres)
+            np.add.at(sums, labels, samples)
+            counts = np.bincount(labels, minlength=num_clusters)
+            # Empty clusters keep their previous centre
+            filled = counts > 0
+            centres[filled] = sums[filled] / counts[filled, None]
+
+        labels = self._assign(vectors, centres)
+        self.centres = centres
+        self.centre_norms = np.einsum('ij,ij->i', centres, centres)
+        # Rows of vectors sorted by cluster, rows of cluster i are order[offsets[i]:offsets[i + 1]]
+        self.order = np.argsort(labels, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=num_clusters))])
+
+    @staticmethod
+    def _assign(vectors, centres, batch_size=8192):
+        centre_norms = np.einsum('ij,ij->i', centres, centres)
+        labels = np.empty(len(vectors), dtype=np.intp)
+        for start in range(0, len(vectors), batch_size):
+            batch = vectors[start:start + batch_size]
+            labels[start:start + batch_size] = np.argmin(centre_norms - 2 * (batch @ centres.T), axis=1)
+        return labels
+
+    def candidates(self, query, num_probes):
+        distances = _squared_distances(self.centres, self.centre_norms, query)
+        clusters = _nearest_rows(distances, num_probes)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+
+
+class SimilarityIndex(object):
+    """
+    Nearest neighbour search over feature vectors of files.
+
+    Each feature is standardized across the library, so that all of them
+    weigh the same in euclidean distance. Small libraries are searched
+    exhaustively with a single matrix product, bigger ones through an
+    inverted file index which compares only vectors of a few clusters
+    closest to the query.
+    """
+
+    def __init__(self, matrix: FeatureMatrix, approximate_threshold=APPROXIMATE_THRESHOLD):
+        self.ids = matrix.ids
+        vectors = matrix.vectors
+        mean = vectors.mean(axis=0) if len(vectors) else 0.0
+        std = vectors.std(axis=0) if len(vectors) else 1.0
+        self.vectors = ((vectors - mean) / np.where(std > 0, std, 1.0)).astype(np.float32)
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+        self.ivf = None
+        if len(self.ids) >= approximate_threshold:
+            self.ivf = _InvertedFileIndex(self.vectors, num_clusters=int(math.sqrt(len(self.ids))))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, file_id) -> Optional[int]:
+        row = int(np.searchsorted(self.ids, file_id))
+        if row < len(self.ids) and self.ids[row] == file_id:
+            return row
+        return None
+
+    def nearest(
+            self,
+            file_id,
+            count=DEFAULT_NUM_NEIGHBOURS,
+            exact=False,
+            num_probes=DEFAULT_NUM_PROBES) -> Optional[List[Tuple[int, float]]]:
+        """
+        Files sounding most like given one, which itself is left out.
+
+        :param exact: compare with all vectors even if approximate index is built
+        :return: list of (file id, distance) tuples, nearest first,
+                 None if file has no feature vector
+        """
+        row = self.row_of(file_id)
+        if row is None:
+            return None
+        query = self.vectors[row]
+
+        if self.ivf is None or exact:
+            candidates = None
+            distances = _squared_distances(self.vectors, self.norms, query)
+        else:
+            candidates = self.ivf.candidates(query, num_probes)
+            distances = _squared_distances(self.vectors[candidates], self.norms[candidates], query)
+
+        nearest = _nearest_rows(distances, count + 1)
+        rows = nearest if candidates is None else candidates[nearest]
+        return [(int(self.ids[r]), math.sqrt(max(0.0, float(d))))
+                for r, d in zip(rows, distances[nearest]) if r != row][:count]
+
+
+class SimilarityIndexCache(object):
+    """
+    Index of feature matrix file, built again once the file is replaced.
+
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, approximate_threshold=APPROXIMATE_THRESHOLD):
+        self.approximate_threshold = approximate_threshold
+        self._key = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self, path) -> Optional[SimilarityIndex]:
+        """
+        :return: None if there is no feature matrix yet
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            if key != self._key:
+                self._index = SimilarityIndex(FeatureMatrix.load(path), self.approximate_threshold)
+                self._key = key
+            return self._index
@@ -0,0 +1,44 @@
+import time
+
+
+class StartupTimer(object):
+    """
+    Breaks cold start time down into consecutive phases.
+
+    Each mark() ends the phase which started with the previous mark, or
+    with creation of the timer for the first one.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        # (name, seconds) tuples
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def elapsed_until(self, phase):
+        """
+        :return: seconds from start until the end of given phase
+        """
+        elapsed = 0.0
+        for name, seconds in self.phases:
+            elapsed += seconds
+            if name == phase:
+                return elapsed
+        raise KeyError(phase)
+
+    def report(self, interactive_phase=None):
+        summary = 'Startup took {:.0f} ms'.format(self.total * 1000)
+        if interactive_phase is not None:
+            summary += ', interactive after {:.0f} ms'.format(self.elapsed_until(interactive_phase) * 1000)
+        return '{}: {}'.format(
+            summary,
+            ', '.join('{} {:.0f} ms'.format(name, seconds * 1000) for name, seconds in self.phases))
@@ -0,0 +1,315 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Set
+
+
+DEFAULT_BATCH_INTERVAL = 1.0
+DEFAULT_MAX_BATCH_DELAY = 10.0
+DEFAULT_POLL_INTERVAL = 30.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class WatcherBackendError(Exception):
+    pass
+
+
+def _walk_dirs(root, stop_event=None):
+    """
+    Yield (path, mtime_ns) of root and all directories below it.
+
+    :param stop_event: walk ends early once it is set
+    """
+    try:
+        yield root, os.stat(root).st_mtime_ns
+    except OSError:
+        return
+
+    stack = [root]
+    while stack:
+        if stop_event is not None and stop_event.is_set():
+            return
+        path = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir() and not entry.is_symlink():
+                            yield entry.path, entry.stat().st_mtime_ns
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class InotifyBackend(object):
+    """
+    Reports changed directories using Linux inotify, one watch per directory.
+
+    :param stop_event: interrupts adding watches of directory tree once set
+    """
+
+    def __init__(self, root, stop_event=None):
+        self.root = root
+        self.stop_event = stop_event
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise WatcherBackendError('inotify is not available: {}'.format(e))
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatcherBackendError(os.strerror(ctypes.get_errno()))
+
+        self._wd_paths = {}
+        self._path_wds = {}
+
+        try:
+            self._add_tree(root)
+        except WatcherBackendError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatcherBackendError(
+                    'inotify watch limit reached, see fs.inotify.max_user_watches')
+            # Directory vanished or is not accessible
+            return
+        self._wd_paths[wd] = path
+        self._path_wds[path] = wd
+
+    def _add_tree(self, root):
+        for path, mtime_ns in _walk_dirs(root, self.stop_event):
+            self._add_watch(path)
+
+    def _forget_tree(self, root):
+        prefix = os.path.join(root, '')
+        for path in [p for p in self._path_wds if p == root or p.startswith(prefix)]:
+            wd = self._path_wds.pop(path)
+            self._wd_paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout):
+        """
+        :return: tuple of (changed directory paths, whether events were lost)
+        """
+        changed = set()
+        overflow = False
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed, overflow
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed, overflow
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            path = self._wd_paths.get(wd)
+            if path is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                if self._path_wds.get(path) == wd:
+                    del self._path_wds[path]
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(os.path.dirname(path))
+                continue
+
+            changed.add(path)
+
+            if mask & IN_ISDIR and name:
+                child_path = os.path.join(path, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(child_path)
+                elif mask & IN_MOVED_FROM:
+                    self._forget_tree(child_path)
+
+        return changed, overflow
+
+
+class PollingBackend(object):
+    """
+    Reports directories whose mtime changed between subsequent walks of the tree.
+
+    Contrary to inotify, files modified in place are not reported.
+
+    :param stop_event: interrupts walks of directory tree once set
+    """
+
+    def __init__(self, root, poll_interval=DEFAULT_POLL_INTERVAL, stop_event=None):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.stop_event = stop_event
+        self._snapshot = dict(_walk_dirs(root, stop_event))
+        self._next_poll = time.monotonic() + poll_interval
+        self._closed = threading.Event()
+
+    def close(self):
+        self._closed.set()
+
+    def wait(self, timeout):
+        delay = self._next_poll - time.monotonic()
+        if delay > 0:
+            self._closed.wait(min(delay, timeout))
+            if time.monotonic() < self._next_poll:
+                return set(), False
+
+        snapshot = dict(_walk_dirs(self.root, self.stop_event))
+        if self.stop_event is not None and self.stop_event.is_set():
+            # Incomplete walk would report missing directories as deleted
+            return set(), False
+        self._next_poll = time.monotonic() + self.poll_interval
+
+        changed = set()
+        for path, mtime_ns in snapshot.items():
+            if self._snapshot.get(path) != mtime_ns:
+                changed.add(path)
+        for path in self._snapshot.keys() - snapshot.keys():
+            changed.add(os.path.dirname(path))
+
+        self._snapshot = snapshot
+        return changed, False
+
+
+def create_backend(root, poll_interval=DEFAULT_POLL_INTERVAL, stop_event=None):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(root, stop_event=stop_event)
+        except WatcherBackendError as e:
+            logging.warning('Falling back to polling for filesystem changes: %s', e)
+    return PollingBackend(root, poll_interval=poll_interval, stop_event=stop_event)
+
+
+class FilesystemWatcher(object):
+    """
+    Background thread watching samples directory for changes.
+
+    Changed directories are collected until no new event arrives for
+    batch_interval seconds (but no longer than max_batch_delay), then passed
+    on in one call, so that copying a whole sample pack results in few
+    database transactions.
+
+    :param on_changes: called from the watcher thread with set of changed
+                       directory paths and flag telling that some events
+                       were lost and whole tree should be checked
+    """
+
+    def __init__(
+            self,
+            root,
+            on_changes: Callable[[Set[str], bool], None],
+            batch_interval=DEFAULT_BATCH_INTERVAL,
+            max_batch_delay=DEFAULT_MAX_BATCH_DELAY,
+            poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.normpath(root)
+        self.on_changes = on_changes
+        self.batch_interval = batch_interval
+        self.max_batch_delay = max_batch_delay
+        self.poll_interval = poll_interval
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='filesystem-watcher',
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        # Walk of a big tree takes a while, stop() should not wait for it to finish
+        backend = create_backend(self.root, poll_interval=self.poll_interval, stop_event=self._stop)
+        logging.info('Watching %s for changes using %s', self.root, type(backend).__name__)
+
+        pending = set()
+        pending_overflow = False
+        batch_started = None
+
+        try:
+            while not self._stop.is_set():
+                changed, overflow = backend.wait(
+                    self.batch_interval if batch_started is not None else 0.5)
+
+                if changed or overflow:
+                    pending.update(changed)
+                    pending_overflow |= overflow
+                    if batch_started is None:
+                        batch_started = time.monotonic()
+                    if time.monotonic() - batch_started < self.max_batch_delay:
+                        continue
+
+                if batch_started is not None:
+                    self._flush(pending, pending_overflow)
+                    pending = set()
+                    pending_overflow = False
+                    batch_started = None
+        finally:
+            backend.close()
+
+    def _flush(self, paths: Iterable[str], overflow):
+        try:
+            self.on_changes(set(paths), overflow)
+        except Exception:
+            logging.error('Failed to apply filesystem changes', exc_info=True)
@@ -0,0 +1,254 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from .audio_decode import DecodedAudio, decode_file
+
+
+# Frames per peak at the finest level
+PEAKS_BLOCK_SIZE = 256
+# Each next level merges this many peaks of previous one
+PEAKS_LEVEL_FACTOR = 4
+# Coarsest level still has at least this many peaks
+PEAKS_MIN_LEVEL_SIZE = 256
+
+PEAKS_MAGIC = b'SXPK'
+PEAKS_VERSION = 1
+
+DEFAULT_NUM_PROCESSES = 2
+
+_PEAKS_HEADER = struct.Struct('<4sHIQHHHH')
+_PEAK_MAX = 127
+
+
+@dataclass
+class WaveformPeaks(object):
+    sample_rate: int
+    num_frames: int
+    channels: int
+    block_size: int = PEAKS_BLOCK_SIZE
+    level_factor: int = PEAKS_LEVEL_FACTOR
+    # int8 arrays of shape (num_peaks, 2) holding (min, max) pairs,
+    # finest level first
+    levels: List[np.ndarray] = field(default_factory=list)
+
+    @property
+    def duration(self):
+        return self.num_frames / self.sample_rate if self.sample_rate else 0.0
+
+    def columns(self, width) -> np.ndarray:
+        """
+        Reduce peaks to given number of columns.
+
+        Cost depends only on width, as the coarsest level having at least
+        width peaks is used.
+
+        :return: float32 array of shape (width, 2) with (min, max) in range -1..1
+        """
+        if width <= 0 or not self.levels:
+            return np.zeros((max(width, 0), 2), dtype=np.float32)
+
+        level = self.levels[0]
+        for candidate in self.levels:
+            if len(candidate) < width:
+                break
+            level = candidate
+
+        n = len(level)
+        if n >= width:
+            starts = np.arange(width) * n // width
+            mins = np.minimum.reduceat(level[:, 0], starts)
+            maxs = np.maximum.reduceat(level[:, 1], starts)
+            result = np.stack([mins, maxs], axis=1)
+        else:
+            result = level[np.arange(width) * n // width]
+
+        return result.astype(np.float32) / _PEAK_MAX
+
+    def to_bytes(self) -> bytes:
+        header = _PEAKS_HEADER.pack(
+            PEAKS_MAGIC, PEAKS_VERSION, self.sample_rate, self.num_frames,
+            self.channels, self.block_size, self.level_factor, len(self.levels))
+        sizes = struct.pack('<{}I'.format(len(self.levels)), *(len(level) for level in self.levels))
+        return b''.join([header, sizes] + [level.tobytes() for level in self.levels])
+
+    @classmethod
+    def from_bytes(cls, data) -> 'WaveformPeaks':
+        """
+        :raises ValueError: if data is not a valid peaks file
+        """
+        try:
+            magic, version, sample_rate, num_frames, channels, block_size, level_factor, num_levels = \
+                _PEAKS_HEADER.unpack_from(data)
+            if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+                raise ValueError('Unknown peaks file version')
+            offset = _PEAKS_HEADER.size
+            sizes = struct.unpack_from('<{}I'.format(num_levels), data, offset)
+        except struct.error as e:
+            raise ValueError('Truncated peaks file: {}'.format(e))
+
+        offset += 4 * num_levels
+        levels = []
+        for size in sizes:
+            level = np.frombuffer(data, dtype=np.int8, count=size * 2, offset=offset)
+            levels.append(level.reshape(size, 2))
+            offset += size * 2
+
+        return cls(sample_rate, num_frames, channels, block_size, level_factor, levels)
+
+
+def _reduce_level(level, factor):
+    """
+    Merge each factor subsequent (min, max) peaks into one.
+    """
+    pad = -len(level) % factor
+    mins = np.pad(level[:, 0], (0, pad), constant_values=_PEAK_MAX)
+    maxs = np.pad(level[:, 1], (0, pad), constant_values=-_PEAK_MAX)
+    return np.stack([
+        mins.reshape(-1, factor).min(axis=1),
+        maxs.reshape(-1, factor).max(axis=1)], axis=1)
+
+
+def compute_peaks(audio: DecodedAudio,
+                  block_size=PEAKS_BLOCK_SIZE,
+                  level_factor=PEAKS_LEVEL_FACTOR,
+                  min_level_size=PEAKS_MIN_LEVEL_SIZE) -> WaveformPeaks:
+    """
+    Compute min/max peak pyramid of all channels mixed together.
+    """
+    peaks = WaveformPeaks(
+        audio.sample_rate, audio.num_frames, audio.channels,
+        block_size=block_size, level_factor=level_factor)
+
+    if not audio.num_frames:
+        return peaks
+
+    lows = audio.samples.min(axis=1)
+    highs = audio.samples.max(axis=1)
+    pad = -len(lows) % block_size
+    lows = np.pad(lows, (0, pad), mode='edge').reshape(-1, block_size).min(axis=1)
+    highs = np.pad(highs, (0, pad), mode='edge').reshape(-1, block_size).max(axis=1)
+
+    level = np.clip(np.round(np.stack([lows, highs], axis=1) * _PEAK_MAX), -_PEAK_MAX, _PEAK_MAX)
+    level = level.astype(np.int8)
+    peaks.levels.append(level)
+
+    while len(level) // level_factor >= min_level_size:
+        level = _reduce_level(level, level_factor)
+        peaks.levels.append(level)
+
+    return peaks
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_peaks_file(path, cache_path) -> WaveformPeaks:
+    """
+    Decode audio file and store its peaks, meant to be run in worker process.
+
+    :raises AudioDecodeError: if file could not be decoded
+    """
+    peaks = compute_peaks(decode_file(path))
+    try:
+        _write_atomic(cache_path, peaks.to_bytes())
+    except OSError as e:
+        logging.warning("Could not store waveform of '%s': %s", path, e)
+    return peaks
+
+
+class WaveformCache(object):
+    """
+    Waveform peaks of audio files, stored on disk in cache_dir.
+
+    Entries are keyed by path, modification time and size of the audio file,
+    so a modified file gets new peaks computed. Files are decoded in a pool
+    of worker processes which is started on first use.
+    """
+
+    def __init__(self, cache_dir, num_processes=DEFAULT_NUM_PROCESSES):
+        self.cache_dir = cache_dir
+        self.num_processes = num_processes
+
+        self._ppe = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def cache_path(self, path, st: os.stat_result):
+        key = '{}\0{}\0{}'.format(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.peaks')
+
+    def load(self, path) -> Optional[WaveformPeaks]:
+        """
+        :return: stored peaks or None if they were not computed yet
+        """
+        try:
+            cache_path = self.cache_path(path, os.stat(path))
+            with open(cache_path, 'rb') as f:
+                return WaveformPeaks.from_bytes(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def request(self, path) -> Future:
+        """
+        Get peaks of audio file, computing them in background if needed.
+
+        Returned future may be cancelled if peaks are not needed anymore.
+        It fails with AudioDecodeError or OSError if file could not be decoded.
+        """
+        try:
+            cache_path = self.cache_path(path, os.stat(path))
+        except OSError as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+
+        peaks = self.load(path)
+        if peaks is not None:
+            future = Future()
+            future.set_result(peaks)
+            return future
+
+        with self._lock:
+            future = self._pending.get(cache_path)
+            if future is not None and not future.cancelled():
+                return future
+
+            if self._ppe is None:
+                self._ppe = ProcessPoolExecutor(
+                    max_workers=self.num_processes,
+                    mp_context=multiprocessing.get_context('spawn'))
+
+            future = self._ppe.submit(build_peaks_file, path, cache_path)
+            self._pending[cache_path] = future
+
+        future.add_done_callback(lambda f: self._forget(cache_path, f))
+        return future
+
+    def _forget(self, cache_path, future):
+        with self._lock:
+            if self._pending.get(cache_path) is future:
+                del self._pending[cache_path]
+
+    def shutdown(self):
+        with self._lock:
+            ppe, self._ppe = self._ppe, None
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        if ppe is not None:
+            ppe.shutdown(wait=True)
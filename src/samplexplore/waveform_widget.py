@@ -0,0 +1,127 @@
+import logging
+
+from qtpy.QtCore import *
+from qtpy.QtGui import *
+from qtpy.QtWidgets import *
+
+from .waveform import WaveformCache, WaveformPeaks
+
+
+class WaveformWidget(QWidget):
+    """
+    Draws waveform of the current sample and playback position.
+
+    Peaks come from WaveformCache, lines are rebuilt only when peaks or
+    widget width change, so repaints do not depend on sample length.
+    """
+
+    peaksReady = Signal(str, object)
+    seekRequested = Signal(int)
+
+    def __init__(self, waveform_cache: WaveformCache, parent=None):
+        super(WaveformWidget, self).__init__(parent=parent)
+
+        self.waveform_cache = waveform_cache
+
+        self.path = None
+        self.peaks = None
+        self.position = 0
+
+        self._future = None
+        self._lines = None
+
+        self.setMinimumHeight(48)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+        self.peaksReady.connect(self.on_peaks_ready)
+
+    def sizeHint(self):
+        return QSize(400, 48)
+
+    def set_file(self, path):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+        self.path = path
+        self.position = 0
+        self.set_peaks(None)
+
+        if path is None:
+            return
+
+        future = self.waveform_cache.request(path)
+        if future.done():
+            self._on_future_done(path, future)
+        else:
+            self._future = future
+            # Called from pool thread, signal carries result over to the UI thread
+            future.add_done_callback(lambda f: self._on_future_done(path, f))
+
+    def _on_future_done(self, path, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logging.info("No waveform of '%s': %s", path, error)
+            return
+        self.peaksReady.emit(path, future.result())
+
+    def on_peaks_ready(self, path, peaks):
+        if path == self.path:
+            self._future = None
+            self.set_peaks(peaks)
+
+    def set_peaks(self, peaks: WaveformPeaks):
+        self.peaks = peaks
+        self._lines = None
+        self.update()
+
+    def set_position(self, position):
+        """
+        :param position: playback position in milliseconds
+        """
+        self.position = position
+        self.update()
+
+    def duration_ms(self):
+        return int(self.peaks.duration * 1000) if self.peaks is not None else 0
+
+    def resizeEvent(self, event):
+        self._lines = None
+        super(WaveformWidget, self).resizeEvent(event)
+
+    def _build_lines(self):
+        width = self.width()
+        height = self.height()
+        mid = height / 2
+        columns = self.peaks.columns(width)
+        return [QLineF(x, mid - high * mid, x, mid - low * mid)
+                for x, (low, high) in enumerate(columns.tolist())]
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        palette = self.palette()
+        painter.fillRect(self.rect(), palette.color(QPalette.Base))
+
+        if self.peaks is None:
+            return
+
+        if self._lines is None:
+            self._lines = self._build_lines()
+
+        painter.setPen(palette.color(QPalette.Text))
+        painter.drawLines(self._lines)
+
+        duration = self.duration_ms()
+        if duration:
+            x = int(self.position / duration * self.width())
+            painter.setPen(palette.color(QPalette.Highlight))
+            painter.drawLine(x, 0, x, self.height())
+
+    def mousePressEvent(self, event):
+        duration = self.duration_ms()
+        if event.button() == Qt.LeftButton and duration and self.width():
+            position = int(event.pos().x() / self.width() * duration)
+            self.seekRequested.emit(max(0, min(position, duration)))
+        super(WaveformWidget, self).mousePressEvent(event)
@@ -0,0 +1,54 @@
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+from samplexplore import db_core
+
+
+def write_wav(path, duration=0.5, frequency=110.0, sample_rate=44100, channels=1):
+    """
+    Write 16-bit WAV file with decaying sine, pitch tells files apart in similarity search.
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    samples = np.sin(2 * np.pi * frequency * t) * np.exp(-t * 4)
+    frames = (np.repeat(samples[:, None], channels, axis=1) * 32767).astype('<i2')
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(frames.tobytes())
+
+
+def write_aiff(path, num_frames, sample_rate=44100, channels=2, bit_depth=16):
+    # 80-bit extended sample rate, exact for integer rates
+    exponent = sample_rate.bit_length() - 1
+    rate = struct.pack('>HQ', 16383 + exponent, sample_rate << (63 - exponent))
+    comm = struct.pack('>hIh', channels, num_frames, bit_depth) + rate
+    sound = bytes(num_frames * channels * bit_depth // 8)
+    ssnd = struct.pack('>II', 0, 0) + sound
+    chunks = (b'COMM' + struct.pack('>I', len(comm)) + comm
+              + b'SSND' + struct.pack('>I', len(ssnd)) + ssnd)
+    with open(path, 'wb') as f:
+        f.write(b'FORM' + struct.pack('>I', 4 + len(chunks)) + b'AIFF' + chunks)
+
+
+@pytest.fixture
+def index_db(tmp_path, monkeypatch):
+    """
+    Empty search database in temporary directory.
+    """
+    # Configuration table is bound to the database it was first used with
+    monkeypatch.setattr(db_core, 'config', None)
+    db_core.connect(str(tmp_path / 'index.sqlite'))
+    db_core.create_tables()
+    yield tmp_path / 'index.sqlite'
+    db_core.db.close()
+
+
+@pytest.fixture
+def samples_dir(tmp_path):
+    path = tmp_path / 'samples'
+    path.mkdir()
+    return path
@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+from samplexplore.audio_metadata import AudioMetadataError, read_metadata, read_metadata_batch
+
+from .conftest import write_aiff, write_wav
+
+
+# MPEG 1 layer III, 128 kbps, 44100 Hz, stereo, no CRC
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_SIZE = 144 * 128000 // 44100
+
+
+def write_flac(path, sample_rate, channels, bit_depth, num_frames):
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bit_depth - 1) << 36) | num_frames
+    streaminfo = bytes(10) + packed.to_bytes(8, 'big') + bytes(16)
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + b'\x80' + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+
+
+def write_mp3(path, num_frames, xing_frames=None, id3_size=0):
+    data = bytearray()
+    if id3_size:
+        size = bytes((id3_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+        data += b'ID3\x03\x00\x00' + size + bytes(id3_size)
+    for i in range(num_frames):
+        frame = bytearray(MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - 4))
+        if i == 0 and xing_frames is not None:
+            # After 32 bytes of side information of stereo MPEG 1 frame
+            frame[36:48] = b'Xing' + struct.pack('>II', 1, xing_frames)
+        data += frame
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_wav(tmp_path):
+    path = tmp_path / 'a.wav'
+    write_wav(path, duration=0.5, sample_rate=48000, channels=2)
+    metadata = read_metadata(str(path))
+    assert metadata.duration == pytest.approx(0.5)
+    assert (metadata.sample_rate, metadata.channels, metadata.bit_depth) == (48000, 2, 16)
+
+
+def test_wav_extensible_valid_bits(tmp_path):
+    fmt = struct.pack('<HHIIHH', 0xFFFE, 1, 44100, 44100 * 4, 4, 32)
+    fmt += struct.pack('<HHIH', 22, 24, 0x4, 0x0001) + bytes(14)
+    data = bytes(44100 * 4)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    path = tmp_path / 'a.wav'
+    path.write_bytes(b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks)
+
+    metadata = read_metadata(str(path))
+    assert metadata.duration == pytest.approx(1.0)
+    assert metadata.bit_depth == 24
+
+
+def test_truncated_wav_duration_is_limited_by_file_size(tmp_path):
+    path = tmp_path / 'a.wav'
+    write_wav(path, duration=1.0)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    assert read_metadata(str(path)).duration == pytest.approx(0.5, abs=0.01)
+
+
+def test_aiff(tmp_path):
+    path = tmp_path / 'a.aif'
+    write_aiff(path, num_frames=22050, sample_rate=44100, channels=2, bit_depth=24)
+    metadata = read_metadata(str(path))
+    assert metadata.duration == pytest.approx(0.5)
+    assert (metadata.sample_rate, metadata.channels, metadata.bit_depth) == (44100, 2, 24)
+
+
+def test_flac(tmp_path):
+    path = tmp_path / 'a.flac'
+    write_flac(path, sample_rate=96000, channels=2, bit_depth=24, num_frames=192000)
+    metadata = read_metadata(str(path))
+    assert metadata.duration == pytest.approx(2.0)
+    assert (metadata.sample_rate, metadata.channels, metadata.bit_depth) == (96000, 2, 24)
+
+
+def test_mp3_duration_from_bitrate(tmp_path):
+    path = tmp_path / 'a.mp3'
+    write_mp3(path, num_frames=100, id3_size=100)
+    metadata = read_metadata(str(path))
+    assert metadata.duration == pytest.approx(100 * MP3_FRAME_SIZE * 8 / 128000)
+    assert (metadata.sample_rate, metadata.channels, metadata.bit_depth) == (44100, 2, None)
+
+
+def test_mp3_duration_from_xing_header(tmp_path):
+    path = tmp_path / 'a.mp3'
+    write_mp3(path, num_frames=10, xing_frames=500)
+    assert read_metadata(str(path)).duration == pytest.approx(500 * 1152 / 44100)
+
+
+def test_unrecognized(tmp_path):
+    path = tmp_path / 'a.ogg'
+    path.write_bytes(b'OggS' + bytes(100))
+    with pytest.raises(AudioMetadataError):
+        read_metadata(str(path))
+
+
+def test_damaged_header(tmp_path):
+    path = tmp_path / 'a.aif'
+    path.write_bytes(b'FORM\x00\x00\x00\x20AIFFCOMM\x00\x00\x00\x12\x00')
+    with pytest.raises(AudioMetadataError):
+        read_metadata(str(path))
+
+
+def test_batch_skips_unreadable_files(tmp_path):
+    path = tmp_path / 'a.wav'
+    write_wav(path)
+    results = read_metadata_batch([str(path), str(tmp_path / 'missing.wav')])
+    assert results[0].sample_rate == 44100
+    assert results[1] is None
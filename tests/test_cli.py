@@ -0,0 +1,50 @@
+import json
+import signal
+
+import pytest
+
+from samplexplore import cli
+
+from .conftest import write_wav
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli.db_core, 'config', None)
+    # Commands would take over Ctrl+C of the test run
+    monkeypatch.setattr(signal, 'signal', lambda signum, handler: None)
+    return str(tmp_path / 'index.sqlite')
+
+
+def run(capsys, db_path, *argv):
+    code = cli.main(['--db', db_path] + list(argv))
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    return code, records
+
+
+def test_index_of_missing_directory_keeps_index(tmp_path, samples_dir, db_path, capsys):
+    write_wav(samples_dir / 'kick.wav')
+    code, records = run(capsys, db_path, 'update', str(samples_dir))
+    assert code == 0
+    assert records[-1]['num_files'] == 1
+
+    code, records = run(capsys, db_path, 'index', str(tmp_path / 'sampels'))
+    assert code != 0
+    assert records[-1]['event'] == 'error'
+
+    code, records = run(capsys, db_path, 'update', str(tmp_path / 'sampels'))
+    assert code != 0
+    assert records[-1]['event'] == 'error'
+
+    code, records = run(capsys, db_path, 'stats')
+    assert records[-1]['num_files'] == 1
+
+
+def test_search(samples_dir, db_path, capsys):
+    write_wav(samples_dir / 'kick.wav', duration=1.0)
+    write_wav(samples_dir / 'kick_long.wav', duration=3.0)
+    run(capsys, db_path, 'update', str(samples_dir))
+
+    code, records = run(capsys, db_path, 'search', 'kick', 'dur:1s')
+    assert code == 0
+    assert [record['filename'] for record in records] == ['kick.wav']
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from samplexplore import db_core
+
+from .conftest import write_wav
+
+
+def indexed_files():
+    """
+    :return: dict of full path to (size, duration) of indexed files
+    """
+    rows = (db_core.Files
+            .select(db_core.file_full_path(), db_core.Files.size, db_core.FileMetadata.duration)
+            .join_from(db_core.Files, db_core.Directories,
+                       on=(db_core.Files.directory == db_core.Directories.id))
+            .join_from(db_core.Files, db_core.FileMetadata, db_core.JOIN.LEFT_OUTER,
+                       on=(db_core.FileMetadata.file == db_core.Files.id))
+            .tuples())
+    return {full_path: (size, duration) for full_path, size, duration in rows}
+
+
+def search(text):
+    results = db_core.search_file_paged(text)
+    try:
+        return sorted(row[1] for row in results.fetch(1000))
+    finally:
+        results.close()
+
+
+@pytest.fixture
+def library(index_db, samples_dir):
+    (samples_dir / 'drums').mkdir()
+    (samples_dir / 'drums' / 'kicks').mkdir()
+    write_wav(samples_dir / 'drums' / 'kicks' / 'kick_a.wav', duration=0.5)
+    write_wav(samples_dir / 'drums' / 'snare.wav', duration=0.25)
+    (samples_dir / 'notes.txt').write_text('not a sample')
+    assert db_core.rebuild_files_table(str(samples_dir))
+    return samples_dir
+
+
+def test_rebuild(library):
+    files = indexed_files()
+    assert sorted(files) == [
+        str(library / 'drums' / 'kicks' / 'kick_a.wav'),
+        str(library / 'drums' / 'snare.wav'),
+    ]
+    assert files[str(library / 'drums' / 'snare.wav')][1] == pytest.approx(0.25)
+    assert search('kick') == ['kick_a.wav']
+    # Directory names are searched as well
+    assert search('kicks') == ['kick_a.wav']
+
+
+def test_update_adds_and_removes_files(library):
+    write_wav(library / 'drums' / 'kicks' / 'kick_b.wav')
+    os.remove(library / 'drums' / 'snare.wav')
+    (library / 'fx').mkdir()
+    write_wav(library / 'fx' / 'riser.wav')
+
+    assert db_core.update_files_table(str(library))
+    filenames = sorted(os.path.basename(path) for path in indexed_files())
+    assert filenames == ['kick_a.wav', 'kick_b.wav', 'riser.wav']
+    assert search('kick') == ['kick_a.wav', 'kick_b.wav']
+    assert search('snare') == []
+    assert search('riser') == ['riser.wav']
+
+
+def test_update_removes_deleted_directory(library):
+    kick = library / 'drums' / 'kicks' / 'kick_a.wav'
+    os.remove(kick)
+    os.rmdir(kick.parent)
+
+    assert db_core.update_files_table(str(library))
+    assert list(indexed_files()) == [str(library / 'drums' / 'snare.wav')]
+    assert db_core.list_directory(str(kick.parent)) is None
+    assert db_core.list_directory(str(library / 'drums')).directories == []
+
+
+def test_update_reads_file_modified_in_place(library):
+    snare = library / 'drums' / 'snare.wav'
+    directory_mtime_ns = os.stat(snare.parent).st_mtime_ns
+    write_wav(snare, duration=1.0)
+    # Directory listing did not change, only the file itself
+    os.utime(snare.parent, ns=(directory_mtime_ns, directory_mtime_ns))
+
+    assert db_core.update_files_table(str(library))
+    size, duration = indexed_files()[str(snare)]
+    assert size == os.path.getsize(snare)
+    assert duration == pytest.approx(1.0)
+
+
+def test_update_without_changes_keeps_rows(library):
+    ids = {row.id for row in db_core.Files.select()}
+    assert db_core.update_files_table(str(library))
+    assert {row.id for row in db_core.Files.select()} == ids
+
+
+def test_sync_directories(library):
+    kicks = library / 'drums' / 'kicks'
+    write_wav(kicks / 'kick_b.wav', duration=0.75)
+    write_wav(library / 'drums' / 'snare_b.wav')
+
+    # Only the given directory is looked at
+    assert db_core.sync_directories(str(library), [str(kicks)])
+    files = indexed_files()
+    assert str(library / 'drums' / 'snare_b.wav') not in files
+    assert files[str(kicks / 'kick_b.wav')][1] == pytest.approx(0.75)
+    assert search('kick') == ['kick_a.wav', 'kick_b.wav']
+
+    feature_ids = {row.file_id for row in db_core.FileFeatures.select()}
+    assert db_core.file_id_of(str(kicks / 'kick_b.wav')) in feature_ids
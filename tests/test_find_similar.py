@@ -0,0 +1,63 @@
+import os
+import threading
+
+import pytest
+
+from samplexplore import db_core
+from samplexplore.similarity import FeatureMatrix
+
+from .conftest import write_wav
+
+
+@pytest.fixture
+def library(index_db, samples_dir):
+    for i in range(6):
+        write_wav(samples_dir / 'kick_{}.wav'.format(i), frequency=50 + 10 * i)
+    assert db_core.rebuild_files_table(str(samples_dir))
+    return samples_dir
+
+
+def similar_filenames(path):
+    rows = db_core.find_similar(str(path), count=10)
+    return None if rows is None else [row[1] for row in rows]
+
+
+def test_find_similar(library):
+    filenames = similar_filenames(library / 'kick_2.wav')
+    assert sorted(filenames) == ['kick_0.wav', 'kick_1.wav', 'kick_3.wav', 'kick_4.wav', 'kick_5.wav']
+    assert filenames[0] in ('kick_1.wav', 'kick_3.wav')
+
+
+def test_not_analysed_file(library):
+    (library / 'broken.wav').write_bytes(b'junk')
+    assert db_core.update_files_table(str(library))
+    assert similar_filenames(library / 'broken.wav') is None
+
+
+def test_interrupted_rebuild_does_not_use_old_matrix(library):
+    assert similar_filenames(library / 'kick_2.wav')
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert not db_core.rebuild_files_table(str(library), cancel_event=cancel_event)
+
+    # Files got new ids, which the old matrix would map to other files
+    assert similar_filenames(library / 'kick_2.wav') is None
+    assert FeatureMatrix.read_header(db_core.feature_matrix_path())[1] == 0
+
+    assert db_core.update_files_table(str(library))
+    assert len(similar_filenames(library / 'kick_2.wav')) == 5
+
+
+def test_deleted_files_are_not_found(library):
+    assert similar_filenames(library / 'kick_2.wav')
+
+    os.remove(library / 'kick_1.wav')
+    os.remove(library / 'kick_3.wav')
+    write_wav(library / 'snare.wav', frequency=400)
+    assert db_core.sync_directories(str(library), [str(library)])
+
+    filenames = similar_filenames(library / 'kick_2.wav')
+    assert sorted(filenames) == ['kick_0.wav', 'kick_4.wav', 'kick_5.wav', 'snare.wav']
+    header = FeatureMatrix.read_header(db_core.feature_matrix_path())
+    assert header[2] == db_core.get_config()[db_core.FEATURES_GENERATION_KEY]
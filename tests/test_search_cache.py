@@ -0,0 +1,84 @@
+import os
+
+from samplexplore.db_core import SearchCache
+from samplexplore.search_query import parse_query
+
+
+ROWS = [
+    (1, 'kick_hard.wav', os.path.join(os.sep, 'lib', 'drums', 'kick_hard.wav'), 'drums'),
+    (2, 'kick_soft.wav', os.path.join(os.sep, 'lib', 'drums', 'kick_soft.wav'), 'drums'),
+    (3, 'kick.wav', os.path.join(os.sep, 'lib', 'kick.wav'), ''),
+]
+
+
+def query(text, directory=None):
+    q = parse_query(text)
+    q.directory = directory
+    return q
+
+
+def test_exact_hit():
+    cache = SearchCache()
+    cache.put(query('kick'), ROWS, cache.generation)
+    assert cache.get(query('KICK')) is ROWS
+    assert cache.get(query('snare')) is None
+
+
+def test_narrows_unranked():
+    cache = SearchCache()
+    cache.put(query('ki'), ROWS, cache.generation)
+    assert cache.get(query('ki ha')) == [ROWS[0]]
+
+
+def test_does_not_narrow_ranked():
+    # Rows of "kick" are in bm25 order of "kick", not of "kick_h"
+    cache = SearchCache()
+    cache.put(query('kick'), ROWS, cache.generation)
+    assert cache.get(query('kick_h')) is None
+
+
+def test_narrows_ranked_to_subdirectory():
+    cache = SearchCache()
+    cache.put(query('kick'), ROWS, cache.generation)
+    assert cache.get(query('kick', os.path.join(os.sep, 'lib', 'drums'))) == ROWS[:2]
+
+
+def test_different_filters_are_not_narrowed():
+    cache = SearchCache()
+    cache.put(query('ki'), ROWS, cache.generation)
+    assert cache.get(query('ki dur:<1')) is None
+    assert cache.get(query('ki ext:wav')) is None
+
+
+def test_narrowed_result_is_cached():
+    cache = SearchCache()
+    cache.put(query('ki'), ROWS, cache.generation)
+    rows = cache.get(query('ki so'))
+    assert cache.get(query('ki so')) is rows
+
+
+def test_invalidate():
+    cache = SearchCache()
+    cache.put(query('kick'), ROWS, cache.generation)
+    cache.invalidate()
+    assert cache.get(query('kick')) is None
+
+
+def test_results_of_older_generation_are_not_stored():
+    cache = SearchCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.put(query('kick'), ROWS, generation)
+    assert cache.get(query('kick')) is None
+
+
+def test_limits():
+    cache = SearchCache(max_rows=4, max_result_rows=3)
+    cache.put(query('four'), ROWS + ROWS[:1], cache.generation)
+    assert cache.get(query('four')) is None
+
+    cache.put(query('kick'), ROWS, cache.generation)
+    cache.put(query('drums'), ROWS[:2], cache.generation)
+    # Least recently used entry is evicted
+    assert cache.get(query('kick')) is None
+    assert cache.get(query('drums')) == ROWS[:2]
@@ -0,0 +1,66 @@
+import pytest
+
+from samplexplore.search_query import SearchQueryError, parse_query
+
+
+def test_words_are_terms():
+    query = parse_query('kick  hard')
+    assert query.terms == ['kick', 'hard']
+    assert query.filters == []
+    assert not query.is_empty
+
+
+def test_empty_query():
+    assert parse_query('  ').is_empty
+
+
+def test_unknown_filter_is_term():
+    assert parse_query('foo:bar').terms == ['foo:bar']
+
+
+def test_duration_units():
+    assert parse_query('dur:<500ms').filters == [('duration', '<', 0.5)]
+    assert parse_query('len:>=2s').filters == [('duration', '>=', 2.0)]
+    assert parse_query('duration:<=1.5').filters == [('duration', '<=', 1.5)]
+
+
+def test_bare_duration_is_tolerance_band():
+    (name, low_op, low), (_, high_op, high) = parse_query('dur:1s').filters
+    assert name == 'duration'
+    assert (low_op, high_op) == ('>=', '<=')
+    assert low == pytest.approx(0.95)
+    assert high == pytest.approx(1.05)
+
+
+def test_explicit_equality_is_exact():
+    assert parse_query('dur:=1s').filters == [('duration', '=', 1.0)]
+
+
+def test_range():
+    assert parse_query('dur:100ms..1s').filters == [('duration', '>=', 0.1), ('duration', '<=', 1.0)]
+    assert parse_query('dur:..1').filters == [('duration', '<=', 1.0)]
+
+
+@pytest.mark.parametrize('text, rate', [
+    ('sr:44100', 44100),
+    ('sr:44.1k', 44100),
+    ('rate:48khz', 48000),
+    ('sr:96', 96000),
+    ('sr:22050hz', 22050),
+])
+def test_sample_rate(text, rate):
+    assert parse_query(text).filters == [('sample_rate', '=', rate)]
+
+
+def test_channels_and_bit_depth():
+    query = parse_query('ch:mono bits:>=24 channels:2')
+    assert query.filters == [('channels', '=', 1), ('bit_depth', '>=', 24), ('channels', '=', 2)]
+
+
+def test_extensions():
+    assert parse_query('ext:WAV,.aif ext:flac').extensions == ['wav', 'aif', 'flac']
+
+
+def test_invalid_value():
+    with pytest.raises(SearchQueryError):
+        parse_query('dur:<long')
@@ -0,0 +1,42 @@
+"""
+Measure start latency of the preview engine without audio device.
+
+Usage: python tools/preview_latency.py [--wav OUT.wav] FILE...
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from samplexplore.audio_decode import AudioDecodeError, decode_file
+from samplexplore.preview_engine import NullBackend, WavFileBackend, benchmark_latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure preview start latency')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--wav', help='write rendered output to this file')
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='seconds between starting subsequent files')
+    args = parser.parse_args()
+
+    audios = []
+    for path in args.files:
+        try:
+            audios.append(decode_file(path))
+        except (OSError, AudioDecodeError) as e:
+            print('Skipping {}: {}'.format(path, e), file=sys.stderr)
+
+    backend = WavFileBackend(args.wav) if args.wav else NullBackend()
+    result = benchmark_latency(audios, backend, interval=args.interval)
+    if not result:
+        print('Nothing was played')
+        return
+
+    print('{count} starts, latency mean {mean:.2f} ms, median {median:.2f} ms, max {max:.2f} ms'.format(
+        count=result['count'], **{k: result[k] * 1000 for k in ('mean', 'median', 'max')}))
+
+
+if __name__ == '__main__':
+    main()